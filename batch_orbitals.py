@@ -0,0 +1,389 @@
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+from typing import Callable, List, NamedTuple, Optional
+
+from cube_pyramid import preview_cube
+from cube_stats import analyse_cubes
+from grid_sizing import DEFAULT_GRID, grid_parameters, grid_preset, plan_xyz_grid
+from isosurface_mesh import export_orbital_meshes
+from instrumentation import RUN_LOG, RUN_LOG_PREFIX
+from isovalue import orbital_isovalues
+from modules import available_cores, input_waveplot_batch, read_elements, run_dftb, write_dftb_input
+from movie import MovieSettings
+from offscreen_renderer import render_orbitals_offscreen
+from orbital_engine import COMPACT_SUPPORT, DENSITY_WEIGHTINGS, write_density_cube, write_orbital_cubes
+from orbital_selection import check_selection, select_orbitals
+from process_runner import describe
+from parallel_waveplot import input_waveplot_parallel
+from render_pool import RenderJob, render_orbitals_parallel
+from result_cache import DFTB_RESULT_FILES, ResultCache, cube_cache_key, dftb_cache_key
+
+# Programs for the cube files, named like the choices of engine_choice
+CUBE_ENGINES = ('waveplot', 'numpy', 'parallel')
+
+# Programs for the images and movies (headless VMD processes or the built-in renderer)
+RENDERERS = ('vmd', 'builtin')
+
+# Files of the DFTB+ and waveplot runs removed once the cube files are written
+INTERMEDIATE_FILES = ['dftb_pin.hsd', 'detailed.out', 'detailed.xml', 'eigenvec.bin', 'charges.bin', 'waveplot_pin.hsd',
+                      'waveplot_in.hsd', 'waveplot.out', 'band.out']
+
+class BatchSpec(NamedTuple):
+    """Job specification of a batch run over many molecules."""
+    molecules: List[str]
+    orbitals: List[str]
+    engine: str
+    background_color: str
+    molecule_style: str
+    movie_maker: str
+    movie_settings: MovieSettings
+    enclosed_fraction: Optional[float]
+    render: bool
+    output_directory: str
+    queue_size: int
+    render_workers: int
+    preview_level: int
+    mesh_format: str
+    renderer: str
+    density: str
+    grid: str
+    compact: bool
+    validate: bool
+
+class MoleculeJob(NamedTuple):
+    """State of one molecule passed from stage to stage of the pipeline."""
+    name: str
+    molecule_xyz: str
+    directory: str
+    elements: List[str]
+    cube_files: List[str]
+    output_files: List[str]
+    error: str
+
+def read_batch_spec(spec_file: str) -> BatchSpec:
+    """Reads the job specification of a batch run from a JSON file.
+
+    Example:
+        {"molecules": ["molecules/*.xyz"], "orbitals": [12, 13], "engine": "numpy",
+         "background_color": "1", "molecule_style": "3", "movie": false, "preview_level": 20, "grid": "preview",
+         "compact": true, "validate": true, "output_directory": "batch"}
+
+    Molecules are paths or glob patterns relative to the specification file. Orbitals are level numbers or selections
+    such as "HOMO-2:LUMO+2" or "E in [-8, -2] eV", resolved for every molecule. Only "molecules" and "orbitals" are
+    required; the other keys default to the standard choices of generate_orbitals.py.
+
+    Args:
+        spec_file (str): JSON file with the job specification
+
+    Returns:
+        BatchSpec: Job specification with absolute paths
+    """
+    with open(spec_file, 'r') as file:
+        spec = json.load(file)
+    base_directory = os.path.dirname(os.path.abspath(spec_file))
+
+    molecules = []
+    for pattern in spec['molecules']:
+        matches = sorted(glob.glob(os.path.join(base_directory, pattern)))
+        if not matches:
+            raise ValueError(f"No molecule file matches {pattern}.")
+        molecules += [match for match in matches if match not in molecules]
+    if isinstance(spec['orbitals'], str):
+        spec['orbitals'] = [spec['orbitals']]
+    if not spec['orbitals']:
+        raise ValueError("No orbitals specified.")
+    check_selection(', '.join(str(orbital) for orbital in spec['orbitals']))
+
+    if spec.get('mesh_format', '') not in ('', 'ply', 'glb'):
+        raise ValueError(f"Unknown mesh format {spec['mesh_format']}, choose ply or glb.")
+    engine = spec.get('engine', 'waveplot')
+    if engine not in CUBE_ENGINES:
+        raise ValueError(f"Unknown engine {engine}, choose one of {', '.join(CUBE_ENGINES)}.")
+    renderer = spec.get('renderer', 'vmd')
+    if renderer not in RENDERERS:
+        raise ValueError(f"Unknown renderer {renderer}, choose one of {', '.join(RENDERERS)}.")
+    density = spec.get('density', '')
+    if density not in ('',) + DENSITY_WEIGHTINGS:
+        raise ValueError(f"Unknown density {density}, choose one of {', '.join(DENSITY_WEIGHTINGS)}.")
+    grid = str(spec.get('grid', DEFAULT_GRID))
+    # Raises ValueError for unknown presets and invalid spacings
+    grid_preset(grid)
+    movie_maker = 'yes' if spec.get('movie', False) else 'no'
+    movie_settings = MovieSettings(format=spec.get('movie_format', 'gif'), n_frames=int(spec.get('n_frames', 36)))
+    enclosed_fraction = spec.get('isovalue_fraction')
+
+    return BatchSpec(molecules, [str(orbital) for orbital in spec['orbitals']], engine,
+                     str(spec.get('background_color', '1')), str(spec.get('molecule_style', '1')), movie_maker, movie_settings,
+                     float(enclosed_fraction) if enclosed_fraction is not None else None, bool(spec.get('render', True)),
+                     os.path.join(base_directory, spec.get('output_directory', 'batch_output')),
+                     int(spec.get('queue_size', 2)), int(spec.get('render_workers', 0)), int(spec.get('preview_level', 0)),
+                     spec.get('mesh_format', ''), renderer, density, grid, bool(spec.get('compact', COMPACT_SUPPORT)),
+                     bool(spec.get('validate', True)))
+
+def dftb_stage(job: MoleculeJob, spec: BatchSpec, cache: ResultCache, cache_lock: threading.Lock) -> MoleculeJob:
+    """Runs DFTB+ for one molecule in its own directory, or takes the results from the cache.
+
+    Args:
+        job (MoleculeJob): Molecule to be calculated
+        spec (BatchSpec): Job specification
+        cache (ResultCache): Cache of DFTB+ results and cube files
+        cache_lock (threading.Lock): Lock serializing the access of the stages to the cache
+
+    Returns:
+        MoleculeJob: Molecule with the DFTB+ results in its directory
+    """
+    dftb_key = dftb_cache_key(job.molecule_xyz, job.elements)
+    with cache_lock:
+        cached = cache.fetch(dftb_key, DFTB_RESULT_FILES, job.directory)
+    if cached:
+        # waveplot includes dftb_in.hsd, which has to point to the xyz file of this molecule
+        write_dftb_input(job.molecule_xyz, job.elements, job.directory)
+        print(f"{job.name}: DFTB+ results taken from the cache.")
+        return job
+
+    result = run_dftb(job.molecule_xyz, job.elements, job.directory)
+    if result.status != 'finished':
+        return job._replace(error=describe(result))
+    if not all(os.path.isfile(os.path.join(job.directory, file)) for file in DFTB_RESULT_FILES):
+        return job._replace(error=f"DFTB+ calculation failed (see {job.directory}/dftb.out)")
+    with cache_lock:
+        cache.store(dftb_key, DFTB_RESULT_FILES, job.directory)
+    print(f"{job.name}: DFTB+ calculation has finished.")
+    return job
+
+def cube_stage(job: MoleculeJob, spec: BatchSpec, cache: ResultCache, cache_lock: threading.Lock) -> MoleculeJob:
+    """Calculates the cube files of one molecule and removes the intermediate files of DFTB+ and waveplot.
+
+    Args:
+        job (MoleculeJob): Molecule with the DFTB+ results in its directory
+        spec (BatchSpec): Job specification
+        cache (ResultCache): Cache of DFTB+ results and cube files
+        cache_lock (threading.Lock): Lock serializing the access of the stages to the cache
+
+    Returns:
+        MoleculeJob: Molecule with the cube files which have been written
+    """
+    dftb_key = dftb_cache_key(job.molecule_xyz, job.elements)
+    # Compact support grids are written by the NumPy and parallel waveplot engines
+    compact = spec.compact and spec.engine in ('numpy', 'parallel')
+    cube_engine = ('numpy' if spec.engine == 'numpy' else 'waveplot') + (' compact' if compact else '')
+    # HOMO, LUMO and energy windows differ between the molecules
+    selection = ', '.join(spec.orbitals)
+    orbitals = select_orbitals(selection, job.directory)
+    # The grid spacing is the same for all molecules, the number of points follows their size
+    n_points, region = grid_parameters(plan_xyz_grid(job.molecule_xyz, spec.grid))
+    if spec.density:
+        # One density cube file accumulated in memory instead of one cube file per orbital, the selection is resolved
+        # for every spin channel
+        try:
+            cube_files = [write_density_cube(selection, spec.density, directory=job.directory, n_points=n_points, region=region)]
+        except ValueError as error:
+            return job._replace(error=str(error))
+        orbitals = []
+    else:
+        cube_files = []
+    with cache_lock:
+        for orbital in orbitals:
+            cube_file = f"wp-1-1-{orbital}-real.cube"
+            if cache.fetch(cube_cache_key(dftb_key, orbital, cube_engine, n_points, region), [cube_file], job.directory):
+                cube_files.append(cube_file)
+    remaining_orbitals = [orbital for orbital in orbitals if f"wp-1-1-{orbital}-real.cube" not in cube_files]
+
+    if remaining_orbitals:
+        if spec.engine == 'numpy':
+            new_cube_files = write_orbital_cubes(remaining_orbitals, os.path.join(job.directory, 'detailed.xml'),
+                                                 os.path.join(job.directory, 'eigenvec.bin'), n_points, region, compact)
+        elif spec.engine == 'parallel':
+            new_cube_files = input_waveplot_parallel(remaining_orbitals, n_points=n_points, directory=job.directory, region=region,
+                                                     compact=compact)
+        else:
+            new_cube_files = input_waveplot_batch(remaining_orbitals, job.directory, n_points, region)
+        with cache_lock:
+            for orbital in remaining_orbitals:
+                cube_file = f"wp-1-1-{orbital}-real.cube"
+                if cube_file in new_cube_files:
+                    cache.store(cube_cache_key(dftb_key, orbital, cube_engine, n_points, region), [cube_file], job.directory)
+        cube_files += new_cube_files
+
+    for file in INTERMEDIATE_FILES:
+        if os.path.exists(os.path.join(job.directory, file)):
+            os.remove(os.path.join(job.directory, file))
+
+    print(f"{job.name}: cube files written: {' '.join(cube_files)}")
+    if not cube_files:
+        return job._replace(error="No cube file was written")
+    return job._replace(cube_files=cube_files)
+
+def validation_stage(job: MoleculeJob) -> MoleculeJob:
+    """Checks the cube files of one molecule (see cube_stats.py), so that no meshes or images are made from bad data.
+
+    The statistics are written to cube_statistics.json in the directory of the molecule. Broken cube files (truncated,
+    not finite or all zero) are not passed on to the next stages, the warnings about the box and the grid are printed.
+
+    Args:
+        job (MoleculeJob): Molecule with its cube files
+
+    Returns:
+        MoleculeJob: Molecule with the cube files which passed the checks
+    """
+    statistics = analyse_cubes([os.path.join(job.directory, cube_file) for cube_file in job.cube_files])
+    with open(os.path.join(job.directory, 'cube_statistics.json'), 'w') as file:
+        json.dump([cube._asdict() for cube in statistics], file, indent=1)
+    good_cube_files = []
+    for cube_file, cube in zip(job.cube_files, statistics):
+        if cube.problems:
+            print(f"{job.name}: {cube_file} skipped: {'; '.join(cube.problems)}")
+            continue
+        if cube.warnings:
+            print(f"{job.name}: Warning: {cube_file}: {'; '.join(cube.warnings)}")
+        good_cube_files.append(cube_file)
+    job = job._replace(cube_files=good_cube_files)
+    if not good_cube_files:
+        return job._replace(error="No cube file passed the checks (see cube_statistics.json)")
+    return job
+
+def mesh_stage(job: MoleculeJob, spec: BatchSpec) -> MoleculeJob:
+    """Exports the isosurfaces of the orbitals of one molecule with atoms and bonds as PLY or glTF files (no VMD needed).
+
+    Args:
+        job (MoleculeJob): Molecule with its cube files
+        spec (BatchSpec): Job specification
+
+    Returns:
+        MoleculeJob: Molecule with the mesh files added to its output files
+    """
+    cube_paths = [os.path.join(job.directory, cube_file) for cube_file in job.cube_files]
+    mesh_files = export_orbital_meshes(cube_paths, orbital_isovalues(cube_paths, spec.enclosed_fraction), spec.mesh_format)
+    return job._replace(output_files=job.output_files + [os.path.basename(mesh_file) for mesh_file in mesh_files])
+
+def render_stage(job: MoleculeJob, spec: BatchSpec, render_workers: int) -> MoleculeJob:
+    """Renders the orbitals of one molecule with headless VMD processes or the built-in renderer.
+
+    Args:
+        job (MoleculeJob): Molecule with its cube files
+        spec (BatchSpec): Job specification
+        render_workers (int): Number of concurrent VMD processes (processes for the rotation frames of the built-in renderer)
+
+    Returns:
+        MoleculeJob: Molecule with the images and movies which have been written
+    """
+    cube_paths = [os.path.join(job.directory, cube_file) for cube_file in job.cube_files]
+    isovalues = orbital_isovalues(cube_paths, spec.enclosed_fraction)
+    # Thumbnails are rendered from a coarse level of the cube files
+    if spec.renderer == 'builtin':
+        output_files = render_orbitals_offscreen([preview_cube(cube_path, spec.preview_level) for cube_path in cube_paths], spec.background_color,
+                                                 spec.molecule_style, spec.movie_maker, spec.movie_settings, isovalues, render_workers, job.directory)
+        return job._replace(output_files=job.output_files + [os.path.basename(file) for file in output_files])
+    render_jobs = [RenderJob(job.molecule_xyz, preview_cube(cube_path, spec.preview_level), spec.background_color, spec.molecule_style,
+                             spec.movie_maker, spec.movie_settings, isovalue) for cube_path, isovalue in zip(cube_paths, isovalues)]
+    results = render_orbitals_parallel(render_jobs, render_workers, job.directory)
+    output_files = [file for result in results for file in result.output_files]
+    errors = [f"{os.path.basename(result.orbital_file)}: {result.error}" for result in results if result.error]
+    return job._replace(output_files=job.output_files + output_files, error='; '.join(errors))
+
+def run_stage(name: str, stage: Callable[[MoleculeJob], MoleculeJob], input_queue: queue.Queue, output_queue: queue.Queue) -> None:
+    """Takes jobs from a queue, processes them and hands them to the next stage, until the end marker (None) arrives.
+
+    Jobs which failed in an earlier stage are passed on unchanged. The output queue is bounded, so a fast stage
+    waits for the next one instead of piling up intermediate files.
+
+    Args:
+        name (str): Name of the stage in the run log
+        stage (Callable[[MoleculeJob], MoleculeJob]): Work done on every job
+        input_queue (queue.Queue): Jobs of the previous stage
+        output_queue (queue.Queue): Jobs for the next stage
+
+    Returns:
+        None: Runs until the end marker has been passed on
+    """
+    while True:
+        job = input_queue.get()
+        if job is None:
+            output_queue.put(None)
+            return
+        if not job.error:
+            try:
+                with RUN_LOG.stage(name, job.name):
+                    job = stage(job)
+            except Exception as error:
+                job = job._replace(error=f"{type(error).__name__}: {error}")
+        output_queue.put(job)
+
+def run_batch(spec: BatchSpec) -> List[MoleculeJob]:
+    """Runs DFTB+, the cube generation and the rendering for all molecules as a pipeline.
+
+    Every stage runs in its own thread, connected by bounded queues, so DFTB+ for molecule N+1 runs while the
+    cube files of molecule N are calculated and molecule N-1 is rendered. Every molecule works in its own
+    directory <output_directory>/<name>, where its cube files, images and movies are kept.
+
+    Args:
+        spec (BatchSpec): Job specification
+
+    Returns:
+        List[MoleculeJob]: One job per molecule, in the order they finished
+    """
+    cache = ResultCache()
+    cache_lock = threading.Lock()
+    render_workers = spec.render_workers if spec.render_workers > 0 else max(1, available_cores() // 2)
+
+    stages = [('dftb', lambda job: dftb_stage(job, spec, cache, cache_lock)),
+              ('cube files', lambda job: cube_stage(job, spec, cache, cache_lock))]
+    if spec.validate:
+        stages.append(('validation', validation_stage))
+    if spec.mesh_format:
+        stages.append(('meshes', lambda job: mesh_stage(job, spec)))
+    if spec.render:
+        stages.append(('rendering', lambda job: render_stage(job, spec, render_workers)))
+
+    # The first queue holds all molecules, the queues between the stages are bounded
+    queues = [queue.Queue()] + [queue.Queue(maxsize=spec.queue_size) for _ in stages[:-1]] + [queue.Queue()]
+    threads = [threading.Thread(target=run_stage, args=(name, stage, queues[i], queues[i + 1]), daemon=True)
+               for i, (name, stage) in enumerate(stages)]
+    for thread in threads:
+        thread.start()
+
+    names = set()
+    for molecule_xyz in spec.molecules:
+        name = os.path.splitext(os.path.basename(molecule_xyz))[0]
+        # Molecules with the same file name in different directories get different output directories
+        while name in names:
+            name += '_'
+        names.add(name)
+        directory = os.path.join(spec.output_directory, name)
+        os.makedirs(directory, exist_ok=True)
+        queues[0].put(MoleculeJob(name, molecule_xyz, directory, read_elements(molecule_xyz), [], [], ''))
+    queues[0].put(None)
+
+    finished = []
+    while True:
+        job = queues[-1].get()
+        if job is None:
+            break
+        if job.error:
+            print(f"{job.name} failed: {job.error}")
+        else:
+            print(f"{job.name} finished: {' '.join(job.output_files or job.cube_files)}")
+        finished.append(job)
+    for thread in threads:
+        thread.join()
+    return finished
+
+if __name__ == '__main__':
+
+    # Check, if enough elements are present
+    if len(sys.argv) != 2:
+        print(f"Usage: python3 {sys.argv[0]} JobSpecification.json")
+        exit()
+
+    batch_spec = read_batch_spec(sys.argv[1])
+    print(f"Starting batch run over {len(batch_spec.molecules)} molecules, results in {batch_spec.output_directory}.")
+    jobs = run_batch(batch_spec)
+    failed_jobs = [job for job in jobs if job.error]
+    print(f"{len(jobs) - len(failed_jobs)} of {len(jobs)} molecules finished without errors.")
+    if failed_jobs:
+        print(f"Failed: {' '.join(job.name for job in failed_jobs)}")
+    RUN_LOG.finish(os.path.join(batch_spec.output_directory, RUN_LOG_PREFIX) if RUN_LOG_PREFIX else '')
@@ -0,0 +1,536 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from cube_io import convert_cube_to_binary, load_cube, read_cube
+from isosurface_mesh import BOHR_TO_ANGSTROM, orbital_meshes
+from isovalue import enclosed_density_isovalue
+from modules import MAX_ANGULAR_MOMENTUM, available_cores, dftb_input, read_elements, run_dftb, waveplot_input
+from movie import GifWriter, MovieSettings
+from offscreen_renderer import build_scene, render_image, rotation_matrices
+from orbital_engine import parse_basis, write_orbital_cubes
+from orbital_selection import homo_level, read_occupations
+from xyz_io import XyzTrajectory
+
+# DFTB+ binary called by run_dftb, a stand-in writes synthetic eigenvectors if it is missing
+DFTB_BINARY = '/usr/local/bin/dftb+'
+
+# Elements DFTB+ can be run with (MAX_ANGULAR_MOMENTUM) and the cube files can be calculated for (embedded basis)
+SUPPORTED_ELEMENTS = sorted(set(MAX_ANGULAR_MOMENTUM) & set(parse_basis()))
+
+# Stages timed for every molecule and grid, in the order of the pipeline
+STAGES = ('xyz_parsing', 'input_generation', 'dftb', 'cube_generation', 'cube_read_text', 'cube_write_binary',
+          'cube_read_binary', 'isovalue', 'isosurface', 'render', 'gif_encoding')
+
+# Idealized bond lengths (Angstrom) of the synthetic molecules
+CC_BOND, CC_AROMATIC, CH_BOND, XH_BOND = 1.54, 1.40, 1.09, 1.01
+HETEROATOM_BONDS = {'N': 1.47, 'O': 1.43, 'S': 1.82}
+# Hydrogens kept by a heteroatom replacing a CH2 group of an alkane or bound to an aromatic carbon
+HETEROATOM_HYDROGENS = {'N': 1, 'O': 0, 'S': 0}
+
+class BenchmarkSettings(NamedTuple):
+    """Sizes and sweeps of a benchmark run."""
+    alkane_sizes: Tuple[int, ...] = (2, 4, 8, 16, 32)
+    acene_sizes: Tuple[int, ...] = (1, 2, 3, 4, 6)
+    variants: Tuple[str, ...] = ('', 'N', 'O', 'S')
+    grid_sizes: Tuple[int, ...] = (32, 48, 64, 80)
+    orbital_counts: Tuple[int, ...] = (1, 4, 16)
+    n_frames: int = 8
+    repeats: int = 3
+
+# Small sweep for a quick check of the benchmark itself
+QUICK_SETTINGS = BenchmarkSettings((2, 4, 8), (1, 2), ('', 'S'), (24, 32, 48), (1, 4), 4, 1)
+
+class Molecule(NamedTuple):
+    """Synthetic molecule of the benchmark."""
+    name: str
+    family: str
+    variant: str
+    species: List[str]
+    coordinates: np.ndarray
+
+class BenchmarkResult(NamedTuple):
+    """Best time of one stage for one molecule, grid and number of orbitals."""
+    stage: str
+    molecule: str
+    family: str
+    variant: str
+    atoms: int
+    grid_points: int
+    orbitals: int
+    seconds: float
+
+def alkane_chain(n_carbons: int, heteroatom: str = '') -> Molecule:
+    """Builds a linear alkane in all-trans zigzag geometry.
+
+    With a heteroatom every fourth CH2 group of the chain (starting with the third atom) is replaced by NH, O or S.
+
+    Args:
+        n_carbons (int): Number of atoms of the chain
+        heteroatom (str): N, O, S or empty for the plain alkane
+
+    Returns:
+        Molecule: Species and coordinates (Angstrom)
+    """
+    step_x, step_y = CC_BOND * np.cos(np.radians(35.25)), CC_BOND * np.sin(np.radians(35.25)) / 2.0
+    species, coordinates = [], []
+    for i in range(n_carbons):
+        side = 1.0 if i % 2 else -1.0
+        atom = np.array([i * step_x, side * step_y, 0.0])
+        element = heteroatom if heteroatom and 0 < i < n_carbons - 1 and i % 4 == 2 else 'C'
+        species.append(element)
+        coordinates.append(atom)
+        if element == 'C':
+            hydrogens = [atom + [0.0, side * 0.63, 0.89], atom + [0.0, side * 0.63, -0.89]]
+            if i == 0:
+                hydrogens.append(atom + [-1.03, -side * 0.36, 0.0])
+            if i == n_carbons - 1:
+                hydrogens.append(atom + [1.03, -side * 0.36, 0.0])
+        else:
+            hydrogens = [atom + [0.0, side * XH_BOND, 0.0]] * HETEROATOM_HYDROGENS[element]
+        species += ['H'] * len(hydrogens)
+        coordinates += hydrogens
+    return Molecule(f"alkane_{n_carbons}{'_' + heteroatom if heteroatom else ''}", 'alkane', heteroatom, species, np.array(coordinates))
+
+def polyacene(n_rings: int, heteroatom: str = '') -> Molecule:
+    """Builds a linear polyacene (benzene, naphthalene, anthracene, ...).
+
+    With a heteroatom the first and the last hydrogen along the chain are replaced by NH2, OH or SH groups.
+
+    Args:
+        n_rings (int): Number of fused rings
+        heteroatom (str): N, O, S or empty for the plain polyacene
+
+    Returns:
+        Molecule: Species and coordinates (Angstrom)
+    """
+    ring_distance = CC_AROMATIC * np.sqrt(3.0)
+    angles = np.radians(30.0 + 60.0 * np.arange(6))
+    hexagon = CC_AROMATIC * np.column_stack([np.cos(angles), np.sin(angles), np.zeros(6)])
+    carbons = np.concatenate([hexagon + [ring * ring_distance, 0.0, 0.0] for ring in range(n_rings)])
+    carbons = carbons[np.unique(np.round(carbons, 3), axis=0, return_index=True)[1]]
+
+    # Carbons with two carbon neighbors carry a hydrogen, pointing away from their neighbors
+    distances = np.linalg.norm(carbons[:, None] - carbons[None], axis=2)
+    neighbors = (distances > 0.1) & (distances < 1.1 * CC_AROMATIC)
+    species, coordinates, substituent_sites = ['C'] * len(carbons), list(carbons), []
+    for atom, bonded in zip(carbons, neighbors):
+        if bonded.sum() == 2:
+            direction = atom - carbons[bonded].mean(axis=0)
+            substituent_sites.append((atom, direction / np.linalg.norm(direction)))
+    if heteroatom:
+        ends = [min(range(len(substituent_sites)), key=lambda site: substituent_sites[site][0][0]),
+                max(range(len(substituent_sites)), key=lambda site: substituent_sites[site][0][0])]
+    else:
+        ends = []
+    for site, (atom, direction) in enumerate(substituent_sites):
+        if site not in ends:
+            species.append('H')
+            coordinates.append(atom + CH_BOND * direction)
+            continue
+        group = atom + HETEROATOM_BONDS[heteroatom] * direction
+        species.append(heteroatom)
+        coordinates.append(group)
+        for side in (1.0, -1.0)[:HETEROATOM_HYDROGENS[heteroatom] + 1]:
+            hydrogen = direction + [0.0, 0.0, side]
+            species.append('H')
+            coordinates.append(group + XH_BOND * hydrogen / np.linalg.norm(hydrogen))
+    return Molecule(f"acene_{n_rings}{'_' + heteroatom if heteroatom else ''}", 'acene', heteroatom, species, np.array(coordinates))
+
+# Generators of the molecule families, called with the size and the heteroatom variant
+MOLECULE_FAMILIES: Dict[str, Callable[[int, str], Molecule]] = {'alkane': alkane_chain, 'acene': polyacene}
+
+def write_molecule_xyz(molecule: Molecule, xyz_file: str) -> None:
+    """Writes a synthetic molecule as xyz file.
+
+    Args:
+        molecule (Molecule): Species and coordinates (Angstrom)
+        xyz_file (str): Name of the xyz file
+
+    Returns:
+        None: Writes the xyz file
+    """
+    with open(xyz_file, 'w') as file:
+        file.write(f"{len(molecule.species)}\n{molecule.name}\n")
+        for element, (x, y, z) in zip(molecule.species, molecule.coordinates):
+            file.write(f"{element:2s} {x:14.8f} {y:14.8f} {z:14.8f}\n")
+
+def stand_in_dftb(molecule_xyz: str, directory: str) -> None:
+    """Writes detailed.xml and eigenvec.bin with random, normalized eigenvectors instead of running DFTB+.
+
+    The number of orbitals and electrons follows from the embedded basis, so the files can be used by
+    orbital_engine.py like the ones of a real DFTB+ run.
+
+    Args:
+        molecule_xyz (str): xyz file of the molecule (relative to the directory)
+        directory (str): Directory of the calculation
+
+    Returns:
+        None: Writes detailed.xml and eigenvec.bin
+    """
+    basis = parse_basis()
+    with XyzTrajectory(os.path.join(directory, molecule_xyz)) as trajectory:
+        frame = trajectory.frame(0)
+    type_names = list(dict.fromkeys(str(element) for element in frame.species))
+    number_orbitals, number_electrons = 0, 0.0
+    for element in frame.species:
+        max_angular_momentum = 'spdf'.index(MAX_ANGULAR_MOMENTUM.get(str(element), 'f'))
+        shells = [orbital for orbital in basis[str(element)].orbitals if orbital.angular_momentum <= max_angular_momentum]
+        number_orbitals += sum(2 * shell.angular_momentum + 1 for shell in shells)
+        number_electrons += sum(shell.occupation for shell in shells)
+    occupations = np.zeros(number_orbitals)
+    occupations[:int(round(number_electrons)) // 2] = 2.0
+
+    types = [type_names.index(str(element)) + 1 for element in frame.species]
+    rows = "\n".join(f"{species} {x:.10f} {y:.10f} {z:.10f}" for species, (x, y, z) in zip(types, frame.coordinates / BOHR_TO_ANGSTROM))
+    with open(os.path.join(directory, 'detailed.xml'), 'w') as file:
+        file.write(f"""<?xml version="1.0" encoding="UTF-8"?>
+<detailedout>
+<identity>0</identity>
+<geometry>
+<typenames>{' '.join(f'"{name}"' for name in type_names)}</typenames>
+<typesandcoordinates>
+{rows}
+</typesandcoordinates>
+<periodic>No</periodic>
+</geometry>
+<real>Yes</real>
+<nrofkpoints>1</nrofkpoints>
+<nrofspins>1</nrofspins>
+<nrofstates>{number_orbitals}</nrofstates>
+<nroforbitals>{number_orbitals}</nroforbitals>
+<kpointsandweights>0.0 0.0 0.0 1.0</kpointsandweights>
+<occupations>
+<spin1>
+<k1>{' '.join(f'{occupation:.1f}' for occupation in occupations)}</k1>
+</spin1>
+</occupations>
+</detailedout>
+""")
+    eigenvectors = np.random.default_rng(number_orbitals).standard_normal((number_orbitals, number_orbitals))
+    eigenvectors /= np.linalg.norm(eigenvectors, axis=1, keepdims=True)
+    with open(os.path.join(directory, 'eigenvec.bin'), 'wb') as file:
+        file.write(np.array([0], dtype=np.int32).tobytes())
+        file.write(eigenvectors.tobytes())
+
+def dftb_available() -> bool:
+    """Checks whether the DFTB+ binary used by run_dftb exists."""
+    return os.path.isfile(DFTB_BINARY) and os.access(DFTB_BINARY, os.X_OK)
+
+def frontier_orbitals(detailed_xml: str, count: int) -> List[int]:
+    """Selects orbitals around the HOMO (half of them occupied, as far as the basis allows).
+
+    Args:
+        detailed_xml (str): detailed.xml of the calculation
+        count (int): Number of orbitals
+
+    Returns:
+        List[int]: Numbers of the orbitals (starting at 1)
+    """
+    occupations = read_occupations(detailed_xml)
+    number_orbitals = len(occupations)
+    homo = max(1, homo_level(occupations))
+    first = min(max(1, homo - count // 2 + 1), max(1, number_orbitals - count + 1))
+    return list(range(first, min(first + count, number_orbitals + 1)))
+
+def time_stage(function: Callable[[], object], repeats: int) -> Tuple[float, object]:
+    """Runs a stage several times and keeps the fastest run.
+
+    Args:
+        function (Callable[[], object]): Stage to be timed
+        repeats (int): Number of runs
+
+    Returns:
+        Tuple[float, object]: Best wall time in seconds and the result of the last run
+    """
+    best = np.inf
+    result = None
+    for _ in range(max(1, repeats)):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def benchmark_molecule(molecule: Molecule, directory: str, settings: BenchmarkSettings, use_dftb: bool) -> List[BenchmarkResult]:
+    """Times the stages up to DFTB+ of one molecule.
+
+    Args:
+        molecule (Molecule): Synthetic molecule
+        directory (str): Directory of the calculation (created)
+        settings (BenchmarkSettings): Number of repetitions
+        use_dftb (bool): Run DFTB+ (otherwise the stand-in)
+
+    Returns:
+        List[BenchmarkResult]: Times of xyz parsing, input generation and DFTB+
+    """
+    os.makedirs(directory, exist_ok=True)
+    molecule_xyz = os.path.join(directory, 'geometry.xyz')
+    write_molecule_xyz(molecule, molecule_xyz)
+
+    def parse_xyz() -> List[str]:
+        with XyzTrajectory(molecule_xyz) as trajectory:
+            trajectory.frame(0)
+        return read_elements(molecule_xyz)
+
+    def generate_inputs() -> None:
+        dftb_input('geometry.xyz', elements)
+        waveplot_input([1])
+
+    def calculate() -> None:
+        if use_dftb:
+            run_dftb('geometry.xyz', elements, directory)
+        else:
+            stand_in_dftb('geometry.xyz', directory)
+        if not os.path.isfile(os.path.join(directory, 'eigenvec.bin')):
+            raise RuntimeError(f"DFTB+ failed for {molecule.name} (see {directory}/dftb.out).")
+
+    atoms = len(molecule.species)
+    results = []
+    seconds, elements = time_stage(parse_xyz, settings.repeats)
+    results.append(BenchmarkResult('xyz_parsing', molecule.name, molecule.family, molecule.variant, atoms, 0, 0, seconds))
+    seconds, _ = time_stage(generate_inputs, settings.repeats)
+    results.append(BenchmarkResult('input_generation', molecule.name, molecule.family, molecule.variant, atoms, 0, 0, seconds))
+    seconds, _ = time_stage(calculate, 1)
+    results.append(BenchmarkResult('dftb', molecule.name, molecule.family, molecule.variant, atoms, 0, 0, seconds))
+    return results
+
+def benchmark_grid(molecule: Molecule, directory: str, n_points: int, n_orbitals: int, settings: BenchmarkSettings,
+                   visualize: bool = True) -> List[BenchmarkResult]:
+    """Times the cube generation and (for the first orbital) cube I/O, isosurface extraction, rendering and GIF encoding.
+
+    Args:
+        molecule (Molecule): Molecule calculated by benchmark_molecule in the directory
+        directory (str): Directory of the calculation
+        n_points (int): Number of grid points in each direction
+        n_orbitals (int): Number of orbitals (around the HOMO)
+        settings (BenchmarkSettings): Number of repetitions and movie frames
+        visualize (bool): Time the stages after the cube generation
+
+    Returns:
+        List[BenchmarkResult]: Times of the stages
+    """
+    orbitals = frontier_orbitals(os.path.join(directory, 'detailed.xml'), n_orbitals)
+    detailed_xml, eigenvec_bin = os.path.join(directory, 'detailed.xml'), os.path.join(directory, 'eigenvec.bin')
+    grid_points = n_points**3
+    results = []
+
+    def record(stage: str, seconds: float) -> None:
+        results.append(BenchmarkResult(stage, molecule.name, molecule.family, molecule.variant, len(molecule.species),
+                                       grid_points, len(orbitals), seconds))
+
+    seconds, cube_files = time_stage(lambda: write_orbital_cubes(orbitals, detailed_xml, eigenvec_bin, (n_points,) * 3), settings.repeats)
+    record('cube_generation', seconds)
+    if not visualize:
+        return results
+
+    cube_file = os.path.join(directory, cube_files[0])
+    seconds, (header, data) = time_stage(lambda: read_cube(cube_file), settings.repeats)
+    record('cube_read_text', seconds)
+    seconds, binary_file = time_stage(lambda: convert_cube_to_binary(cube_file), settings.repeats)
+    record('cube_write_binary', seconds)
+    seconds, _ = time_stage(lambda: load_cube(binary_file), settings.repeats)
+    record('cube_read_binary', seconds)
+    seconds, isovalue = time_stage(lambda: enclosed_density_isovalue(cube_file, 0.85), settings.repeats)
+    record('isovalue', seconds)
+    seconds, _ = time_stage(lambda: orbital_meshes(header, data, isovalue), settings.repeats)
+    record('isosurface', seconds)
+
+    scene = build_scene(cube_file, isovalue, '1', '3')
+    rotations = rotation_matrices('y', np.arange(settings.n_frames) * 360.0 / settings.n_frames)
+    seconds, frames = time_stage(lambda: [render_image(scene, rotation) for rotation in rotations], 1)
+    record('render', seconds)
+
+    def encode() -> None:
+        writer = GifWriter(os.path.join(directory, 'benchmark.gif'), MovieSettings(n_frames=settings.n_frames))
+        for frame in frames:
+            writer.add_frame(frame)
+        writer.close()
+    seconds, _ = time_stage(encode, settings.repeats)
+    record('gif_encoding', seconds)
+    return results
+
+def scaling_exponents(results: Sequence[BenchmarkResult]) -> Dict[str, Dict[str, float]]:
+    """Fits the scaling exponent of every stage with the number of atoms, grid points and orbitals.
+
+    The exponent is the slope of log(time) over log(size) for results in which only this size changes
+    (median over all such series, e.g. over the molecule families).
+
+    Args:
+        results (Sequence[BenchmarkResult]): Benchmark results
+
+    Returns:
+        Dict[str, Dict[str, float]]: Exponent of every stage and size which has been varied
+    """
+    variables = ('atoms', 'grid_points', 'orbitals')
+    exponents: Dict[str, Dict[str, float]] = {}
+    for stage in STAGES:
+        stage_results = [result for result in results if result.stage == stage and result.seconds > 0.0]
+        for variable in variables:
+            series: Dict[tuple, List[BenchmarkResult]] = {}
+            for result in stage_results:
+                fixed = tuple(getattr(result, other) for other in variables if other != variable)
+                # Molecules of one family and variant form a series in the number of atoms
+                key = (result.family, result.variant) + fixed if variable == 'atoms' else (result.molecule,) + fixed
+                series.setdefault(key, []).append(result)
+            slopes = []
+            for members in series.values():
+                sizes = np.array([getattr(member, variable) for member in members], dtype=float)
+                if len(np.unique(sizes)) >= 2 and sizes.min() > 0:
+                    slopes.append(np.polyfit(np.log(sizes), np.log([member.seconds for member in members]), 1)[0])
+            if slopes:
+                exponents.setdefault(stage, {})[variable] = round(float(np.median(slopes)), 3)
+    return exponents
+
+def git_version() -> str:
+    """Returns the git commit of the code (empty if it is not a git checkout)."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def run_benchmark(settings: BenchmarkSettings = BenchmarkSettings(), report_file: str = 'benchmark_report.json',
+                  keep_files: bool = False) -> dict:
+    """Runs the benchmark and writes the report.
+
+    Every molecule (families and heteroatom variants) is timed up to DFTB+ and on the first grid size with the first
+    number of orbitals; the largest plain molecule of every family is additionally swept over all grid sizes and
+    numbers of orbitals.
+
+    Args:
+        settings (BenchmarkSettings): Sizes and sweeps
+        report_file (str): JSON report
+        keep_files (bool): Keep the calculation directories
+
+    Returns:
+        dict: Report (environment, settings, results and scaling exponents)
+    """
+    use_dftb = dftb_available()
+    print(f"DFTB+: {DFTB_BINARY if use_dftb else 'not found, using the stand-in with random eigenvectors'}")
+    work_directory = tempfile.mkdtemp(prefix='benchmark_')
+    sizes = {'alkane': settings.alkane_sizes, 'acene': settings.acene_sizes}
+    results: List[BenchmarkResult] = []
+    try:
+        for family, generator in MOLECULE_FAMILIES.items():
+            for variant in settings.variants:
+                for size in sizes[family]:
+                    molecule = generator(size, variant)
+                    if variant and variant not in molecule.species:
+                        continue
+                    directory = os.path.join(work_directory, molecule.name)
+                    results += benchmark_molecule(molecule, directory, settings, use_dftb)
+                    results += benchmark_grid(molecule, directory, settings.grid_sizes[0], settings.orbital_counts[0], settings)
+                    print(f"{molecule.name}: {len(molecule.species)} atoms done")
+
+            # Grid and orbital sweeps for the largest plain molecule of the family
+            molecule = generator(max(sizes[family]), '')
+            directory = os.path.join(work_directory, molecule.name)
+            for n_points in settings.grid_sizes[1:]:
+                results += benchmark_grid(molecule, directory, n_points, settings.orbital_counts[0], settings)
+                print(f"{molecule.name}: {n_points}^3 grid done")
+            for n_orbitals in settings.orbital_counts[1:]:
+                results += benchmark_grid(molecule, directory, settings.grid_sizes[0], n_orbitals, settings, visualize=False)
+                print(f"{molecule.name}: {n_orbitals} orbitals done")
+    finally:
+        if not keep_files:
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'version': git_version(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cores': available_cores(),
+        'dftb': 'dftb+' if use_dftb else 'stand-in',
+        'supported_elements': SUPPORTED_ELEMENTS,
+        'settings': settings._asdict(),
+        'results': [result._asdict() for result in results],
+        'scaling': scaling_exponents(results),
+    }
+    with open(report_file, 'w') as file:
+        json.dump(report, file, indent=1)
+    return report
+
+def compare_reports(previous: dict, current: dict, tolerance: float = 1.2) -> List[str]:
+    """Finds the stages which became slower than in a previous report.
+
+    Args:
+        previous (dict): Earlier benchmark report
+        current (dict): New benchmark report
+        tolerance (float): Ratio of the times above which a stage counts as slower
+
+    Returns:
+        List[str]: Description of every slower stage
+    """
+    def key(result: dict) -> tuple:
+        return result['stage'], result['molecule'], result['grid_points'], result['orbitals']
+    previous_times = {key(result): result['seconds'] for result in previous['results']}
+    regressions = []
+    for result in current['results']:
+        before = previous_times.get(key(result))
+        if before and result['seconds'] > tolerance * before and result['seconds'] > 1e-3:
+            regressions.append(f"{result['stage']} {result['molecule']} ({result['grid_points']} points, {result['orbitals']} orbitals): "
+                               f"{before:.4f} s -> {result['seconds']:.4f} s")
+    return regressions
+
+def print_summary(report: dict) -> None:
+    """Prints the total time of every stage and the scaling exponents.
+
+    Args:
+        report (dict): Benchmark report
+
+    Returns:
+        None: Prints a table
+    """
+    print("------------------------------------------------------------------------")
+    print(f"{'Stage':20s} {'Total [s]':>10s}   Scaling exponents")
+    for stage in STAGES:
+        total = sum(result['seconds'] for result in report['results'] if result['stage'] == stage)
+        exponents = ', '.join(f"{variable} {exponent:.2f}" for variable, exponent in report['scaling'].get(stage, {}).items())
+        print(f"{stage:20s} {total:10.3f}   {exponents}")
+    print("------------------------------------------------------------------------")
+
+if __name__ == '__main__':
+
+    # Check, if enough elements are present
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '--help'):
+        print(f"Usage: python3 {sys.argv[0]} [--quick] [--keep] [--output benchmark_report.json] [--compare PreviousReport]")
+        exit()
+
+    arguments = sys.argv[1:]
+    benchmark_settings = BenchmarkSettings()
+    output_file = 'benchmark_report.json'
+    previous_file: Optional[str] = None
+    keep = False
+    while arguments:
+        option = arguments.pop(0)
+        if option == '--quick':
+            benchmark_settings = QUICK_SETTINGS
+        elif option == '--keep':
+            keep = True
+        elif option == '--output':
+            output_file = arguments.pop(0)
+        elif option == '--compare':
+            previous_file = arguments.pop(0)
+        else:
+            print(f"Unknown option {option}.")
+            exit()
+
+    benchmark_report = run_benchmark(benchmark_settings, output_file, keep)
+    print_summary(benchmark_report)
+    print(f"Report written to {output_file}.")
+    if previous_file:
+        with open(previous_file, 'r') as previous_report:
+            slower = compare_reports(json.load(previous_report), benchmark_report)
+        print(f"{len(slower)} stages slower than in {previous_file}:" if slower else f"No stage slower than in {previous_file}.")
+        for line in slower:
+            print(f"  {line}")
@@ -0,0 +1,396 @@
+import json
+import os
+import struct
+import sys
+import zlib
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence, TextIO, Tuple
+
+import numpy as np
+
+# Binary companion format: magic, header length, JSON header (padded so the data is aligned),
+# float32 chunks of whole x slabs, JSON chunk index, offset of the chunk index
+BINARY_CUBE_MAGIC = b'CUBEBIN1'
+BINARY_CUBE_SUFFIX = '.cubeb'
+BINARY_CUBE_ALIGNMENT = 64
+
+class CubeHeader(NamedTuple):
+    """Header of a Gaussian cube file (all lengths in Bohr)."""
+    comments: Tuple[str, str]
+    origin: np.ndarray
+    axes: np.ndarray
+    shape: Tuple[int, int, int]
+    atomic_numbers: np.ndarray
+    coordinates: np.ndarray
+
+def read_cube_header(file: TextIO) -> CubeHeader:
+    """Reads the header of a cube file and leaves the file positioned at the first data value.
+
+    Args:
+        file (TextIO): Opened cube file
+
+    Returns:
+        CubeHeader: Comments, origin, grid vectors, number of points and atoms of the cube file
+    """
+    comments = (file.readline().rstrip('\n'), file.readline().rstrip('\n'))
+    columns = file.readline().split()
+    number_atoms = abs(int(columns[0]))
+    origin = np.array(columns[1:4], dtype=float)
+
+    shape = []
+    axes = np.zeros((3, 3))
+    for i in range(0, 3):
+        columns = file.readline().split()
+        shape.append(int(columns[0]))
+        axes[i] = np.array(columns[1:4], dtype=float)
+
+    atomic_numbers = np.zeros(number_atoms, dtype=int)
+    coordinates = np.zeros((number_atoms, 3))
+    for i in range(0, number_atoms):
+        columns = file.readline().split()
+        atomic_numbers[i] = int(columns[0])
+        coordinates[i] = np.array(columns[2:5], dtype=float)
+
+    return CubeHeader(comments, origin, axes, tuple(shape), atomic_numbers, coordinates)
+
+def iter_cube_slabs(file: TextIO, header: CubeHeader) -> Iterator[np.ndarray]:
+    """Reads the data of a cube file slab by slab (all values with the same x index).
+
+    Only one slab is held in memory at a time.
+
+    Args:
+        file (TextIO): Cube file positioned at the first data value (see read_cube_header)
+        header (CubeHeader): Header of the cube file
+
+    Returns:
+        Iterator[np.ndarray]: Slabs with shape (ny, nz)
+    """
+    slab_size = header.shape[1] * header.shape[2]
+    values: List[str] = []
+    for line in file:
+        values.extend(line.split())
+        while len(values) >= slab_size:
+            yield np.array(values[:slab_size], dtype=float).reshape(header.shape[1], header.shape[2])
+            del values[:slab_size]
+
+def read_cube(cube_file: str) -> Tuple[CubeHeader, np.ndarray]:
+    """Reads a complete cube file.
+
+    Args:
+        cube_file (str): Name of the cube file
+
+    Returns:
+        Tuple[CubeHeader, np.ndarray]: Header of the cube file and the grid data with shape (nx, ny, nz)
+    """
+    with open(cube_file, 'r') as file:
+        header = read_cube_header(file)
+        data = np.array(file.read().split(), dtype=float)
+    return header, data.reshape(header.shape)
+
+def write_cube_header(file: TextIO, header: CubeHeader) -> None:
+    """Writes the header of a cube file.
+
+    Args:
+        file (TextIO): Cube file opened for writing
+        header (CubeHeader): Header to be written
+
+    Returns:
+        None: Writes the header lines into the file
+    """
+    file.write(f"{header.comments[0]}\n{header.comments[1]}\n")
+    file.write(f"{len(header.atomic_numbers):5d}{header.origin[0]:12.6f}{header.origin[1]:12.6f}{header.origin[2]:12.6f}\n")
+    for i in range(0, 3):
+        axis = header.axes[i]
+        file.write(f"{header.shape[i]:5d}{axis[0]:12.6f}{axis[1]:12.6f}{axis[2]:12.6f}\n")
+    for number, coordinate in zip(header.atomic_numbers, header.coordinates):
+        file.write(f"{number:5d}{float(number):12.6f}{coordinate[0]:12.6f}{coordinate[1]:12.6f}{coordinate[2]:12.6f}\n")
+
+def format_cube_slab(slab: np.ndarray) -> str:
+    """Formats one slab (all values with the same x index) in cube file layout.
+
+    Every z-row starts on a new line and holds at most six values per line.
+
+    Args:
+        slab (np.ndarray): Grid values with shape (ny, nz)
+
+    Returns:
+        str: Text of the slab in cube file layout
+    """
+    lines: List[str] = []
+    for row in slab:
+        values = [f" {value:12.5E}" for value in row]
+        for i in range(0, len(values), 6):
+            lines.append(''.join(values[i:i + 6]))
+    return '\n'.join(lines) + '\n'
+
+def write_cube(cube_file: str, header: CubeHeader, data: np.ndarray) -> None:
+    """Writes a complete cube file.
+
+    Args:
+        cube_file (str): Name of the cube file
+        header (CubeHeader): Header of the cube file
+        data (np.ndarray): Grid data with shape (nx, ny, nz)
+
+    Returns:
+        None: Writes the cube file
+    """
+    with open(cube_file, 'w') as file:
+        write_cube_header(file, header)
+        for slab in data:
+            file.write(format_cube_slab(slab))
+
+def write_binary_cube(binary_file: str, header: CubeHeader, slabs: Iterable[np.ndarray], compression: Optional[str] = None, slabs_per_chunk: int = 8) -> None:
+    """Writes cube data in the compact binary companion format.
+
+    The data is stored as float32 in chunks of whole x slabs. Uncompressed files can be memory mapped.
+
+    Args:
+        binary_file (str): Name of the binary cube file
+        header (CubeHeader): Header of the cube
+        slabs (Iterable[np.ndarray]): Slabs with shape (ny, nz) in x order (may be a generator)
+        compression (Optional[str]): None or 'zlib'
+        slabs_per_chunk (int): Number of slabs per chunk
+
+    Returns:
+        None: Writes the binary cube file
+    """
+    if compression not in (None, 'zlib'):
+        raise ValueError(f"Unknown compression {compression}.")
+    description = {
+        'comments': list(header.comments),
+        'origin': header.origin.tolist(),
+        'axes': header.axes.tolist(),
+        'shape': list(header.shape),
+        'atomic_numbers': header.atomic_numbers.tolist(),
+        'coordinates': header.coordinates.tolist(),
+        'dtype': '<f4',
+        'compression': compression,
+        'slabs_per_chunk': slabs_per_chunk,
+    }
+    encoded = json.dumps(description).encode()
+    data_offset = len(BINARY_CUBE_MAGIC) + 8 + len(encoded)
+    padding = -data_offset % BINARY_CUBE_ALIGNMENT
+    encoded += b' ' * padding
+
+    chunks = []
+    with open(binary_file, 'wb') as file:
+        file.write(BINARY_CUBE_MAGIC)
+        file.write(struct.pack('<Q', len(encoded)))
+        file.write(encoded)
+
+        pending: List[np.ndarray] = []
+        def write_chunk() -> None:
+            raw = np.asarray(pending, dtype='<f4').tobytes()
+            if compression == 'zlib':
+                raw = zlib.compress(raw, 1)
+            chunks.append([file.tell(), len(raw), len(pending)])
+            file.write(raw)
+            pending.clear()
+
+        for slab in slabs:
+            pending.append(slab)
+            if len(pending) == slabs_per_chunk:
+                write_chunk()
+        if pending:
+            write_chunk()
+
+        index_offset = file.tell()
+        file.write(json.dumps(chunks).encode())
+        file.write(struct.pack('<Q', index_offset))
+
+class BinaryCube:
+    """Lazy reader for cube files in the binary companion format."""
+
+    def __init__(self, binary_file: str):
+        self.file = open(binary_file, 'rb')
+        if self.file.read(len(BINARY_CUBE_MAGIC)) != BINARY_CUBE_MAGIC:
+            self.file.close()
+            raise ValueError(f"{binary_file} is not a binary cube file.")
+        header_length = struct.unpack('<Q', self.file.read(8))[0]
+        description = json.loads(self.file.read(header_length))
+        self.data_offset = self.file.tell()
+        self.header = CubeHeader(tuple(description['comments']), np.array(description['origin']), np.array(description['axes']),
+                                 tuple(description['shape']), np.array(description['atomic_numbers'], dtype=int),
+                                 np.array(description['coordinates']).reshape(-1, 3))
+        self.compression = description['compression']
+        self.slabs_per_chunk = description['slabs_per_chunk']
+
+        self.file.seek(-8, os.SEEK_END)
+        index_offset = struct.unpack('<Q', self.file.read(8))[0]
+        self.file.seek(index_offset)
+        self.chunks = json.loads(self.file.read()[:-8])
+        self.memory_map = None
+        if self.compression is None:
+            self.memory_map = np.memmap(binary_file, dtype='<f4', mode='r', offset=self.data_offset, shape=self.header.shape)
+
+    def __enter__(self) -> 'BinaryCube':
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes the underlying file."""
+        self.memory_map = None
+        self.file.close()
+
+    def read_chunk(self, index: int) -> np.ndarray:
+        """Reads one chunk of slabs.
+
+        Args:
+            index (int): Number of the chunk
+
+        Returns:
+            np.ndarray: Slabs of the chunk with shape (slabs in chunk, ny, nz)
+        """
+        offset, length, number_slabs = self.chunks[index]
+        if self.memory_map is not None:
+            first = index * self.slabs_per_chunk
+            return self.memory_map[first:first + number_slabs]
+        self.file.seek(offset)
+        raw = self.file.read(length)
+        if self.compression == 'zlib':
+            raw = zlib.decompress(raw)
+        return np.frombuffer(raw, dtype='<f4').reshape(number_slabs, self.header.shape[1], self.header.shape[2])
+
+    def slab(self, index: int) -> np.ndarray:
+        """Reads a single slab (all values with the same x index) without loading the rest of the grid.
+
+        Args:
+            index (int): x index of the slab
+
+        Returns:
+            np.ndarray: Slab with shape (ny, nz)
+        """
+        if self.memory_map is not None:
+            return self.memory_map[index]
+        return self.read_chunk(index // self.slabs_per_chunk)[index % self.slabs_per_chunk]
+
+    def iter_slabs(self) -> Iterator[np.ndarray]:
+        """Iterates over all slabs, holding only one chunk in memory.
+
+        Returns:
+            Iterator[np.ndarray]: Slabs with shape (ny, nz)
+        """
+        for index in range(0, len(self.chunks)):
+            for slab in self.read_chunk(index):
+                yield slab
+
+    def read(self) -> np.ndarray:
+        """Reads the complete grid.
+
+        Returns:
+            np.ndarray: Grid data with shape (nx, ny, nz)
+        """
+        return np.concatenate([self.read_chunk(index) for index in range(0, len(self.chunks))], axis=0)
+
+def is_binary_cube(cube_file: str) -> bool:
+    """Checks whether a file is in the binary companion format.
+
+    Args:
+        cube_file (str): Name of the file
+
+    Returns:
+        bool: True for binary cube files
+    """
+    with open(cube_file, 'rb') as file:
+        return file.read(len(BINARY_CUBE_MAGIC)) == BINARY_CUBE_MAGIC
+
+def load_cube(cube_file: str) -> Tuple[CubeHeader, np.ndarray]:
+    """Reads a complete cube file in text or binary format.
+
+    Args:
+        cube_file (str): Name of the cube file
+
+    Returns:
+        Tuple[CubeHeader, np.ndarray]: Header of the cube file and the grid data with shape (nx, ny, nz)
+    """
+    if is_binary_cube(cube_file):
+        with BinaryCube(cube_file) as cube:
+            return cube.header, np.array(cube.read(), dtype=float)
+    return read_cube(cube_file)
+
+def is_density_cube(comments: Sequence[str]) -> bool:
+    """Checks whether a cube file holds a density (density.cube of orbital_engine.py) instead of an orbital."""
+    return 'density' in comments[1].lower()
+
+def read_cube_file_header(cube_file: str) -> CubeHeader:
+    """Reads only the header of a cube file in text or binary format.
+
+    Args:
+        cube_file (str): Name of the cube file
+
+    Returns:
+        CubeHeader: Header of the cube file
+    """
+    if is_binary_cube(cube_file):
+        with BinaryCube(cube_file) as cube:
+            return cube.header
+    with open(cube_file, 'r') as file:
+        return read_cube_header(file)
+
+def iter_cube_file_slabs(cube_file: str) -> Iterator[np.ndarray]:
+    """Reads the data of a cube file in text or binary format slab by slab.
+
+    Args:
+        cube_file (str): Name of the cube file
+
+    Returns:
+        Iterator[np.ndarray]: Slabs with shape (ny, nz)
+    """
+    if is_binary_cube(cube_file):
+        with BinaryCube(cube_file) as cube:
+            yield from cube.iter_slabs()
+    else:
+        with open(cube_file, 'r') as file:
+            yield from iter_cube_slabs(file, read_cube_header(file))
+
+def convert_cube_to_binary(cube_file: str, binary_file: str = '', compression: Optional[str] = None) -> str:
+    """Converts a text cube file into the binary companion format in a single streaming pass.
+
+    Args:
+        cube_file (str): Name of the text cube file
+        binary_file (str): Name of the binary file (default: cube file name with the suffix .cubeb)
+        compression (Optional[str]): None or 'zlib'
+
+    Returns:
+        str: Name of the binary cube file
+    """
+    if binary_file == '':
+        binary_file = os.path.splitext(cube_file)[0] + BINARY_CUBE_SUFFIX
+    with open(cube_file, 'r') as file:
+        header = read_cube_header(file)
+        write_binary_cube(binary_file, header, iter_cube_slabs(file, header), compression)
+    return binary_file
+
+def convert_binary_to_cube(binary_file: str, cube_file: str = '') -> str:
+    """Converts a binary cube file back into a text cube file in a single streaming pass.
+
+    Args:
+        binary_file (str): Name of the binary cube file
+        cube_file (str): Name of the text cube file (default: binary file name with the suffix .cube)
+
+    Returns:
+        str: Name of the text cube file
+    """
+    if cube_file == '':
+        cube_file = os.path.splitext(binary_file)[0] + '.cube'
+    with BinaryCube(binary_file) as cube, open(cube_file, 'w') as file:
+        write_cube_header(file, cube.header)
+        for slab in cube.iter_slabs():
+            file.write(format_cube_slab(slab))
+    return cube_file
+
+if __name__ == '__main__':
+
+    # Check, if enough elements are present
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} [--zlib] CubeFile [CubeFile ...]")
+        exit()
+
+    compression = 'zlib' if '--zlib' in sys.argv[1:] else None
+    for cube_file in [argument for argument in sys.argv[1:] if argument != '--zlib']:
+        if is_binary_cube(cube_file):
+            print(f"Converted {cube_file} to {convert_binary_to_cube(cube_file)}.")
+        else:
+            binary_file = convert_cube_to_binary(cube_file, compression=compression)
+            print(f"Converted {cube_file} ({os.path.getsize(cube_file)} bytes) to {binary_file} ({os.path.getsize(binary_file)} bytes).")
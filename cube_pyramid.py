@@ -0,0 +1,137 @@
+import math
+import os
+import sys
+from typing import List, Sequence, TextIO, Tuple
+
+import numpy as np
+
+from cube_io import CubeHeader, format_cube_slab, iter_cube_file_slabs, read_cube_file_header, write_cube_header
+
+# Number of grid points per direction of the coarse levels (the full grid is the finest level)
+PYRAMID_LEVELS = (20, 40)
+
+def pyramid_file(cube_file: str, level: int) -> str:
+    """Returns the name of a coarse level of a cube file.
+
+    The name keeps the waveplot naming (wp-1-1-<n>-real.L<level>.cube), so the orbital number can still be read from it.
+
+    Args:
+        cube_file (str): Cube file of the full grid (text or binary)
+        level (int): Number of grid points per direction of the level
+
+    Returns:
+        str: Name of the cube file of the level
+    """
+    return f"{os.path.splitext(cube_file)[0]}.L{level}.cube"
+
+def level_factors(shape: Sequence[int], level: int) -> Tuple[int, int, int]:
+    """Calculates the block size of a coarse level in every direction.
+
+    Args:
+        shape (Sequence[int]): Number of grid points of the full grid
+        level (int): Number of grid points per direction of the level
+
+    Returns:
+        Tuple[int, int, int]: Number of full grid points averaged into one point of the level per direction
+    """
+    return tuple(max(1, round(n / level)) for n in shape)
+
+class PyramidLevel:
+    """Writes one coarse level of a cube file while the full grid is streamed slab by slab."""
+
+    def __init__(self, level_file: str, header: CubeHeader, factors: Tuple[int, int, int]):
+        self.factors = factors
+        self.shape = tuple(math.ceil(n / f) for n, f in zip(header.shape, factors))
+        # A block average is located at the center of its block
+        origin = header.origin + sum((f - 1) / 2 * axis for f, axis in zip(factors, header.axes))
+        axes = header.axes * np.array(factors)[:, None]
+        self.file: TextIO = open(level_file, 'w')
+        write_cube_header(self.file, CubeHeader(header.comments, origin, axes, self.shape, header.atomic_numbers, header.coordinates))
+        self.y_starts = np.arange(0, header.shape[1], factors[1])
+        self.z_starts = np.arange(0, header.shape[2], factors[2])
+        self.counts = np.outer(np.diff(np.append(self.y_starts, header.shape[1])), np.diff(np.append(self.z_starts, header.shape[2])))
+        self.block = np.zeros(self.shape[1:])
+        self.block_slabs = 0
+
+    def add(self, slab: np.ndarray) -> None:
+        """Adds the next slab of the full grid, a slab of the level is written every factors[0] slabs.
+
+        Args:
+            slab (np.ndarray): Slab of the full grid with shape (ny, nz)
+
+        Returns:
+            None: Accumulates the slab
+        """
+        reduced = np.add.reduceat(np.add.reduceat(np.asarray(slab, dtype=float), self.y_starts, axis=0), self.z_starts, axis=1)
+        self.block += reduced
+        self.block_slabs += 1
+        if self.block_slabs == self.factors[0]:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the average of the accumulated slabs as one slab of the level."""
+        if self.block_slabs:
+            self.file.write(format_cube_slab(self.block / (self.counts * self.block_slabs)))
+            self.block[:] = 0.0
+            self.block_slabs = 0
+
+    def close(self) -> None:
+        """Writes the last (possibly incomplete) block and closes the file."""
+        self.flush()
+        self.file.close()
+
+def build_cube_pyramid(cube_file: str, levels: Sequence[int] = PYRAMID_LEVELS) -> List[str]:
+    """Writes coarse versions of a cube file by averaging blocks of grid points.
+
+    The full grid is read once, slab by slab, and all levels are written at the same time. Levels which are not
+    coarser than the full grid are skipped.
+
+    Args:
+        cube_file (str): Cube file of the full grid (text or binary)
+        levels (Sequence[int]): Number of grid points per direction of every level
+
+    Returns:
+        List[str]: Cube files of the levels, from coarse to fine
+    """
+    header = read_cube_file_header(cube_file)
+    pyramid = []
+    for level in sorted(levels):
+        factors = level_factors(header.shape, level)
+        if factors != (1, 1, 1):
+            pyramid.append(PyramidLevel(pyramid_file(cube_file, level), header, factors))
+    try:
+        for slab in iter_cube_file_slabs(cube_file):
+            for pyramid_level in pyramid:
+                pyramid_level.add(slab)
+    finally:
+        for pyramid_level in pyramid:
+            pyramid_level.close()
+    return [pyramid_level.file.name for pyramid_level in pyramid]
+
+def preview_cube(cube_file: str, level: int) -> str:
+    """Returns the cube file of a coarse level, building the pyramid if the level does not exist yet.
+
+    Args:
+        cube_file (str): Cube file of the full grid
+        level (int): Number of grid points per direction of the level (0: full grid)
+
+    Returns:
+        str: Cube file to be loaded (the full grid if the level would not be coarser)
+    """
+    if level <= 0:
+        return cube_file
+    level_file = pyramid_file(cube_file, level)
+    if not os.path.isfile(level_file) or os.path.getmtime(level_file) < os.path.getmtime(cube_file):
+        if level_file not in build_cube_pyramid(cube_file, [level]):
+            return cube_file
+    return level_file
+
+if __name__ == '__main__':
+
+    # Check, if enough elements are present
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} CubeFile [CubeFile ...]")
+        exit()
+
+    for cube_file in sys.argv[1:]:
+        print(f"Pyramid of {cube_file}: {' '.join(build_cube_pyramid(cube_file))}")
@@ -1,16 +1,36 @@
+import atexit
 import sys
 import subprocess
 import shutil
 import os
 import fileinput
 
-from modules import read_elements, run_dftb, create_vmd_script, user_choices, launch_vmd_with_script, input_waveplot
+from modules import read_elements, run_dftb, write_dftb_input, create_vmd_script, user_choices, launch_vmd_with_script, input_waveplot_batch, density_choice, engine_choice, grid_choice, orbital_selection_choice, orbital_number, render_mode_choice, available_cores, movie_choices, isovalue_choice, preview_choice
+from cube_pyramid import preview_cube
+from cube_stats import analyse_cubes
+from grid_sizing import grid_parameters, plan_xyz_grid
+from instrumentation import RUN_LOG
+from isovalue import orbital_isovalues
+from movie import MovieSettings
+from orbital_engine import COMPACT_SUPPORT, write_density_cube, write_orbital_cubes
+from orbital_selection import needs_calculation, select_levels, select_orbitals
+from parallel_waveplot import input_waveplot_parallel
+from render_pool import RenderJob, render_orbitals_batch, render_orbitals_parallel, render_rotation_movies
+from vmd_server import display_client
+from offscreen_renderer import render_orbitals_offscreen
+from result_cache import DFTB_RESULT_FILES, ResultCache, cube_cache_key, dftb_cache_key
+from trajectory_orbitals import orbital_evolution_movies, parse_frame_selection, render_trajectory, run_trajectory
+from workspace import Workspace
+from xyz_io import XyzTrajectory
 
 # Check, if enough elements are present
-if len(sys.argv) != 2:
-    print(f"Usage: python3 {sys.argv[0]} CoordinatesFile")
+if len(sys.argv) not in (2, 3):
+    print(f"Usage: python3 {sys.argv[0]} CoordinatesFile [Frames (start:stop:stride) for trajectories]")
     exit()
 
+#Resources of every stage and external program are summarized when the run ends
+atexit.register(RUN_LOG.finish)
+
 #Setting current working directory
 current_directory = os.getcwd()
 os.chdir(current_directory)
@@ -28,111 +48,257 @@ else:
     exit()
 
 
-#looking for all different elements (H,C,O,N)
-elements = read_elements(molecule_xyz)
+#Checking for a trajectory (several frames in the xyz file)
+with XyzTrajectory(molecule_xyz) as trajectory:
+    number_frames = len(trajectory)
+    trajectory_mode = number_frames > 1 or len(sys.argv) == 3
+    if trajectory_mode:
+        frames = parse_frame_selection(sys.argv[2] if len(sys.argv) == 3 else ':', number_frames)
+        if len(frames) == 0:
+            print(f"No frames selected from the {number_frames} frames of {molecule_xyz} --> exiting.")
+            exit()
+        print(f"Found trajectory with {number_frames} frames, the orbitals of {len(frames)} frames will be calculated.")
+
+        #looking for all different elements in the first selected frame
+        elements = trajectory.elements([frames[0]])
+
+if not trajectory_mode:
+    #looking for all different elements (H,C,O,N)
+    elements = read_elements(molecule_xyz)
 
 #Defining file names
 gen_file="geom.gen"
 
-#Reading Orbital to be calculated
-while True:
-    #Number of Orbitals to be plotted
-    print("----------------------------------------------------------------------------------------------------")
-    print("How many Orbitals do you want to calculate?")
-    print("----------------------------------------------------------------------------------------------------")
-
-    #Get user input
-    number_orbitals = int(input("Your choice: "))
-
-    # Prompt the user for input
-    print("----------------------------------------------------------------------------------------------------")
-    print("Which Orbital(s) do you want to calculate (number)?")
-    print("----------------------------------------------------------------------------------------------------")
-
-    orbitals = []
-    for i in range(0,number_orbitals):
-        # Get user input
-        orbitals.append(input(f"Orbital {i+1}: "))
-    break
-
-#Giving Status update
-print("Starting DFTB+ Calculation for generation of eigenvectors.")
-
-run_dftb(molecule_xyz, elements)
-
-#Status Update
-print("DFTB+ Calculation has finished.")
-print("Starting Calculation of the Orbital Cube files using waveplot.")
-
-for i in range(0,number_orbitals):
-    #Running Waveplot
-    input_waveplot(orbitals[i])
-
-#Status update
-print("Waveplot Calculation has finished.")
-
-#deleting temporary files
-removal_files =['dftb_pin.hsd','detailed.out','detailed.xml','eigenvec.bin','charges.bin','waveplot_pin.hsd', 'waveplot.out', 'dftb.out']
-removed_files = []
-for file in removal_files:
-    if os.path.exists(file) == True:
-        os.remove(file)
-        removed_files.append(file)
+#Reading the Orbitals to be calculated (numbers, HOMO/LUMO offsets or energy windows)
+orbital_selection = orbital_selection_choice()
+
+#One cube file per orbital or the accumulated density of all of them (not for trajectories)
+density_weighting = density_choice() if not trajectory_mode else ''
+
+#Choosing the program for the cube files (densities are accumulated by the NumPy engine)
+engine = engine_choice() if not density_weighting else '2'
+
+#Choosing the grid spacing of the cube files (the number of points follows from the size of the molecule)
+grid_setting = grid_choice(molecule_xyz)
+
+if trajectory_mode:
+    #Frame by frame, every frame starting from the charges of the previous one
+    print("Starting DFTB+ and cube calculations for every frame.")
+    with RUN_LOG.stage('trajectory', molecule_xyz):
+        frame_results = run_trajectory(molecule_xyz, frames, [], elements, engine, selection=orbital_selection, grid=grid_setting)
+    orbitals = sorted({orbital_number(cube_file) for result in frame_results for cube_file in result.cube_files}, key=int)
+    warm_iterations = [result.scc_iterations for result in frame_results if result.warm_start and result.cube_files]
+    if warm_iterations:
+        print(f"Average number of SCC iterations of the warm started frames: {sum(warm_iterations) / len(warm_iterations):.1f}")
+
+    print("")
+    print("How do you want the molecule to look?")
+    print("In trajectory mode images of every frame are rendered; the movies show the orbitals along the trajectory.")
+    background_color, molecule_style, movie_maker = user_choices()
+    enclosed_fraction = isovalue_choice()
+    with RUN_LOG.stage('rendering', molecule_xyz):
+        render_trajectory(frame_results, background_color, molecule_style, enclosed_fraction)
+    if movie_maker in ('yes', 'y'):
+        movie_format, _ = movie_choices()
+        orbital_evolution_movies(frame_results, orbitals, MovieSettings(format=movie_format))
+    exit()
+
+#DFTB+ and the cube generation run in a private workspace on scratch storage, only the cube files are moved back
+workspace = Workspace('generate_').create()
+atexit.register(workspace.remove)
+workspace_xyz = workspace.copy_in(molecule_xyz)
+
+#Looking for results of earlier runs in the cache
+cache = ResultCache()
+dftb_key = dftb_cache_key(molecule_xyz, elements)
+#Localized orbitals are written on the part of the grid around their atoms (NumPy and parallel waveplot engines)
+compact = COMPACT_SUPPORT and engine in ('2', '3')
+cube_engine = ('numpy' if engine == '2' else 'waveplot') + (' compact' if compact else '')
+n_points, region = grid_parameters(plan_xyz_grid(molecule_xyz, grid_setting))
+#HOMO, LUMO and energy windows can only be resolved with the results of DFTB+
+symbolic_selection = needs_calculation(orbital_selection)
+orbitals = [] if symbolic_selection else [str(level) for level in select_levels(orbital_selection)]
+cube_files = []
+for orbital in orbitals if not density_weighting else []:
+    cube_file = f"wp-1-1-{orbital}-real.cube"
+    if cache.fetch(cube_cache_key(dftb_key, orbital, cube_engine, n_points, region), [cube_file]):
+        cube_files.append(cube_file)
+remaining_orbitals = [orbital for orbital in orbitals if f"wp-1-1-{orbital}-real.cube" not in cube_files]
+
+if symbolic_selection or remaining_orbitals:
+    if cache.fetch(dftb_key, DFTB_RESULT_FILES, workspace.path):
+        #waveplot includes dftb_in.hsd, which has to point to the xyz file of this run
+        write_dftb_input(workspace_xyz, elements, workspace.path)
+        print("Found DFTB+ results in the cache, skipping the DFTB+ Calculation.")
     else:
-        print(f"File {file} does not exist.")
-print(f"Files: ", end="") 
-for i in range(0,len(removed_files)):
-    print(f"{removed_files[i]} ", end="")
-print(" have been removed.")
+        #Giving Status update
+        print("Starting DFTB+ Calculation for generation of eigenvectors.")
+
+        with RUN_LOG.stage('dftb', molecule_xyz) as outputs:
+            dftb_result = run_dftb(workspace_xyz, elements, workspace.path)
+            outputs += [workspace.file(file) for file in DFTB_RESULT_FILES]
+        if dftb_result.status != 'finished':
+            workspace.publish(['dftb.out'])
+            print("DFTB+ Calculation failed (see dftb.out) --> exiting.")
+            exit()
+
+        #Status Update
+        print("DFTB+ Calculation has finished.")
+        if all(os.path.isfile(workspace.file(file)) for file in DFTB_RESULT_FILES):
+            cache.store(dftb_key, DFTB_RESULT_FILES, workspace.path)
+
+if symbolic_selection:
+    orbitals = select_orbitals(orbital_selection, workspace.path)
+    print(f"Selected orbitals: {' '.join(orbitals)}")
+    for orbital in orbitals if not density_weighting else []:
+        cube_file = f"wp-1-1-{orbital}-real.cube"
+        if cache.fetch(cube_cache_key(dftb_key, orbital, cube_engine, n_points, region), [cube_file]):
+            cube_files.append(cube_file)
+    remaining_orbitals = [orbital for orbital in orbitals if f"wp-1-1-{orbital}-real.cube" not in cube_files]
+if cube_files:
+    print(f"Cube files taken from the cache: {' '.join(cube_files)}")
+
+if density_weighting:
+    #Accumulating the density of all orbitals in memory, only the density cube file is written
+    #The selection is resolved for every spin channel (HOMO and LUMO can differ between them)
+    print(f"Starting Calculation of the density of orbitals {orbital_selection} using the NumPy engine.")
+    with RUN_LOG.stage('cube files', 'density') as outputs:
+        try:
+            density_file = write_density_cube(orbital_selection, density_weighting, directory=workspace.path, n_points=n_points, region=region)
+        except ValueError as error:
+            print(f"{error} --> exiting.")
+            exit()
+        cube_files = workspace.publish([density_file])
+        outputs += cube_files
+    print("NumPy Calculation has finished.")
+    remaining_orbitals = []
+
+if remaining_orbitals:
+    with RUN_LOG.stage('cube files', ' '.join(remaining_orbitals)) as outputs:
+        if engine == '2':
+            print("Starting Calculation of the Orbital Cube files using the NumPy engine.")
+            new_cube_files = write_orbital_cubes(remaining_orbitals, workspace.file('detailed.xml'), workspace.file('eigenvec.bin'), n_points, region, compact)
+            print("NumPy Calculation has finished.")
+        elif engine == '3':
+            print(f"Starting Calculation of the Orbital Cube files using waveplot on {available_cores()} cores.")
+            new_cube_files = input_waveplot_parallel(remaining_orbitals, n_points=n_points, directory=workspace.path, region=region,
+                                                     compact=compact)
+            print("Waveplot Calculation has finished.")
+        else:
+            print("Starting Calculation of the Orbital Cube files using waveplot.")
+
+            #Running Waveplot once for all orbitals
+            new_cube_files = input_waveplot_batch(remaining_orbitals, workspace.path, n_points, region)
+
+            #Status update
+            print("Waveplot Calculation has finished.")
+        #Moving the cube files atomically into the current directory
+        new_cube_files = workspace.publish(new_cube_files)
+        outputs += new_cube_files
+
+    #Storing the new cube files in the cache
+    for orbital in remaining_orbitals:
+        cube_file = f"wp-1-1-{orbital}-real.cube"
+        if cube_file in new_cube_files:
+            cache.store(cube_cache_key(dftb_key, orbital, cube_engine, n_points, region), [cube_file])
+    cube_files += new_cube_files
+if not density_weighting:
+    #Cube files in the order of the orbitals
+    cube_files = [f"wp-1-1-{orbital}-real.cube" for orbital in orbitals if f"wp-1-1-{orbital}-real.cube" in cube_files]
+print(f"Cube files written: {' '.join(cube_files)}")
+missing_orbitals = [orbital for orbital in orbitals if f"wp-1-1-{orbital}-real.cube" not in cube_files and not density_weighting]
+if missing_orbitals:
+    print(f"No cube file was written for orbital(s): {' '.join(missing_orbitals)}")
+
+#Checking the cube files before any time is spent on rendering them
+with RUN_LOG.stage('validation'):
+    for cube_statistics in analyse_cubes(cube_files):
+        if cube_statistics.problems or cube_statistics.warnings:
+            print(f"Warning: {cube_statistics.cube_file}: {'; '.join(cube_statistics.problems + cube_statistics.warnings)}")
+
+#deleting temporary files (the whole workspace)
+workspace.remove()
+print(f"Temporary files in {workspace.path} have been removed.")
 
 print("")
 print("")
 print("How do you want the molecule to look?")
 #Defining Visualisation Choices
 background_color, molecule_style, movie_maker = user_choices()
+movie_settings = MovieSettings()
+if movie_maker in ('yes', 'y'):
+    movie_format, n_frames = movie_choices()
+    movie_settings = MovieSettings(format=movie_format, n_frames=n_frames)
+enclosed_fraction = isovalue_choice()
 
+render_mode = render_mode_choice()
+preview_level = preview_choice()
 
-for i in range(0,number_orbitals):
-    #reading input files input
-    orbital_file_path=f"wp-1-1-{orbitals[i]}-real.cube"
-
-    #Checking for xyz file specified
-    condition_1 = os.path.isfile(orbital_file_path)
-    if condition_1 is not False:
-        print(f"Found Cube file: {orbital_file_path}")
-    else:
-        print(f"Specified Cube file {orbital_file_path} not found --> exiting.")
-        exit()
+# Isovalues of the orbital surfaces (fixed or calculated from the cube files)
+with RUN_LOG.stage('isovalues'):
+    isovalues = dict(zip(cube_files, orbital_isovalues(cube_files, enclosed_fraction)))
 
+if render_mode == '2':
     #Status update
     print("")
     print("")
-    print(f"Starting Visualistaion of Orbital {orbitals[i]} using VMD.")
+    print(f"Starting Visualistaion of Orbitals {' '.join(orbitals)} in one VMD session.")
     print("")
     print("")
-    
-    # Create VMD script
-    vmd_script_file = create_vmd_script(molecule_xyz,orbital_file_path, background_color, molecule_style, movie_maker)
 
-    # Launch VMD with the script
-    vmd_process = launch_vmd_with_script(vmd_script_file)
+    with RUN_LOG.stage('rendering', molecule_xyz):
+        render_orbitals_batch(molecule_xyz, [preview_cube(cube_file, preview_level) for cube_file in cube_files], background_color, molecule_style, movie_maker, movie_settings, [isovalues[cube_file] for cube_file in cube_files])
+elif render_mode == '3':
+    # Render every orbital in its own headless VMD process, several at once
+    render_jobs = [RenderJob(molecule_xyz, preview_cube(cube_file, preview_level), background_color, molecule_style, movie_maker, movie_settings, isovalues[cube_file])
+                   for cube_file in cube_files]
+    with RUN_LOG.stage('rendering', molecule_xyz):
+        render_orbitals_parallel(render_jobs)
+elif render_mode == '4':
+    # Render all orbitals with the built-in renderer, the molecule is taken from the cube files
+    with RUN_LOG.stage('rendering', molecule_xyz):
+        render_orbitals_offscreen([preview_cube(cube_file, preview_level) for cube_file in cube_files], background_color, molecule_style, movie_maker, movie_settings, [isovalues[cube_file] for cube_file in cube_files])
+else:
+    for orbital_file_path in cube_files:
+        #reading input files input
+        orbital = orbital_number(orbital_file_path)
+
+        #Checking for xyz file specified
+        condition_1 = os.path.isfile(orbital_file_path)
+        if condition_1 is not False:
+            print(f"Found Cube file: {orbital_file_path}")
+        else:
+            print(f"Specified Cube file {orbital_file_path} not found --> exiting.")
+            exit()
+
+        #Status update
+        print("")
+        print("")
+        print(f"Starting Visualistaion of Orbital {orbital} using VMD.")
+        print("")
+        print("")
+    
+        viewer = display_client()
+        if viewer is not None:
+            # Show the orbital in the window of the running render server
+            viewer.show_orbital(molecule_xyz, orbital_file_path, background_color, molecule_style, isovalues[orbital_file_path])
+            input("Press Enter to continue with the next orbital.")
+        else:
+            # Create VMD script
+            vmd_script_file = create_vmd_script(molecule_xyz,orbital_file_path, background_color, molecule_style, isovalues[orbital_file_path],
+                                                preview_cube(orbital_file_path, preview_level) if preview_level else '')
 
-    # Wait for VMD to finish
-    vmd_process.wait()
+            # Launch VMD with the script
+            vmd_process = launch_vmd_with_script(vmd_script_file)
 
-    # Clean up: Remove temporary script file
-    os.remove(vmd_script_file)
-    if movie_maker in ('yes','y'):
-        os.rename('rotation_x.gif',f'MO_{orbitals[i]}_rotation_x.gif')
-        os.rename('rotation_y.gif',f'MO_{orbitals[i]}_rotation_y.gif')
-        os.rename('rotation_z.gif',f'MO_{orbitals[i]}_rotation_z.gif')
+            # Wait for VMD to finish
+            RUN_LOG.wait(vmd_process)
 
+            # Clean up: Remove temporary script file
+            os.remove(vmd_script_file)
 
-#removing Snapshots from movie
-if movie_maker in ('yes', 'y'):
-    del_vec = ['0000','0001','0002','0003','0004','0005','0006','0007','0008',
-               '0009','0010','0011','0012','0013','0014','0015','0016','0017',
-               '0018','0019','0020','0021','0022','0023','0024','0025','0026',
-               '0027','0028','0029','0030','0031','0032','0033','0034','0035']
-    for i in del_vec:
-        os.remove(f'snap.{i}.rgb')
+        # Rendering and encoding the rotation movies without display
+        if movie_maker in ('yes','y'):
+            print(f"Rendering the rotation movies of orbital {orbital}.")
+            with RUN_LOG.stage('movies', orbital_file_path):
+                render_rotation_movies(molecule_xyz, orbital_file_path, background_color, molecule_style, f'MO_{orbital}_', movie_settings, isovalues[orbital_file_path])
@@ -0,0 +1,184 @@
+import math
+import sys
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from xyz_io import XyzTrajectory
+
+BOHR_TO_ANGSTROM = 0.529177210903
+
+# Number of grid points of the fixed grid (waveplot OptimalCuboid), used by the grid setting "fixed"
+FIXED_POINTS = (80, 80, 80)
+FIXED_GRID = 'fixed'
+
+# Grid setting used if none is chosen
+DEFAULT_GRID = 'standard'
+
+# Characters of one value in a cube file (" %12.5E"), the line ends add one character per six values
+CUBE_VALUE_BYTES = 13
+
+class GridPreset(NamedTuple):
+    """Grid spacing and padding around the atoms (lengths in Angstrom)."""
+    name: str
+    spacing: float
+    padding: float
+
+GRID_PRESETS = {
+    'preview': GridPreset('preview', 0.30, 3.0),
+    'standard': GridPreset('standard', 0.20, 4.0),
+    'publication': GridPreset('publication', 0.10, 4.0),
+}
+
+class GridPlan(NamedTuple):
+    """Grid of the cube files planned from the molecular extent (lengths in Bohr, like waveplot)."""
+    preset: GridPreset
+    n_points: Tuple[int, int, int]
+    origin: np.ndarray
+    box: np.ndarray
+
+    @property
+    def region(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Origin and box vectors of the plotted region (waveplot PlottedRegion = UserDefined)."""
+        return self.origin, self.box
+
+class GridCost(NamedTuple):
+    """Estimated size of a grid."""
+    points: int
+    cube_megabytes: float
+    memory_megabytes: float
+
+def grid_preset(setting: str) -> Optional[GridPreset]:
+    """Converts a grid setting into a preset.
+
+    Args:
+        setting (str): Name of a preset (preview, standard, publication), a spacing in Angstrom (e.g. "0.15", padded like
+            the standard preset) or "fixed" for the fixed 80x80x80 grid
+
+    Returns:
+        Optional[GridPreset]: Spacing and padding of the grid (None for the fixed grid)
+    """
+    setting = str(setting).strip().lower() or DEFAULT_GRID
+    if setting == FIXED_GRID:
+        return None
+    if setting in GRID_PRESETS:
+        return GRID_PRESETS[setting]
+    try:
+        spacing = float(setting)
+    except ValueError:
+        raise ValueError(f"Unknown grid {setting}, choose one of {', '.join(GRID_PRESETS)}, {FIXED_GRID} or a spacing in Angstrom.") from None
+    if not 0.0 < spacing <= 2.0:
+        raise ValueError(f"Grid spacing {spacing} is out of range, use a spacing between 0 and 2 Angstrom.")
+    return GridPreset(f"{spacing:g} A", spacing, GRID_PRESETS[DEFAULT_GRID].padding)
+
+def plan_grid(coordinates: np.ndarray, preset: GridPreset) -> GridPlan:
+    """Plans a cuboid grid along the cartesian axes around the atoms with the spacing of a preset.
+
+    The box encloses all atoms plus the padding on every side. The number of points is rounded up, so that the spacing
+    is kept exactly, and the box is centered on the atoms.
+
+    Args:
+        coordinates (np.ndarray): Coordinates of the atoms in Angstrom with shape (n, 3)
+        preset (GridPreset): Spacing and padding of the grid
+
+    Returns:
+        GridPlan: Number of points, origin and box vectors of the grid (Bohr)
+    """
+    lower = np.min(coordinates, axis=0) - preset.padding
+    upper = np.max(coordinates, axis=0) + preset.padding
+    n_points = tuple(max(int(math.ceil(edge / preset.spacing - 1e-9)), 1) for edge in upper - lower)
+    edges = np.array(n_points) * preset.spacing
+    origin = 0.5 * (lower + upper) - 0.5 * edges
+    return GridPlan(preset, n_points, origin / BOHR_TO_ANGSTROM, np.diag(edges) / BOHR_TO_ANGSTROM)
+
+def plan_xyz_grid(molecule_xyz: str, setting: str, frame: int = 0) -> Optional[GridPlan]:
+    """Plans the grid for a frame of a xyz file.
+
+    Args:
+        molecule_xyz (str): xyz file of the molecule or trajectory
+        setting (str): Grid setting (see grid_preset)
+        frame (int): Frame of the xyz file
+
+    Returns:
+        Optional[GridPlan]: Planned grid (None for the fixed grid)
+    """
+    preset = grid_preset(setting)
+    if preset is None:
+        return None
+    with XyzTrajectory(molecule_xyz) as trajectory:
+        return plan_grid(trajectory.frame(frame).coordinates, preset)
+
+def grid_parameters(plan: Optional[GridPlan]) -> Tuple[Tuple[int, int, int], Optional[Tuple[np.ndarray, np.ndarray]]]:
+    """Returns the number of points and the region passed to the cube engines.
+
+    Args:
+        plan (Optional[GridPlan]): Planned grid (None for the fixed grid)
+
+    Returns:
+        Tuple[Tuple[int, int, int], Optional[Tuple[np.ndarray, np.ndarray]]]: Number of points and region (None: OptimalCuboid)
+    """
+    if plan is None:
+        return FIXED_POINTS, None
+    return plan.n_points, plan.region
+
+def grid_cost(n_points: Tuple[int, int, int]) -> GridCost:
+    """Estimates the size of one cube file and the memory of one orbital on a grid.
+
+    Args:
+        n_points (Tuple[int, int, int]): Number of grid points in each direction
+
+    Returns:
+        GridCost: Number of points, size of the cube file and memory of the float64 values in MB
+    """
+    points = int(np.prod(n_points))
+    cube_bytes = n_points[0] * n_points[1] * (CUBE_VALUE_BYTES * n_points[2] + math.ceil(n_points[2] / 6))
+    return GridCost(points, cube_bytes / 1024**2, 8 * points / 1024**2)
+
+def describe_grid(n_points: Tuple[int, int, int], preset: Optional[GridPreset] = None) -> str:
+    """Describes a grid and its cost in one line.
+
+    Args:
+        n_points (Tuple[int, int, int]): Number of grid points in each direction
+        preset (Optional[GridPreset]): Spacing and padding of the grid (None: fixed grid)
+
+    Returns:
+        str: Description with spacing, points, cube file size and memory
+    """
+    cost = grid_cost(n_points)
+    setting = f"{preset.spacing:.2f} A spacing, {preset.padding:.1f} A padding" if preset else "OptimalCuboid"
+    return (f"{setting}: {'x'.join(str(n) for n in n_points)} = {cost.points:,} points, "
+            f"{cost.cube_megabytes:.1f} MB per cube file, {cost.memory_megabytes:.1f} MB memory per orbital")
+
+def grid_table(molecule_xyz: str) -> List[str]:
+    """Describes the presets and the fixed grid for a molecule.
+
+    Args:
+        molecule_xyz (str): xyz file of the molecule
+
+    Returns:
+        List[str]: One line per grid setting
+    """
+    lines = []
+    for name in GRID_PRESETS:
+        plan = plan_xyz_grid(molecule_xyz, name)
+        lines.append(f"{name:12s} {describe_grid(plan.n_points, plan.preset)}")
+    lines.append(f"{FIXED_GRID:12s} {describe_grid(FIXED_POINTS)}")
+    return lines
+
+if __name__ == '__main__':
+
+    # Check, if enough elements are present
+    if len(sys.argv) not in (2, 3):
+        print(f"Usage: python3 {sys.argv[0]} CoordinatesFile [Grid (preview, standard, publication, fixed or spacing in Angstrom)]")
+        exit()
+
+    if len(sys.argv) == 2:
+        print('\n'.join(grid_table(sys.argv[1])))
+    else:
+        grid_plan = plan_xyz_grid(sys.argv[1], sys.argv[2])
+        if grid_plan is None:
+            print(describe_grid(FIXED_POINTS))
+        else:
+            print(describe_grid(grid_plan.n_points, grid_plan.preset))
+            print(f"Origin (Bohr): {' '.join(f'{value:.4f}' for value in grid_plan.origin)}")
+            print(f"Box (Bohr): {' '.join(f'{value:.4f}' for value in np.diag(grid_plan.box))}")
@@ -0,0 +1,246 @@
+import cProfile
+import csv
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+# Prefix of the run log files (<prefix>.json and <prefix>.csv, opt-in), empty: only the summary is printed
+RUN_LOG_PREFIX = os.environ.get('ORBITAL_RUN_LOG', '')
+
+# Directory for cProfile statistics of the stages (opt-in), empty: no profiling
+PROFILE_DIRECTORY = os.environ.get('ORBITAL_PROFILE', '')
+
+# ru_maxrss is given in kilobytes on Linux and in bytes on macOS
+_MAXRSS_TO_MB = 1.0 / 1024**2 if sys.platform == 'darwin' else 1.0 / 1024
+
+# Per-thread CPU time where the platform supports it (stages of the batch pipeline run in parallel threads)
+_RUSAGE_STAGE = getattr(resource, 'RUSAGE_THREAD', resource.RUSAGE_SELF)
+
+class ResourceRecord(NamedTuple):
+    """Resources used by one stage or one external process."""
+    kind: str
+    name: str
+    label: str
+    command: str
+    start: float
+    wall_seconds: float
+    user_seconds: float
+    system_seconds: float
+    peak_rss_mb: float
+    read_bytes: int
+    written_bytes: int
+    output_bytes: int
+    return_code: Optional[int]
+
+def _io_counters() -> Tuple[int, int]:
+    """Returns the bytes read and written by the current thread (Linux /proc), (0, 0) elsewhere."""
+    for io_file in ('/proc/thread-self/io', '/proc/self/io'):
+        try:
+            with open(io_file, 'r') as file:
+                counters = dict(line.split(':') for line in file.read().splitlines())
+            return int(counters['rchar']), int(counters['wchar'])
+        except (OSError, KeyError, ValueError):
+            continue
+    return 0, 0
+
+def _output_bytes(output_files: Sequence[str]) -> int:
+    """Returns the total size of the output files which exist."""
+    return sum(os.path.getsize(file) for file in output_files if os.path.isfile(file))
+
+class RunLog:
+    """Collects the resources of the stages and external processes of a run.
+
+    Stages are timed in the calling thread (wall and CPU time, peak RSS of the Python process, bytes read and
+    written). External processes are started through the run log and reaped with os.wait4, which returns the
+    resources of exactly this child process.
+    """
+
+    def __init__(self, profile_directory: str = PROFILE_DIRECTORY):
+        self.records: List[ResourceRecord] = []
+        self.lock = threading.Lock()
+        self.started: Dict[int, Tuple[str, str, str, float, float, Sequence[str]]] = {}
+        self.created = time.time()
+        self.origin = time.perf_counter()
+        self.profile_directory = profile_directory
+        self.profiling = threading.local()
+
+    def add(self, record: ResourceRecord) -> None:
+        """Adds a record (thread safe)."""
+        with self.lock:
+            self.records.append(record)
+
+    @contextmanager
+    def stage(self, name: str, label: str = '') -> Iterator[List[str]]:
+        """Measures a stage of the run.
+
+        The stage yields a list, to which the output files of the stage can be added; their total size is recorded.
+        With a profile directory the outermost stage of every thread is also profiled with cProfile
+        (<profile directory>/<name>[_<label>].prof).
+
+        Args:
+            name (str): Name of the stage
+            label (str): Molecule, orbital or frame the stage works on
+
+        Returns:
+            Iterator[List[str]]: Output files of the stage
+        """
+        output_files: List[str] = []
+        profiler = None
+        if self.profile_directory and not getattr(self.profiling, 'active', False):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self.profiling.active = True
+            except ValueError:
+                # Another profiler is already running (sys.monitoring allows only one per process)
+                profiler = None
+        usage = resource.getrusage(_RUSAGE_STAGE)
+        read_bytes, written_bytes = _io_counters()
+        start = time.perf_counter()
+        try:
+            yield output_files
+        finally:
+            wall_seconds = time.perf_counter() - start
+            end_usage = resource.getrusage(_RUSAGE_STAGE)
+            end_read_bytes, end_written_bytes = _io_counters()
+            if profiler is not None:
+                profiler.disable()
+                self.profiling.active = False
+                os.makedirs(self.profile_directory, exist_ok=True)
+                file_name = re.sub(r'[^\w.+-]', '_', f"{name}_{label}" if label else name)
+                profiler.dump_stats(os.path.join(self.profile_directory, f"{file_name}.prof"))
+            self.add(ResourceRecord('stage', name, label, '', start - self.origin, wall_seconds,
+                                    end_usage.ru_utime - usage.ru_utime, end_usage.ru_stime - usage.ru_stime,
+                                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_TO_MB,
+                                    end_read_bytes - read_bytes, end_written_bytes - written_bytes,
+                                    _output_bytes(output_files), None))
+
+    def popen(self, name: str, command: List[str], label: str = '', output_files: Sequence[str] = (), **popen_arguments) -> subprocess.Popen:
+        """Starts an external process, whose resources are recorded once it is waited for with wait.
+
+        Args:
+            name (str): Name of the program (dftb+, waveplot, vmd, ffmpeg)
+            command (List[str]): Command line
+            label (str): Molecule, orbital or frame the process works on
+            output_files (Sequence[str]): Files written by the process (sizes are recorded after it finished)
+            **popen_arguments: Further arguments of subprocess.Popen (cwd, stdout, env, ...)
+
+        Returns:
+            subprocess.Popen: Started process
+        """
+        process = subprocess.Popen(command, **popen_arguments)
+        directory = popen_arguments.get('cwd') or '.'
+        with self.lock:
+            self.started[process.pid] = (name, label, ' '.join(command), time.perf_counter(), time.perf_counter() - self.origin,
+                                         [os.path.join(directory, file) for file in output_files])
+        return process
+
+    def wait(self, process: subprocess.Popen) -> int:
+        """Waits for a process started with popen and records its resources.
+
+        Processes which have already been waited for are not recorded again. On Linux the peak RSS of a child is
+        at least the RSS of the Python process when it was started (the memory of the fork is counted).
+
+        Args:
+            process (subprocess.Popen): Process started with popen
+
+        Returns:
+            int: Return code of the process
+        """
+        if process.returncode is not None:
+            return process.returncode
+        with self.lock:
+            name, label, command, start, relative_start, output_files = self.started.pop(
+                process.pid, ('process', '', ' '.join(map(str, process.args)), time.perf_counter(), 0.0, []))
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        except (AttributeError, ChildProcessError):
+            # No wait4 on this platform or the process has already been reaped
+            process.wait()
+            usage = None
+        wall_seconds = time.perf_counter() - start
+        self.add(ResourceRecord('process', name, label, command, relative_start, wall_seconds,
+                                usage.ru_utime if usage else 0.0, usage.ru_stime if usage else 0.0,
+                                usage.ru_maxrss * _MAXRSS_TO_MB if usage else 0.0,
+                                # Block I/O of the child, counted in blocks of 512 bytes
+                                usage.ru_inblock * 512 if usage else 0, usage.ru_oublock * 512 if usage else 0,
+                                _output_bytes(output_files), process.returncode))
+        return process.returncode
+
+    def run(self, name: str, command: List[str], label: str = '', output_files: Sequence[str] = (), **popen_arguments) -> subprocess.CompletedProcess:
+        """Runs an external process to completion and records its resources (replacement for subprocess.run).
+
+        Args:
+            name (str): Name of the program (dftb+, waveplot, vmd, ffmpeg)
+            command (List[str]): Command line
+            label (str): Molecule, orbital or frame the process works on
+            output_files (Sequence[str]): Files written by the process, relative to its working directory
+            **popen_arguments: Further arguments of subprocess.Popen (cwd, stdout, env, ...)
+
+        Returns:
+            subprocess.CompletedProcess: Finished process
+        """
+        process = self.popen(name, command, label, output_files, **popen_arguments)
+        return subprocess.CompletedProcess(command, self.wait(process))
+
+    def write_json(self, json_file: str) -> None:
+        """Writes all records as JSON file (renamed into place, so concurrent runs never leave a mixed file)."""
+        temporary = f"{json_file}.{os.getpid()}.partial"
+        with open(temporary, 'w') as file:
+            json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.created)), 'command': ' '.join(sys.argv),
+                       'records': [record._asdict() for record in self.records]}, file, indent=1)
+        os.replace(temporary, json_file)
+
+    def write_csv(self, csv_file: str) -> None:
+        """Writes all records as CSV file (one line per record)."""
+        temporary = f"{csv_file}.{os.getpid()}.partial"
+        with open(temporary, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(ResourceRecord._fields)
+            writer.writerows(self.records)
+        os.replace(temporary, csv_file)
+
+    def summary(self) -> str:
+        """Returns a table of the total resources of every stage and program."""
+        totals: Dict[Tuple[str, str], List[float]] = {}
+        for record in self.records:
+            total = totals.setdefault((record.kind, record.name), [0, 0.0, 0.0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += record.wall_seconds
+            total[2] += record.user_seconds + record.system_seconds
+            total[3] = max(total[3], record.peak_rss_mb)
+            total[4] += record.output_bytes
+        lines = ["------------------------------------------------------------------------",
+                 f"{'':8s} {'Name':20s} {'Count':>5s} {'Wall [s]':>9s} {'CPU [s]':>9s} {'RSS [MB]':>9s} {'Output [MB]':>11s}"]
+        for (kind, name), (count, wall, cpu, rss, output) in totals.items():
+            lines.append(f"{kind:8s} {name:20s} {count:5d} {wall:9.2f} {cpu:9.2f} {rss:9.1f} {output / 1024**2:11.2f}")
+        lines.append("------------------------------------------------------------------------")
+        return '\n'.join(lines)
+
+    def finish(self, prefix: str = RUN_LOG_PREFIX) -> None:
+        """Prints the summary and writes the run log as <prefix>.json and <prefix>.csv.
+
+        Args:
+            prefix (str): Prefix of the run log files (empty: only the summary is printed)
+
+        Returns:
+            None: Writes the run log
+        """
+        if not self.records:
+            return
+        print(self.summary())
+        if prefix:
+            self.write_json(f"{prefix}.json")
+            self.write_csv(f"{prefix}.csv")
+            print(f"Run log written to {prefix}.json and {prefix}.csv.")
+
+# Run log shared by all modules of a run
+RUN_LOG = RunLog()
@@ -0,0 +1,427 @@
+import itertools
+import json
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from cube_io import CubeHeader, load_cube
+from isovalue import DEFAULT_ISOVALUE, enclosed_density_isovalue
+from modules import available_cores
+
+BOHR_TO_ANGSTROM = 0.529177210903
+
+# Colors of the orbital lobes as in the VMD scripts (ColorID 0: blue, ColorID 1: red)
+POSITIVE_COLOR = (0, 0, 255)
+NEGATIVE_COLOR = (255, 0, 0)
+BOND_RADIUS = 0.15
+
+# Covalent radius (Angstrom) and color of the elements of the basis, by atomic number (VMD element colors)
+ELEMENT_PROPERTIES = {1: (0.31, (255, 255, 255)), 6: (0.76, (0, 255, 255)), 7: (0.71, (0, 0, 255)), 8: (0.66, (255, 0, 0)),
+                      9: (0.57, (178, 229, 127)), 14: (1.11, (240, 200, 160)), 15: (1.07, (178, 127, 51)), 16: (1.05, (255, 255, 0)),
+                      17: (1.02, (0, 255, 0)), 35: (1.20, (165, 42, 42)), 53: (1.39, (148, 0, 148))}
+DEFAULT_ELEMENT_PROPERTIES = (0.75, (255, 20, 147))
+
+# Six tetrahedra of a grid cell around its diagonal (0,0,0)-(1,1,1), one per order of the axes. Neighboring cells
+# split their common faces along the same diagonals, so the surfaces of neighboring cells fit together.
+CELL_TETRAHEDRA = [np.array([[0, 0, 0], np.eye(3, dtype=int)[a], np.eye(3, dtype=int)[a] + np.eye(3, dtype=int)[b], [1, 1, 1]])
+                   for a, b, _ in itertools.permutations(range(0, 3))]
+TETRAHEDRON_EDGES = [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]
+
+class Mesh(NamedTuple):
+    """Triangle mesh with per vertex normals and colors."""
+    vertices: np.ndarray
+    normals: np.ndarray
+    colors: np.ndarray
+    faces: np.ndarray
+
+def _tetrahedron_cases() -> List[List[Tuple[int, int, int]]]:
+    """Builds the triangles (as edges of the tetrahedron) for all 16 inside/outside cases of a tetrahedron.
+
+    Returns:
+        List[List[Tuple[int, int, int]]]: Triangles of every case (bit i set: vertex i inside)
+    """
+    cases = []
+    for case in range(0, 16):
+        inside = [vertex for vertex in range(0, 4) if case >> vertex & 1]
+        outside = [vertex for vertex in range(0, 4) if not case >> vertex & 1]
+        cut_edges = [TETRAHEDRON_EDGES.index(tuple(sorted((a, b)))) for a in inside for b in outside]
+        if len(cut_edges) == 3:
+            cases.append([tuple(cut_edges)])
+        elif len(cut_edges) == 4:
+            # Two inside, two outside vertices: the cut is a quadrilateral (a0-b0, a0-b1, a1-b1, a1-b0)
+            a0b0, a0b1, a1b0, a1b1 = cut_edges
+            cases.append([(a0b0, a0b1, a1b1), (a0b0, a1b1, a1b0)])
+        else:
+            cases.append([])
+    return cases
+
+TETRAHEDRON_CASES = _tetrahedron_cases()
+
+def marching_tetrahedra(data: np.ndarray, isovalue: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Extracts the isosurface data == isovalue enclosing the region data > isovalue.
+
+    Every grid cell is split into six tetrahedra; all cells are processed at once for one tetrahedron and case at a time.
+    Vertices on the same grid edge are shared between the triangles.
+
+    Args:
+        data (np.ndarray): Grid values with shape (nx, ny, nz)
+        isovalue (float): Level of the surface
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Vertices in grid coordinates (n, 3) and triangles (m, 3) facing outwards
+    """
+    shape = np.array(data.shape)
+    flat = data.ravel()
+    strides = np.array([shape[1] * shape[2], shape[2], 1])
+    cells = np.stack(np.meshgrid(*[np.arange(0, n - 1) for n in shape], indexing='ij'), axis=-1).reshape(-1, 3)
+    # Only cells with values on both sides of the isovalue can contain the surface
+    corners = cells @ strides
+    corner_offsets = np.array(list(itertools.product((0, 1), repeat=3))) @ strides
+    corner_values = flat[corners[:, None] + corner_offsets[None, :]]
+    crossing = (corner_values.max(axis=1) > isovalue) & (corner_values.min(axis=1) <= isovalue)
+    cells = cells[crossing]
+
+    edge_keys = []
+    edge_points = []
+    orientations = []
+    for tetrahedron in CELL_TETRAHEDRA:
+        points = cells[:, None, :] + tetrahedron[None, :, :]
+        indices = points @ strides
+        values = flat[indices]
+        inside = values > isovalue
+        codes = inside @ (1 << np.arange(0, 4))
+        for case in range(1, 15):
+            selected = codes == case
+            if not selected.any():
+                continue
+            case_points, case_indices, case_values, case_inside = points[selected], indices[selected], values[selected], inside[selected]
+            # Direction from the inside to the outside vertices, the triangles are turned to face it
+            outward = case_points[~case_inside].reshape(len(case_points), -1, 3).mean(axis=1) - \
+                      case_points[case_inside].reshape(len(case_points), -1, 3).mean(axis=1)
+            for triangle in TETRAHEDRON_CASES[case]:
+                corners_of_triangle = []
+                for edge in triangle:
+                    a, b = TETRAHEDRON_EDGES[edge]
+                    low, high = np.minimum(case_indices[:, a], case_indices[:, b]), np.maximum(case_indices[:, a], case_indices[:, b])
+                    t = (isovalue - case_values[:, a]) / (case_values[:, b] - case_values[:, a])
+                    corners_of_triangle.append(case_points[:, a] + t[:, None] * (case_points[:, b] - case_points[:, a]))
+                    edge_keys.append(low * flat.size + high)
+                normal = np.cross(corners_of_triangle[1] - corners_of_triangle[0], corners_of_triangle[2] - corners_of_triangle[0])
+                orientations.append(np.einsum('ij,ij->i', normal, outward) >= 0.0)
+                edge_points.append(np.stack(corners_of_triangle, axis=1))
+
+    if not edge_points:
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64)
+    # Triangles of one case and tetrahedron are stored edge by edge, bring the keys into triangle order
+    triangles = np.concatenate(edge_points, axis=0)
+    keys = np.concatenate([np.stack(edge_keys[i:i + 3], axis=1) for i in range(0, len(edge_keys), 3)], axis=0)
+    facing_outwards = np.concatenate(orientations)
+    keys[~facing_outwards] = keys[~facing_outwards][:, ::-1]
+    triangles[~facing_outwards] = triangles[~facing_outwards][:, ::-1]
+
+    unique_keys, first, faces = np.unique(keys.ravel(), return_index=True, return_inverse=True)
+    vertices = triangles.reshape(-1, 3)[first]
+    return vertices, faces.reshape(-1, 3)
+
+def vertex_normals(vertices: np.ndarray, faces: np.ndarray) -> np.ndarray:
+    """Calculates area weighted vertex normals.
+
+    Args:
+        vertices (np.ndarray): Vertices (n, 3)
+        faces (np.ndarray): Triangles (m, 3)
+
+    Returns:
+        np.ndarray: Unit normals (n, 3)
+    """
+    face_normals = np.cross(vertices[faces[:, 1]] - vertices[faces[:, 0]], vertices[faces[:, 2]] - vertices[faces[:, 0]])
+    normals = np.zeros_like(vertices)
+    for corner in range(0, 3):
+        np.add.at(normals, faces[:, corner], face_normals)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return normals / np.where(lengths > 0.0, lengths, 1.0)
+
+def orbital_meshes(header: CubeHeader, data: np.ndarray, isovalue: float) -> List[Mesh]:
+    """Extracts the positive and negative isosurface of an orbital.
+
+    Args:
+        header (CubeHeader): Header of the cube file
+        data (np.ndarray): Grid values of the orbital
+        isovalue (float): Isovalue of the surfaces (+isovalue and -isovalue)
+
+    Returns:
+        List[Mesh]: Positive and negative lobes in Angstrom
+    """
+    meshes = []
+    for sign, color in ((1.0, POSITIVE_COLOR), (-1.0, NEGATIVE_COLOR)):
+        grid_vertices, faces = marching_tetrahedra(sign * data, isovalue)
+        vertices = (header.origin + grid_vertices @ header.axes) * BOHR_TO_ANGSTROM
+        colors = np.tile(np.array(color, dtype=np.uint8), (len(vertices), 1))
+        meshes.append(Mesh(vertices, vertex_normals(vertices, faces), colors, faces))
+    return meshes
+
+def _sphere(subdivisions: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """Builds a unit icosphere.
+
+    Args:
+        subdivisions (int): Number of times every triangle of the icosahedron is split into four
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Vertices and triangles
+    """
+    golden = (1.0 + 5.0**0.5) / 2.0
+    vertices = [(-1, golden, 0), (1, golden, 0), (-1, -golden, 0), (1, -golden, 0), (0, -1, golden), (0, 1, golden),
+                (0, -1, -golden), (0, 1, -golden), (golden, 0, -1), (golden, 0, 1), (-golden, 0, -1), (-golden, 0, 1)]
+    faces = [(0, 11, 5), (0, 5, 1), (0, 1, 7), (0, 7, 10), (0, 10, 11), (1, 5, 9), (5, 11, 4), (11, 10, 2), (10, 7, 6), (7, 1, 8),
+             (3, 9, 4), (3, 4, 2), (3, 2, 6), (3, 6, 8), (3, 8, 9), (4, 9, 5), (2, 4, 11), (6, 2, 10), (8, 6, 7), (9, 8, 1)]
+    vertices = [np.array(vertex, dtype=float) / np.linalg.norm(vertex) for vertex in vertices]
+    for _ in range(0, subdivisions):
+        midpoints = {}
+        new_faces = []
+        for face in faces:
+            middle = []
+            for a, b in ((face[0], face[1]), (face[1], face[2]), (face[2], face[0])):
+                if (min(a, b), max(a, b)) not in midpoints:
+                    point = vertices[a] + vertices[b]
+                    vertices.append(point / np.linalg.norm(point))
+                    midpoints[(min(a, b), max(a, b))] = len(vertices) - 1
+                middle.append(midpoints[(min(a, b), max(a, b))])
+            new_faces += [(face[0], middle[0], middle[2]), (face[1], middle[1], middle[0]), (face[2], middle[2], middle[1]), tuple(middle)]
+        faces = new_faces
+    return np.array(vertices), np.array(faces)
+
+def _cylinder(start: np.ndarray, end: np.ndarray, radius: float, segments: int = 12) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Builds an open cylinder between two points.
+
+    Args:
+        start (np.ndarray): Center of the first end
+        end (np.ndarray): Center of the second end
+        radius (float): Radius of the cylinder
+        segments (int): Number of sides
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: Vertices, normals and triangles
+    """
+    axis = (end - start) / np.linalg.norm(end - start)
+    helper = np.array([1.0, 0.0, 0.0]) if abs(axis[0]) < 0.9 else np.array([0.0, 1.0, 0.0])
+    u = np.cross(axis, helper)
+    u /= np.linalg.norm(u)
+    v = np.cross(axis, u)
+    angles = np.linspace(0.0, 2.0 * np.pi, segments, endpoint=False)
+    ring = np.cos(angles)[:, None] * u + np.sin(angles)[:, None] * v
+    vertices = np.concatenate([start + radius * ring, end + radius * ring])
+    i = np.arange(0, segments)
+    j = (i + 1) % segments
+    faces = np.concatenate([np.stack([i, j, i + segments], axis=1), np.stack([j, j + segments, i + segments], axis=1)])
+    return vertices, np.concatenate([ring, ring]), faces
+
+def molecule_meshes(atomic_numbers: np.ndarray, coordinates: np.ndarray, atom_scale: float = 0.5, atom_radius: float = 0.0,
+                    bond_radius: float = BOND_RADIUS) -> List[Mesh]:
+    """Builds ball and stick meshes of the atoms and bonds of a molecule.
+
+    Two atoms are bonded if their distance is below 1.2 times the sum of their covalent radii; every bond is split
+    in the middle and colored like its atoms (as the Licorice style of VMD).
+
+    Args:
+        atomic_numbers (np.ndarray): Atomic numbers
+        coordinates (np.ndarray): Coordinates of the atoms in Angstrom
+        atom_scale (float): Radius of the atoms relative to their covalent radius (at least 1.5 bond radii)
+        atom_radius (float): Same radius for all atoms, replaces atom_scale if not 0
+        bond_radius (float): Radius of the bonds
+
+    Returns:
+        List[Mesh]: Atoms and bonds
+    """
+    properties = [ELEMENT_PROPERTIES.get(int(number), DEFAULT_ELEMENT_PROPERTIES) for number in atomic_numbers]
+    radii = np.array([radius for radius, _ in properties])
+    colors = np.array([color for _, color in properties], dtype=np.uint8)
+
+    sphere_vertices, sphere_faces = _sphere()
+    atom_radii = np.full(len(radii), atom_radius) if atom_radius > 0.0 else np.maximum(atom_scale * radii, bond_radius * 1.5)
+    atoms = Mesh((coordinates[:, None, :] + atom_radii[:, None, None] * sphere_vertices[None]).reshape(-1, 3),
+                 np.tile(sphere_vertices, (len(coordinates), 1)), np.repeat(colors, len(sphere_vertices), axis=0),
+                 (sphere_faces[None] + len(sphere_vertices) * np.arange(0, len(coordinates))[:, None, None]).reshape(-1, 3))
+
+    distances = np.linalg.norm(coordinates[:, None, :] - coordinates[None, :, :], axis=-1)
+    first, second = np.nonzero(np.triu(distances < 1.2 * (radii[:, None] + radii[None, :]), k=1))
+    vertices, normals, vertex_colors, faces = [], [], [], []
+    offset = 0
+    for a, b in zip(first, second):
+        middle = (coordinates[a] + coordinates[b]) / 2.0
+        for atom, start, end in ((a, coordinates[a], middle), (b, middle, coordinates[b])):
+            cylinder_vertices, cylinder_normals, cylinder_faces = _cylinder(start, end, bond_radius)
+            vertices.append(cylinder_vertices)
+            normals.append(cylinder_normals)
+            vertex_colors.append(np.tile(colors[atom], (len(cylinder_vertices), 1)))
+            faces.append(cylinder_faces + offset)
+            offset += len(cylinder_vertices)
+    if not vertices:
+        bonds = Mesh(np.zeros((0, 3)), np.zeros((0, 3)), np.zeros((0, 3), dtype=np.uint8), np.zeros((0, 3), dtype=np.int64))
+    else:
+        bonds = Mesh(np.concatenate(vertices), np.concatenate(normals), np.concatenate(vertex_colors), np.concatenate(faces))
+    return [atoms, bonds]
+
+def merge_meshes(meshes: Sequence[Mesh]) -> Mesh:
+    """Joins several meshes into one.
+
+    Args:
+        meshes (Sequence[Mesh]): Meshes to be joined
+
+    Returns:
+        Mesh: Joined mesh
+    """
+    offsets = np.cumsum([0] + [len(mesh.vertices) for mesh in meshes])
+    return Mesh(np.concatenate([mesh.vertices for mesh in meshes]), np.concatenate([mesh.normals for mesh in meshes]),
+                np.concatenate([mesh.colors for mesh in meshes]),
+                np.concatenate([mesh.faces + offset for mesh, offset in zip(meshes, offsets)]))
+
+def write_ply(ply_file: str, mesh: Mesh) -> None:
+    """Writes a mesh as binary little endian PLY file with vertex normals and colors.
+
+    Args:
+        ply_file (str): Name of the PLY file
+        mesh (Mesh): Mesh to be written
+
+    Returns:
+        None: Writes the PLY file
+    """
+    header = (f"ply\nformat binary_little_endian 1.0\ncomment orbital isosurfaces, atoms and bonds (Angstrom)\n"
+              f"element vertex {len(mesh.vertices)}\nproperty float x\nproperty float y\nproperty float z\n"
+              f"property float nx\nproperty float ny\nproperty float nz\n"
+              f"property uchar red\nproperty uchar green\nproperty uchar blue\n"
+              f"element face {len(mesh.faces)}\nproperty list uchar uint vertex_indices\nend_header\n")
+    vertex_type = np.dtype([('position', '<f4', 3), ('normal', '<f4', 3), ('color', 'u1', 3)])
+    vertices = np.empty(len(mesh.vertices), dtype=vertex_type)
+    vertices['position'], vertices['normal'], vertices['color'] = mesh.vertices, mesh.normals, mesh.colors
+    face_type = np.dtype([('count', 'u1'), ('indices', '<u4', 3)])
+    faces = np.empty(len(mesh.faces), dtype=face_type)
+    faces['count'], faces['indices'] = 3, mesh.faces
+    with open(ply_file, 'wb') as file:
+        file.write(header.encode())
+        file.write(vertices.tobytes())
+        file.write(faces.tobytes())
+
+def write_glb(glb_file: str, named_meshes: Sequence[Tuple[str, Mesh]]) -> None:
+    """Writes meshes as binary glTF 2.0 file (one node per mesh, vertex colors, all data in one binary buffer).
+
+    Args:
+        glb_file (str): Name of the glb file
+        named_meshes (Sequence[Tuple[str, Mesh]]): Name and mesh of every node (empty meshes are skipped)
+
+    Returns:
+        None: Writes the glb file
+    """
+    buffer = bytearray()
+    buffer_views, accessors, meshes, nodes = [], [], [], []
+
+    def add_accessor(array: np.ndarray, component_type: int, accessor_type: str, target: int, normalized: bool = False) -> int:
+        while len(buffer) % 4:
+            buffer.append(0)
+        buffer_views.append({'buffer': 0, 'byteOffset': len(buffer), 'byteLength': array.nbytes, 'target': target})
+        buffer.extend(array.tobytes())
+        accessor = {'bufferView': len(buffer_views) - 1, 'componentType': component_type, 'count': len(array), 'type': accessor_type}
+        if normalized:
+            accessor['normalized'] = True
+        if accessor_type == 'VEC3' and component_type == 5126 and target == 34962 and not normalized:
+            accessor['min'], accessor['max'] = array.min(axis=0).tolist(), array.max(axis=0).tolist()
+        accessors.append(accessor)
+        return len(accessors) - 1
+
+    for name, mesh in named_meshes:
+        if len(mesh.faces) == 0:
+            continue
+        attributes = {'POSITION': add_accessor(mesh.vertices.astype('<f4'), 5126, 'VEC3', 34962),
+                      'NORMAL': add_accessor(mesh.normals.astype('<f4'), 5126, 'VEC3', 34962),
+                      # Vertex attributes have to be aligned to four bytes, so the colors are stored as RGBA
+                      'COLOR_0': add_accessor(np.concatenate([mesh.colors, np.full((len(mesh.colors), 1), 255)], axis=1).astype(np.uint8),
+                                              5121, 'VEC4', 34962, normalized=True)}
+        indices = add_accessor(mesh.faces.astype('<u4').ravel(), 5125, 'SCALAR', 34963)
+        meshes.append({'name': name, 'primitives': [{'attributes': attributes, 'indices': indices, 'material': 0}]})
+        nodes.append({'name': name, 'mesh': len(meshes) - 1})
+    while len(buffer) % 4:
+        buffer.append(0)
+
+    gltf = {'asset': {'version': '2.0', 'generator': 'isosurface_mesh.py'},
+            'scene': 0, 'scenes': [{'nodes': list(range(0, len(nodes)))}], 'nodes': nodes, 'meshes': meshes,
+            'materials': [{'pbrMetallicRoughness': {'baseColorFactor': [1.0, 1.0, 1.0, 1.0], 'metallicFactor': 0.0, 'roughnessFactor': 0.6},
+                           'doubleSided': True}],
+            'accessors': accessors, 'bufferViews': buffer_views, 'buffers': [{'byteLength': len(buffer)}]}
+    json_chunk = json.dumps(gltf, separators=(',', ':')).encode()
+    json_chunk += b' ' * (-len(json_chunk) % 4)
+    with open(glb_file, 'wb') as file:
+        file.write(struct.pack('<4sII', b'glTF', 2, 12 + 8 + len(json_chunk) + 8 + len(buffer)))
+        file.write(struct.pack('<I4s', len(json_chunk), b'JSON'))
+        file.write(json_chunk)
+        file.write(struct.pack('<I4s', len(buffer), b'BIN\x00'))
+        file.write(bytes(buffer))
+
+def export_orbital_mesh(cube_file: str, isovalue: float = DEFAULT_ISOVALUE, mesh_format: str = 'glb', output_file: str = '') -> str:
+    """Extracts the isosurfaces of an orbital and writes them together with the molecule as PLY or glTF file.
+
+    Args:
+        cube_file (str): Cube file of the orbital (text or binary)
+        isovalue (float): Isovalue of the surfaces
+        mesh_format (str): 'ply' or 'glb'
+        output_file (str): Name of the mesh file (empty: name of the cube file with the extension of the format)
+
+    Returns:
+        str: Name of the mesh file
+    """
+    header, data = load_cube(cube_file)
+    output_file = output_file or f"{os.path.splitext(cube_file)[0]}.{mesh_format}"
+    positive, negative = orbital_meshes(header, data, isovalue)
+    atoms, bonds = molecule_meshes(np.asarray(header.atomic_numbers), np.asarray(header.coordinates) * BOHR_TO_ANGSTROM)
+    if mesh_format == 'ply':
+        write_ply(output_file, merge_meshes([positive, negative, atoms, bonds]))
+    elif mesh_format == 'glb':
+        write_glb(output_file, [('positive', positive), ('negative', negative), ('atoms', atoms), ('bonds', bonds)])
+    else:
+        raise ValueError(f"Unknown mesh format {mesh_format}, choose ply or glb.")
+    return output_file
+
+def export_orbital_meshes(cube_files: Sequence[str], isovalues: Sequence[float], mesh_format: str = 'glb', n_workers: int = 0) -> List[str]:
+    """Exports the isosurfaces of several orbitals, one process per orbital.
+
+    Args:
+        cube_files (Sequence[str]): Cube files of the orbitals
+        isovalues (Sequence[float]): Isovalue of every orbital
+        mesh_format (str): 'ply' or 'glb'
+        n_workers (int): Number of processes (0: all available cores)
+
+    Returns:
+        List[str]: Names of the mesh files
+    """
+    if n_workers <= 0:
+        n_workers = available_cores()
+    with ProcessPoolExecutor(max_workers=max(1, min(n_workers, len(cube_files)))) as executor:
+        return list(executor.map(export_orbital_mesh, cube_files, isovalues, [mesh_format] * len(cube_files)))
+
+if __name__ == '__main__':
+
+    # Check, if enough elements are present
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} [--ply] [--isovalue 0.02 | --fraction 0.85] CubeFile [CubeFile ...]")
+        exit()
+
+    arguments = sys.argv[1:]
+    mesh_format = 'glb'
+    isovalue = DEFAULT_ISOVALUE
+    fraction = None
+    while arguments and arguments[0].startswith('--'):
+        option = arguments.pop(0)
+        if option == '--ply':
+            mesh_format = 'ply'
+        elif option == '--isovalue':
+            isovalue = float(arguments.pop(0))
+        elif option == '--fraction':
+            fraction = float(arguments.pop(0))
+        else:
+            print(f"Unknown option {option}.")
+            exit()
+
+    isovalues = [enclosed_density_isovalue(cube_file, fraction) if fraction else isovalue for cube_file in arguments]
+    for cube_file, mesh_file in zip(arguments, export_orbital_meshes(arguments, isovalues, mesh_format)):
+        print(f"Isosurfaces of {cube_file} written to {mesh_file}.")
@@ -0,0 +1,119 @@
+import sys
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from cube_io import is_density_cube, iter_cube_file_slabs, read_cube_file_header
+
+# Isovalue used when no automatic isovalue is requested
+DEFAULT_ISOVALUE = 0.02
+# Fraction of the orbital density enclosed by the automatic isosurfaces
+DEFAULT_ENCLOSED_FRACTION = 0.85
+
+# The histogram covers |psi| from 1e-8 to 1e2 in logarithmic bins (about 0.6 % relative width)
+HISTOGRAM_LOG_RANGE = (-8.0, 2.0)
+HISTOGRAM_BINS = 4000
+
+class DensityHistogram:
+    """Histogram of the orbital density |psi|^2 over logarithmic bins of |psi|.
+
+    The memory is fixed by the number of bins, independent of the size of the grid, and every grid value is visited once.
+    For the values of a density (or spin density) rho the histogram holds |rho| itself instead of its square.
+    """
+
+    def __init__(self, n_bins: int = HISTOGRAM_BINS, log_range: Sequence[float] = HISTOGRAM_LOG_RANGE, density_values: bool = False):
+        self.n_bins = n_bins
+        self.log_range = log_range
+        self.density_values = density_values
+        self.density = np.zeros(n_bins)
+
+    def add(self, values: np.ndarray) -> None:
+        """Adds grid values (e.g. one slab of a cube file) to the histogram.
+
+        Args:
+            values (np.ndarray): Values of the orbital psi (of the density rho for density_values)
+
+        Returns:
+            None: Updates the histogram
+        """
+        magnitudes = np.abs(values, dtype=float).ravel()
+        logs = np.log10(np.maximum(magnitudes, 10.0**self.log_range[0]))
+        scale = self.n_bins / (self.log_range[1] - self.log_range[0])
+        bins = np.clip(((logs - self.log_range[0]) * scale).astype(int), 0, self.n_bins - 1)
+        weights = magnitudes if self.density_values else magnitudes**2
+        self.density += np.bincount(bins, weights=weights, minlength=self.n_bins)
+
+    def isovalue(self, fraction: float) -> float:
+        """Finds the isovalue, whose isosurfaces enclose a fraction of the density added to the histogram.
+
+        The density of the grid points with |psi| above the isovalue is summed from the largest values downwards;
+        within the bin crossing the target the isovalue is interpolated logarithmically.
+
+        Args:
+            fraction (float): Fraction of the density to be enclosed (0 < fraction < 1)
+
+        Returns:
+            float: Isovalue (positive, the negative isosurface uses the same value with opposite sign)
+        """
+        total = self.density.sum()
+        if total == 0.0:
+            return DEFAULT_ISOVALUE
+        enclosed = np.cumsum(self.density[::-1])
+        target = fraction * total
+        index = int(np.searchsorted(enclosed, target))
+        bin_density = self.density[self.n_bins - 1 - index]
+        previous = enclosed[index - 1] if index > 0 else 0.0
+        part = (target - previous) / bin_density if bin_density > 0.0 else 1.0
+        bin_width = (self.log_range[1] - self.log_range[0]) / self.n_bins
+        upper_edge = self.log_range[1] - index * bin_width
+        return float(10.0**(upper_edge - part * bin_width))
+
+def enclosed_density_isovalue(cube_file: str, fraction: float = DEFAULT_ENCLOSED_FRACTION) -> float:
+    """Calculates the isovalue enclosing a fraction of the integrated orbital density of a cube file.
+
+    The cube file (text or binary) is read slab by slab, so the memory needed does not grow with the grid. For a
+    density cube file (density.cube of orbital_engine.py) the fraction refers to the integral of |rho|.
+
+    Args:
+        cube_file (str): Cube file of the orbital or density
+        fraction (float): Fraction of the integral of |psi|^2 (of |rho|) enclosed by the isosurfaces
+
+    Returns:
+        float: Isovalue for the isosurfaces +isovalue and -isovalue
+    """
+    histogram = DensityHistogram(density_values=is_density_cube(read_cube_file_header(cube_file).comments))
+    for slab in iter_cube_file_slabs(cube_file):
+        histogram.add(slab)
+    return histogram.isovalue(fraction)
+
+def orbital_isovalues(cube_files: Sequence[str], fraction: Optional[float] = None) -> List[float]:
+    """Determines the isovalue of every orbital.
+
+    Args:
+        cube_files (Sequence[str]): Cube files of the orbitals
+        fraction (Optional[float]): Fraction of the density enclosed by the isosurfaces (None: fixed isovalue 0.02)
+
+    Returns:
+        List[float]: One isovalue per cube file
+    """
+    if fraction is None:
+        return [DEFAULT_ISOVALUE] * len(cube_files)
+    isovalues = []
+    for cube_file in cube_files:
+        isovalues.append(enclosed_density_isovalue(cube_file, fraction))
+        print(f"Isovalue of {cube_file}: {isovalues[-1]:.5f} (encloses {fraction:.0%} of the density)")
+    return isovalues
+
+if __name__ == '__main__':
+
+    # Check, if enough elements are present
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} [--fraction 0.85] CubeFile [CubeFile ...]")
+        exit()
+
+    arguments = sys.argv[1:]
+    fraction = DEFAULT_ENCLOSED_FRACTION
+    if arguments[0] == '--fraction':
+        fraction = float(arguments[1])
+        arguments = arguments[2:]
+    orbital_isovalues(arguments, fraction)
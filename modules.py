@@ -3,7 +3,31 @@ import shutil
 import subprocess
 import fileinput
 import tempfile
-from typing import List, Tuple
+from typing import List, Optional, Sequence, Tuple
+
+from grid_sizing import DEFAULT_GRID, FIXED_GRID, GRID_PRESETS, describe_grid, grid_table, plan_xyz_grid
+from instrumentation import RUN_LOG
+from orbital_selection import check_selection
+from process_runner import DFTB_TIMEOUT, SCC_PATIENCE, STALL_TIMEOUT, WAVEPLOT_TIMEOUT, ProcessJob, ProcessResult, describe, run_process_blocking
+
+# Highest angular momentum of the basis for every element known to the DFTB+ calculation
+MAX_ANGULAR_MOMENTUM = {'C': 'p', 'H': 's', 'N': 'p', 'O': 'p', 'S': 'p', 'Si': 'd'}
+
+# VMD procedure rendering the frames of the rotation movies (shipped next to this file)
+ROTATION_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rotation_animatied_gif.tcl")
+
+# Directory of the Slater-Koster files (MIO set) used by DFTB+
+SLATER_KOSTER_PREFIX = "/home/wxie/test-parameters/MIO/Compressed/"
+
+def available_cores() -> int:
+    """Returns the number of cores this process may run on.
+
+    Returns:
+        int: Number of usable cores (respects the CPU affinity set by the batch system)
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
 
 def read_elements(molecule_xyz: str) -> List[str]:
     """Reads all different elements from a molecule coordinates file.
@@ -15,6 +39,7 @@ def read_elements(molecule_xyz: str) -> List[str]:
         List[str]: List of all different elements in the molecule (every element is only listed once)
     """
     elements=[]
+    seen_elements = set()
     with open(molecule_xyz, 'r') as file:
         # Skip the first two lines
         next(file)
@@ -32,24 +57,24 @@ def read_elements(molecule_xyz: str) -> List[str]:
                     first_col = col
                     break
 
-            # Add the entry to elements if it's not already in the list
-            if first_col and first_col not in elements:
+            # Add the entry to elements if it's not already in the list (looked up in a set)
+            if first_col and first_col not in seen_elements:
+                seen_elements.add(first_col)
                 elements.append(first_col)
     
     return elements
 
-def run_dftb(molecule_xyz: str, elements: List[str]) -> None:
-    """Runs a DFTB+ calculation to generate the eigenvectors.
+def dftb_input(molecule_xyz: str, elements: List[str], read_initial_charges: bool = False) -> str:
+    """Generates the DFTB+ input for the calculation of the eigenvectors.
 
     Args:
         molecule_xyz (str): File containing the molecule coordinates in xyz format
         elements (List[str]): List of all different elements in the molecule
-    
+        read_initial_charges (bool): Start the SCC cycle from the charges in charges.bin (e.g. of the previous trajectory frame)
+
     Returns:
-        None: Runs DFTB+ calculation and writes the output to dftb.out
+        str: Content of the DFTB+ input file
     """
-
-    current_directory = os.getcwd()
     # Generating the Input filr for DFTB+
     dftb_in = "Geometry = xyzFormat{\n"
     dftb_in += f'  <<< "{molecule_xyz}"\n'
@@ -62,82 +87,105 @@ Hamiltonian = DFTB {
     
     MaxSCCIterations = 500
     
-    MaxAngularMomentum = {
 """
-    if 'C' in elements:
-        dftb_in += "          C = 'p'\n"
-    if 'H' in elements:
-        dftb_in += "          H = 's'\n"
-    if 'N' in elements:
-        dftb_in += "          N = 'p'\n"
-    if 'O' in elements:
-        dftb_in += "          O = 'p'\n"
-    if 'S' in elements:
-        dftb_in += "          S = 'p'\n"
-    if 'Si' in elements:
-        dftb_in += "          Si = 'd'\n"
-
-    dftb_in += '''    }
+    if read_initial_charges:
+        dftb_in += "    ReadInitialCharges = Yes\n"
+    dftb_in += """    MaxAngularMomentum = {
+"""
+    for element, angular_momentum in MAX_ANGULAR_MOMENTUM.items():
+        if element in elements:
+            dftb_in += f"          {element} = '{angular_momentum}'\n"
+
+    dftb_in += f'''    }}
     
-    SlaterKosterFiles = Type2FileNames {
-            Prefix = "/home/wxie/test-parameters/MIO/Compressed/"
+    SlaterKosterFiles = Type2FileNames {{
+            Prefix = "{SLATER_KOSTER_PREFIX}"
             Separator = ""
             Suffix = "-c.spl"
             LowerCaseTypeName = Yes
-            }
+            }}
             
-}
+}}
 
-Options = {
+Options = {{
     WriteDetailedXML = Yes
-}
+}}
 
-Analysis = {
+Analysis = {{
     WriteEigenvectors = Yes
-}'''
+}}'''
+    return dftb_in
 
-    #replacing lines
-    with open(f"{current_directory}/dftb_in.hsd", 'w') as file:
-        file.write(dftb_in)
-        file.close()
-    subprocess.run('/usr/local/bin/dftb+ dftb_in.hsd > dftb.out', shell=True)
-    return
+def write_dftb_input(molecule_xyz: str, elements: List[str], directory: str = '.', read_initial_charges: bool = False) -> str:
+    """Writes dftb_in.hsd into a directory, for DFTB+ and for waveplot (which includes it for the geometry).
 
-def input_waveplot(num_orbital: int) -> None:
-    """Runs a Waveplot calculation to generate the orbital cube files.
+    The xyz file is included by its absolute path, because waveplot includes dftb_in.hsd from other directories
+    (e.g. the shards of parallel_waveplot.py). DFTB+ results taken from the cache get a new dftb_in.hsd this way.
 
     Args:
-        num_orbital (int): Number of the orbital to be calculated
+        molecule_xyz (str): File containing the molecule coordinates in xyz format (relative to the directory)
+        elements (List[str]): List of all different elements in the molecule
+        directory (str): Directory of the calculation
+        read_initial_charges (bool): Start the SCC cycle from charges.bin in the directory
 
     Returns:
-        None: Runs Waveplot calculation and writes the output to waveplot.out
+        str: Path of dftb_in.hsd
     """
-    current_directory = os.getcwd()
+    current_directory = os.path.abspath(directory)
+    dftb_in = dftb_input(os.path.join(current_directory, molecule_xyz), elements, read_initial_charges)
+    with open(os.path.join(current_directory, 'dftb_in.hsd'), 'w') as file:
+        file.write(dftb_in)
+    return os.path.join(current_directory, 'dftb_in.hsd')
 
-    # Generate the input file for Waveplot
-    waveplot_in = '''#Genral Options
+def run_dftb(molecule_xyz: str, elements: List[str], directory: str = '.', read_initial_charges: bool = False) -> ProcessResult:
+    """Runs a DFTB+ calculation to generate the eigenvectors.
 
-Options = {
-    RealComponent = Yes                  # Plot real component of the wavefunction
-  PlottedSpins = { -1 1 }
-  PlottedLevels = {'''
-    waveplot_in += f' {num_orbital} '
-    waveplot_in += '''}                # Levels to plot
-    PlottedRegion =  OptimalCuboid { }    # Region to plot
-  NrOfPoints = { 80 80 80 }            # Number of grid points in each direction
-  NrOfCachedGrids = -1                 # Nr of cached grids (speeds up things)
-  Verbose = Yes                        # Wanna see a lot of messages?
-}
+    The SCC iterations are followed while DFTB+ runs: a calculation whose SCC error has not improved for SCC_PATIENCE
+    iterations is killed, as is one exceeding ORBITAL_DFTB_TIMEOUT or writing no output for ORBITAL_STALL_TIMEOUT seconds.
 
-DetailedXML = "detailed.xml"           # File containing the detailed xml output
-                                       # of DFTB+
-EigenvecBin = "eigenvec.bin"           # File cointaining the binary eigenvecs
+    Args:
+        molecule_xyz (str): File containing the molecule coordinates in xyz format (relative to the directory)
+        elements (List[str]): List of all different elements in the molecule
+        directory (str): Directory the calculation is run in
+        read_initial_charges (bool): Start the SCC cycle from charges.bin in the directory
+    
+    Returns:
+        ProcessResult: Outcome of the DFTB+ run (output in dftb.out)
+    """
 
+    current_directory = os.path.abspath(directory)
+    write_dftb_input(molecule_xyz, elements, directory, read_initial_charges)
+    result = run_process_blocking(ProcessJob('dftb+', ['/usr/local/bin/dftb+', 'dftb_in.hsd'], current_directory, 'dftb.out',
+                                             os.path.normpath(os.path.join(directory, molecule_xyz)), ['eigenvec.bin', 'detailed.xml', 'charges.bin'],
+                                             DFTB_TIMEOUT, STALL_TIMEOUT, SCC_PATIENCE, progress=True))
+    if result.status != 'finished':
+        print(describe(result))
+    return result
 
-# Definition of the basis
-Basis =   {
- Resolution = 0.005
-H = {
+def scc_iterations(dftb_out: str) -> int:
+    """Reads the number of SCC iterations from the output of a DFTB+ calculation.
+
+    Args:
+        dftb_out (str): Standard output of DFTB+ (dftb.out)
+
+    Returns:
+        int: Number of the last SCC iteration (0 if no SCC cycle was found)
+    """
+    iterations = 0
+    in_scc_table = False
+    with open(dftb_out, 'r') as file:
+        for line in file:
+            columns = line.split()
+            if columns and columns[0] == 'iSCC':
+                in_scc_table = True
+            elif in_scc_table and columns and columns[0].isdigit():
+                iterations = int(columns[0])
+            else:
+                in_scc_table = False
+    return iterations
+
+# Definition of the basis used by waveplot (Slater type orbitals of every supported element)
+WAVEPLOT_BASIS = '''H = {
   AtomicNumber = 1
   Orbital = {
     AngularMomentum = 0
@@ -492,25 +540,169 @@ I {
     }
   }
 }
+'''
 
-  <<+ "dftb_in.hsd"  
-}
+def waveplot_input(orbitals: List[int], n_points: Tuple[int, int, int] = (80, 80, 80), region: Optional[Tuple[Sequence[float], Sequence[Sequence[float]]]] = None,
+                   detailed_xml: str = 'detailed.xml', eigenvec_bin: str = 'eigenvec.bin', dftb_in: str = 'dftb_in.hsd') -> str:
+    """Generates the Waveplot input for all orbitals in a single PlottedLevels block.
+
+    Args:
+        orbitals (List[int]): Numbers of the orbitals to be calculated
+        n_points (Tuple[int, int, int]): Number of grid points in each direction
+        region (Optional[Tuple[Sequence[float], Sequence[Sequence[float]]]]): Origin and box vectors (Bohr) of the plotted region, OptimalCuboid if None
+        detailed_xml (str): detailed.xml written by DFTB+
+        eigenvec_bin (str): eigenvec.bin written by DFTB+
+        dftb_in (str): Input file of the DFTB+ calculation
+
+    Returns:
+        str: Content of the Waveplot input file
+    """
+    waveplot_in = '''#Genral Options
+
+Options = {
+    RealComponent = Yes                  # Plot real component of the wavefunction
+  PlottedSpins = { -1 1 }
+  PlottedLevels = {'''
+    waveplot_in += f' {" ".join(str(orbital) for orbital in orbitals)} '
+    waveplot_in += '''}                # Levels to plot
 '''
+    if region is None:
+        waveplot_in += '''    PlottedRegion =  OptimalCuboid { }    # Region to plot
+'''
+    else:
+        origin, box = region
+        waveplot_in += "    PlottedRegion = UserDefined {         # Region to plot\n"
+        waveplot_in += f"      Origin = {{ {origin[0]:.10f} {origin[1]:.10f} {origin[2]:.10f} }}\n"
+        waveplot_in += "      Box = {\n"
+        for vector in box:
+            waveplot_in += f"        {vector[0]:.10f} {vector[1]:.10f} {vector[2]:.10f}\n"
+        waveplot_in += "      }\n    }\n"
+    waveplot_in += f"  NrOfPoints = {{ {n_points[0]} {n_points[1]} {n_points[2]} }}            # Number of grid points in each direction\n"
+    waveplot_in += f'''  NrOfCachedGrids = -1                 # Nr of cached grids (speeds up things)
+  Verbose = Yes                        # Wanna see a lot of messages?
+}}
+
+DetailedXML = "{detailed_xml}"           # File containing the detailed xml output
+                                       # of DFTB+
+EigenvecBin = "{eigenvec_bin}"           # File cointaining the binary eigenvecs
+
+
+# Definition of the basis
+Basis =   {{
+ Resolution = 0.005
+'''
+    waveplot_in += WAVEPLOT_BASIS
+    waveplot_in += f'''
+  <<+ "{dftb_in}"  
+}}
+'''
+    return waveplot_in
+
+def input_waveplot(num_orbital: int) -> None:
+    """Runs a Waveplot calculation to generate the orbital cube files.
+
+    Args:
+        num_orbital (int): Number of the orbital to be calculated
+
+    Returns:
+        None: Runs Waveplot calculation and writes the output to waveplot.out
+    """
+    input_waveplot_batch([num_orbital])
+    return
+
+def input_waveplot_batch(orbitals: List[int], directory: str = '.', n_points: Tuple[int, int, int] = (80, 80, 80),
+                         region: Optional[Tuple[Sequence[float], Sequence[Sequence[float]]]] = None) -> List[str]:
+    """Runs a single Waveplot calculation for all requested orbitals.
+
+    Waveplot is started only once, so detailed.xml, eigenvec.bin and the basis are read only once
+    for the whole list of orbitals.
+
+    Args:
+        orbitals (List[int]): Numbers of the orbitals to be calculated
+        directory (str): Directory containing the DFTB+ output, the cube files are written there
+        n_points (Tuple[int, int, int]): Number of grid points in each direction
+        region (Optional[Tuple[Sequence[float], Sequence[Sequence[float]]]]): Origin and box vectors (Bohr) of the plotted region, OptimalCuboid if None
+
+    Returns:
+        List[str]: Names of the cube files (wp-1-1-<n>-real.cube) which have been written
+    """
+    current_directory = os.path.abspath(directory)
+    expected_files = [f"wp-1-1-{orbital}-real.cube" for orbital in orbitals]
+    # Cube files of an earlier run in the same directory must not be taken for results of this run
+    for cube_file in expected_files:
+        if os.path.isfile(os.path.join(current_directory, cube_file)):
+            os.remove(os.path.join(current_directory, cube_file))
+
+    # Generate the input file for Waveplot
+    waveplot_in = waveplot_input(orbitals, n_points, region)
     with open(f"{current_directory}/waveplot_in.hsd", 'w') as file:
         file.write(waveplot_in)
         file.close()
-    subprocess.run('/usr/local/bin/waveplot waveplot_in.hsd > waveplot.out', shell=True)
-    return
+    result = run_process_blocking(ProcessJob('waveplot', ['/usr/local/bin/waveplot', 'waveplot_in.hsd'], current_directory, 'waveplot.out',
+                                             ' '.join(str(orbital) for orbital in orbitals), expected_files,
+                                             WAVEPLOT_TIMEOUT, STALL_TIMEOUT))
+    if result.status != 'finished':
+        print(describe(result))
+        # A killed waveplot may have left a partially written cube file, none of its files is trusted
+        for cube_file in expected_files:
+            if os.path.isfile(os.path.join(current_directory, cube_file)):
+                os.remove(os.path.join(current_directory, cube_file))
+        return []
+
+    #Checking which cube files came out
+    return [cube_file for cube_file in expected_files if os.path.isfile(os.path.join(current_directory, cube_file))]
+
+def vmd_display_settings(background_color: str, molecule_style: str) -> str:
+    """Creates the VMD commands for the background color and the molecule style.
 
-def create_vmd_script(molecule_file: str,orbital_file: str, background_color: int, molecule_style: int, movie_maker: int) -> str:
+    Args:
+        background_color (str): Background color for the VMD visualization (1: white, 2: black)
+        molecule_style (str): Style for the molecule visualization (1: Lines, 2: CPK, 3: Licorice)
+
+    Returns:
+        str: VMD commands (the molecule is expected in the Tcl variable molecule)
+    """
+    vmd_script = ""
+    #Setting Background color
+    if background_color == '1':
+        vmd_script += f"""\
+        color Display Background 8
+        """
+    elif background_color == '2' or background_color == '':
+        vmd_script += f"""\
+        color Display Background 16
+        """
+
+    #Setting Molecule Style
+    if molecule_style == '1' or molecule_style == '':
+        vmd_script += f"""\
+        mol modstyle rep0 $molecule Lines
+        """
+    elif molecule_style == '2':
+        vmd_script += f"""\
+        mol modstyle rep0 $molecule CPK
+        """
+    elif molecule_style == '3':
+        vmd_script += f"""\
+        mol modstyle rep0 $molecule Licorice "0.2"
+        """
+
+    return vmd_script
+
+def create_vmd_script(molecule_file: str,orbital_file: str, background_color: int, molecule_style: int, isovalue: float = 0.02,
+                      preview_file: str = '') -> str:
     """Creates a VMD script file to visualize the molecule and the orbitals.
 
+    The rotation movies are made separately by movie.make_rotation_movies. With a preview file (a coarse level of the
+    cube, see cube_pyramid.py) the preview is shown first and replaced by the full grid as soon as it is loaded.
+
     Args:
         molecule_file (str): File containing the molecule coordinates in xyz format
         orbital_file (str): File containing the orbital data
         background_color (int): Background color for the VMD visualization (1: white, 2: black)
         molecule_style (int): Style for the molecule visualization (1: Lines, 2: CPK, 3: Licorice)
-        movie_maker (int): Whether a movie should be generated (1: yes, 2: no)
+        isovalue (float): Isovalue of the orbital surfaces
+        preview_file (str): Coarse cube file shown while the full grid is loaded (empty: no preview)
     
     Returns:
         str: Name of the temporary VMD script file
@@ -521,56 +713,40 @@ def create_vmd_script(molecule_file: str,orbital_file: str, background_color: in
     set molecule [mol new "{molecule_file}"]
 
     # Load MO data
-    set MO [mol addfile "{orbital_file}"]
+    set MO [mol addfile "{preview_file or orbital_file}"]
 
     # Display the molecule
     display resetview $molecule
 
     # Displaying positive MO
     mol color ColorID "0"
-    mol representation isosurface "0.02, Isosurface, Solid Surface"
+    mol representation isosurface "{isovalue:.6g}, Isosurface, Solid Surface"
     mol addrep $MO
 
     # Displaying negative MO
     mol color ColorID "1"
-    mol representation isosurface "-0.02, Isosurface, Solid Surface"
+    mol representation isosurface "{-isovalue:.6g}, Isosurface, Solid Surface"
     mol addrep $MO
 
     # Display update
     display update
     """
 
-    #Setting Background color
-    if background_color == '1':
-        vmd_script += f"""\
-        color Display Background 8
-        """
-    elif background_color == '2' or background_color == '':
-        vmd_script += f"""\
-        color Display Background 16
-        """
+    vmd_script += vmd_display_settings(background_color, molecule_style)
 
-    #Setting Molecule Style
-    if molecule_style == '1' or molecule_style == '':
-        vmd_script += f"""\
-        mol modstyle rep0 $molecule Lines
-        """
-    elif molecule_style == '2':
-        vmd_script += f"""\
-        mol modstyle rep0 $molecule CPK
-        """
-    elif molecule_style == '3':
+    if preview_file:
         vmd_script += f"""\
-        mol modstyle rep0 $molecule Licorice "0.2"
-        """
+    # Replacing the preview by the full grid (volume 1)
+    mol addfile "{orbital_file}" type cube waitfor all molid $MO
+    mol color ColorID 0
+    mol representation Isosurface {isovalue:.6g} 1 0 0 1 1
+    mol modrep 1 $MO
+    mol color ColorID 1
+    mol representation Isosurface {-isovalue:.6g} 1 0 0 1 1
+    mol modrep 2 $MO
+    display update
+    """
 
-    #Defining movie style
-    if movie_maker in ('yes', 'y'):
-        vmd_script += f"""\
-        source /data/user9/kevin/scripts/script_orbitals/rotation_animatied_gif.tcl
-        make_rotation_animated_gif
-        """
-            
     #writing into temporary file
     script_file = tempfile.NamedTemporaryFile(mode='w', delete=False)
     script_file.write(vmd_script)
@@ -579,6 +755,97 @@ def create_vmd_script(molecule_file: str,orbital_file: str, background_color: in
 
     return script_file.name
 
+def create_vmd_batch_script(molecule_file: str, orbital_files: List[str], background_color: str, molecule_style: str, movie_maker: str, n_frames: int = 36,
+                            isovalues: Optional[Sequence[float]] = None) -> str:
+    """Creates a VMD script rendering all orbitals of a molecule in a single (headless) VMD session.
+
+    The molecule is loaded once and every cube file is added to it as a volume data set. The isosurface
+    representations are switched from one volume to the next and a snapshot MO_<n>.tga (and the frames
+    MO_<n>_<axis>.NNNN.tga of the rotation movies) is rendered for every orbital with the Tachyon renderer built into VMD.
+
+    Args:
+        molecule_file (str): File containing the molecule coordinates in xyz format
+        orbital_files (List[str]): Cube files of the orbitals (wp-1-1-<n>-real.cube)
+        background_color (str): Background color for the VMD visualization (1: white, 2: black)
+        molecule_style (str): Style for the molecule visualization (1: Lines, 2: CPK, 3: Licorice)
+        movie_maker (str): Whether movie frames should be rendered (yes/y, no/n)
+        n_frames (int): Number of frames per rotation
+        isovalues (Optional[Sequence[float]]): Isovalue of every orbital (None: 0.02 for all orbitals)
+
+    Returns:
+        str: Name of the temporary VMD script file
+    """
+    if isovalues is None:
+        isovalues = [0.02] * len(orbital_files)
+    vmd_script = f"""\
+    # Load molecule from XYZ format
+    set molecule [mol new "{molecule_file}"]
+    """
+    for orbital_file in orbital_files:
+        vmd_script += f"""\
+    mol addfile "{orbital_file}" type cube waitfor all molid $molecule
+    """
+    vmd_script += f"""\
+    display resetview
+    display update
+
+    # Isosurfaces of the first volume, later switched to the other volumes
+    mol color ColorID 0
+    mol representation Isosurface {isovalues[0]:.6g} 0 0 0 1 1
+    mol addrep $molecule
+    mol color ColorID 1
+    mol representation Isosurface {-isovalues[0]:.6g} 0 0 0 1 1
+    mol addrep $molecule
+    """
+    vmd_script += vmd_display_settings(background_color, molecule_style)
+
+    if movie_maker in ('yes', 'y'):
+        vmd_script += f"""\
+    source {ROTATION_SCRIPT}
+    """
+    for volume, (orbital_file, isovalue) in enumerate(zip(orbital_files, isovalues)):
+        name = f"MO_{orbital_number(orbital_file)}"
+        vmd_script += f"""\
+    mol color ColorID 0
+    mol representation Isosurface {isovalue:.6g} {volume} 0 0 1 1
+    mol modrep 1 $molecule
+    mol color ColorID 1
+    mol representation Isosurface {-isovalue:.6g} {volume} 0 0 1 1
+    mol modrep 2 $molecule
+    display update
+    render TachyonInternal {name}.tga
+    """
+        if movie_maker in ('yes', 'y'):
+            for axis in ('y', 'x', 'z'):
+                vmd_script += f"""\
+    render_rotation_frames {axis} {n_frames} {360.0 / n_frames} TachyonInternal {name}_
+    """
+    vmd_script += """\
+    quit
+    """
+
+    #writing into temporary file (without the indentation of the blocks above)
+    script_file = tempfile.NamedTemporaryFile(mode='w', suffix='.tcl', delete=False)
+    script_file.write('\n'.join(line.strip() for line in vmd_script.splitlines()) + '\n')
+    script_file.close()
+
+    return script_file.name
+
+def orbital_number(orbital_file: str) -> str:
+    """Extracts the number of the orbital from the name of a waveplot cube file.
+
+    Args:
+        orbital_file (str): Cube file named wp-<k-point>-<spin>-<n>-real.cube
+
+    Returns:
+        str: Number of the orbital (the file name without extension if it does not follow the waveplot naming)
+    """
+    name = os.path.splitext(os.path.basename(orbital_file))[0]
+    parts = name.split('-')
+    if len(parts) == 5 and parts[0] == 'wp':
+        return parts[3]
+    return name
+
 def user_choices() -> Tuple[int,int,str]:
     """Prompts the user for choices regarding the visualization.
 
@@ -627,13 +894,12 @@ def user_choices() -> Tuple[int,int,str]:
     while True:
         print("------------------------------------------------------------------------")
         print("Do you want a movie of a 360° rotation around all three axes to be made?")
-        print("The generation of a movie takes about two minutes.")
         print("Options yes/y, no/n; Standard: no")
         print("------------------------------------------------------------------------")
         movie_maker = input("Do you want to make a movie? ")
         if movie_maker in ('yes','y'):
             print("You chose yes: You want to make a movie.")
-            print("The movies will be saved as rotation_x.gif, rotation_y.gif and rotaion_z.gif.")
+            print("The movies will be saved as rotation_x, rotation_y and rotation_z.")
             break
         elif movie_maker in ('no','n',''):
             print("You chose no: you don't want to make a movie.")
@@ -644,15 +910,263 @@ def user_choices() -> Tuple[int,int,str]:
 
     return background_color, molecule_style, movie_maker
 
-def launch_vmd_with_script(script_file: str) -> subprocess.Popen:
+def orbital_selection_choice() -> str:
+    """Prompts the user for the orbitals to be calculated.
+
+    Returns:
+        str: Orbital selection (level numbers, ranges, HOMO/LUMO offsets or energy windows, see orbital_selection.py)
+    """
+    while True:
+        print("------------------------------------------------------------------------")
+        print("Which Orbital(s) do you want to calculate?")
+        print("Enter numbers or ranges (e.g. 12, 14 or 10:15), levels relative to the HOMO and LUMO")
+        print("(e.g. HOMO-5:LUMO+5) or energy windows (e.g. E in [-8, -2] eV). Standard: HOMO:LUMO")
+        print("------------------------------------------------------------------------")
+        selection = input("Orbitals: ")
+        if selection.strip() == '':
+            selection = 'HOMO:LUMO'
+        try:
+            # The levels of HOMO, LUMO and energy windows are only known once DFTB+ has run
+            check_selection(selection)
+        except ValueError as error:
+            print(f"Invalid choice: {error}")
+            continue
+        print(f"You chose: {selection}")
+        return selection
+
+def density_choice() -> str:
+    """Prompts the user whether the selected orbitals are written one by one or as one accumulated density.
+
+    Returns:
+        str: Weighting of the density ('': one cube file per orbital, unit: sum of |psi|^2, occupation: occupation weighted)
+    """
+    while True:
+        print("------------------------------------------------------------------------")
+        print("Do you want the orbitals or their density?")
+        print("For one cube file per orbital enter 1 (Standard).")
+        print("For the density (sum of |psi|^2) of all selected orbitals in one cube file enter 2.")
+        print("For the occupation weighted density of all selected orbitals in one cube file enter 3.")
+        print("------------------------------------------------------------------------")
+        density = input("Cube files: ")
+        if density == '1' or density == '':
+            print("You chose 1: one cube file per orbital.")
+            return ''
+        elif density == '2':
+            print("You chose 2: density of the selected orbitals, calculated with the NumPy engine (density.cube).")
+            return 'unit'
+        elif density == '3':
+            print("You chose 3: occupation weighted density, calculated with the NumPy engine (density.cube).")
+            return 'occupation'
+        else:
+            print("Invalid choice.")
+
+def grid_choice(molecule_xyz: str) -> str:
+    """Prompts the user for the grid of the cube files, showing the size of every grid for the molecule.
+
+    Args:
+        molecule_xyz (str): xyz file of the molecule (its extent determines the number of grid points)
+
+    Returns:
+        str: Grid setting (preview, standard, publication, fixed or a spacing in Angstrom)
+    """
+    settings = list(GRID_PRESETS) + [FIXED_GRID]
+    descriptions = [line.split(None, 1)[1] for line in grid_table(molecule_xyz)]
+    while True:
+        print("------------------------------------------------------------------------")
+        print("How fine should the grid of the cube files be?")
+        for number, (setting, description) in enumerate(zip(settings, descriptions), 1):
+            standard = ' (Standard)' if setting == DEFAULT_GRID else ''
+            print(f"For the {setting} grid enter {number}{standard}.")
+            print(f"    {description}")
+        print("For another grid spacing enter it in Angstrom (e.g. 0.15).")
+        print("------------------------------------------------------------------------")
+        grid = input("Grid: ").strip()
+        if grid == '':
+            grid = str(settings.index(DEFAULT_GRID) + 1)
+        if grid.isdigit() and 1 <= int(grid) <= len(settings):
+            print(f"You chose {grid}: {settings[int(grid) - 1]} grid.")
+            return settings[int(grid) - 1]
+        try:
+            plan = plan_xyz_grid(molecule_xyz, grid)
+        except ValueError as error:
+            print(f"Invalid choice: {error}")
+            continue
+        print(f"You chose a grid spacing of {grid} Angstrom: {describe_grid(plan.n_points, plan.preset)}.")
+        return grid
+
+def engine_choice() -> str:
+    """Prompts the user for the program used to calculate the orbital cube files.
+
+    Returns:
+        str: Cube generation engine (1: waveplot, 2: NumPy engine in orbital_engine.py, 3: parallel waveplot)
+    """
+    while True:
+        print("------------------------------------------------------------------------")
+        print("Which program do you want to use for the calculation of the cube files?")
+        print("For waveplot enter 1 (Standard).")
+        print("For the NumPy engine (no waveplot needed) enter 2.")
+        print("For waveplot running on all available cores enter 3.")
+        print("------------------------------------------------------------------------")
+        engine = input("Cube engine: ")
+        if engine == '1' or engine == '':
+            print("You chose 1: waveplot.")
+            break
+        elif engine == '2':
+            print("You chose 2: NumPy engine.")
+            break
+        elif engine == '3':
+            print("You chose 3: parallel waveplot.")
+            break
+        else:
+            print("Invalid choice.")
+
+    return engine
+
+def movie_choices() -> Tuple[str, int]:
+    """Prompts the user for the format and the number of frames of the rotation movies.
+
+    Returns:
+        Tuple[str, int]: Movie format (gif, apng, mp4) and number of frames per rotation
+    """
+    while True:
+        print("------------------------------------------------------------------------")
+        print("Which format do you want the movies to be saved in?")
+        print("Options gif (Standard), apng, mp4 (needs ffmpeg)")
+        print("------------------------------------------------------------------------")
+        movie_format = input("Movie format: ")
+        if movie_format == '':
+            movie_format = 'gif'
+        if movie_format in ('gif', 'apng', 'mp4'):
+            print(f"You chose {movie_format}.")
+            break
+        else:
+            print("Invalid choice.")
+
+    while True:
+        print("------------------------------------------------------------------------")
+        print("How many frames should one rotation of 360° have? (Standard: 36)")
+        print("------------------------------------------------------------------------")
+        n_frames = input("Number of frames: ")
+        if n_frames == '':
+            n_frames = '36'
+        if n_frames.isdigit() and int(n_frames) > 0:
+            print(f"You chose {n_frames} frames ({360 / int(n_frames):g}° per frame).")
+            break
+        else:
+            print("Invalid choice.")
+
+    return movie_format, int(n_frames)
+
+def isovalue_choice() -> Optional[float]:
+    """Prompts the user for the way the isovalue of the orbital surfaces is chosen.
+
+    Returns:
+        Optional[float]: Fraction of the orbital density enclosed by the isosurfaces (None: fixed isovalue 0.02)
+    """
+    while True:
+        print("------------------------------------------------------------------------")
+        print("How should the isovalue of the orbital surfaces be chosen?")
+        print("For the fixed isovalue 0.02 enter 1 (Standard).")
+        print("For an isovalue calculated for every orbital from the cube file enter 2.")
+        print("------------------------------------------------------------------------")
+        isovalue_mode = input("Isovalue: ")
+        if isovalue_mode == '1' or isovalue_mode == '':
+            print("You chose 1: fixed isovalue 0.02.")
+            return None
+        elif isovalue_mode == '2':
+            break
+        else:
+            print("Invalid choice.")
+
+    while True:
+        print("------------------------------------------------------------------------")
+        print("Which fraction of the orbital density should the isosurfaces enclose? (Standard: 0.85)")
+        print("------------------------------------------------------------------------")
+        fraction = input("Fraction: ")
+        if fraction == '':
+            fraction = '0.85'
+        try:
+            if 0.0 < float(fraction) < 1.0:
+                print(f"You chose 2: isosurfaces enclosing {float(fraction):.0%} of the density.")
+                return float(fraction)
+        except ValueError:
+            pass
+        print("Invalid choice.")
+
+def preview_choice() -> int:
+    """Prompts the user for the resolution of the grid loaded into VMD.
+
+    Returns:
+        int: Number of grid points per direction of the coarse level (0: full grid only)
+    """
+    while True:
+        print("------------------------------------------------------------------------")
+        print("Which grid should be loaded into VMD?")
+        print("For the full grid enter 1 (Standard).")
+        print("For a fast preview (40 points per direction) enter 2. Interactive VMD replaces it by the full grid")
+        print("as soon as that is loaded, headless rendering uses the preview for all images.")
+        print("For thumbnails (20 points per direction) enter 3.")
+        print("------------------------------------------------------------------------")
+        preview = input("Grid: ")
+        if preview == '1' or preview == '':
+            print("You chose 1: full grid.")
+            return 0
+        elif preview == '2':
+            print("You chose 2: preview with 40 points per direction.")
+            return 40
+        elif preview == '3':
+            print("You chose 3: thumbnails with 20 points per direction.")
+            return 20
+        else:
+            print("Invalid choice.")
+
+def render_mode_choice() -> str:
+    """Prompts the user for the way the orbitals are visualized.
+
+    Returns:
+        str: Render mode (1: one interactive VMD window per orbital, 2: all orbitals rendered headless in one VMD session,
+             3: several headless VMD processes at once, 4: built-in renderer without VMD)
+    """
+    while True:
+        print("------------------------------------------------------------------------")
+        print("How do you want the orbitals to be visualized?")
+        print("For one interactive VMD window per orbital enter 1 (Standard).")
+        print("For rendering images of all orbitals in one VMD session without display enter 2.")
+        print("For rendering images with several VMD processes at once without display enter 3.")
+        print("For rendering images with the built-in renderer (no VMD needed) enter 4.")
+        print("------------------------------------------------------------------------")
+        render_mode = input("Render mode: ")
+        if render_mode == '1' or render_mode == '':
+            print("You chose 1: interactive VMD.")
+            break
+        elif render_mode == '2':
+            print("You chose 2: batch rendering, the images will be saved as MO_<n>.tga.")
+            break
+        elif render_mode == '3':
+            print(f"You chose 3: parallel rendering on {available_cores()} cores, the images will be saved as MO_<n>.tga.")
+            break
+        elif render_mode == '4':
+            print("You chose 4: built-in renderer, the images will be saved as MO_<n>.png.")
+            break
+        else:
+            print("Invalid choice.")
+
+    return render_mode
+
+def launch_vmd_with_script(script_file: str, headless: bool = False, directory: str = '.') -> subprocess.Popen:
     """Launches VMD with the specified script file.
 
     Args:
         script_file (str): Name of the VMD script file
+        headless (bool): Run VMD in text mode without a display
+        directory (str): Working directory of VMD (images and movie frames are written there)
 
     Returns:
         subprocess.Popen: Process object for the VMD process
     """
     # Launch VMD with the specified script file
-    vmd_process = subprocess.Popen(['vmd', '-e', script_file])
+    if headless:
+        vmd_process = RUN_LOG.popen('vmd', ['vmd', '-dispdev', 'text', '-e', script_file], cwd=directory)
+    else:
+        vmd_process = RUN_LOG.popen('vmd', ['vmd', '-e', script_file], cwd=directory)
     return vmd_process
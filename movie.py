@@ -0,0 +1,493 @@
+import os
+import shutil
+import struct
+import subprocess
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, List, NamedTuple, Optional
+
+import numpy as np
+
+from instrumentation import RUN_LOG
+from modules import ROTATION_SCRIPT, vmd_display_settings
+from workspace import Workspace, publish
+
+class MovieSettings(NamedTuple):
+    """Settings of the rotation movies."""
+    format: str = 'gif'
+    n_frames: int = 36
+    delta: bool = True
+    delay: int = 100
+    loop: int = 4
+
+# File extension of every movie format
+MOVIE_EXTENSIONS = {'gif': 'gif', 'apng': 'png', 'mp4': 'mp4'}
+
+# Rendering order of the rotation axes
+ROTATION_AXES = ('y', 'x', 'z')
+
+def read_tga(tga_file: str) -> np.ndarray:
+    """Reads an uncompressed true color TGA image (as written by the Tachyon renderer of VMD).
+
+    Args:
+        tga_file (str): Name of the TGA file
+
+    Returns:
+        np.ndarray: RGB image with shape (height, width, 3), first row at the top
+    """
+    with open(tga_file, 'rb') as file:
+        header = file.read(18)
+        id_length, color_map_type, image_type = header[0], header[1], header[2]
+        width, height, bits_per_pixel, descriptor = struct.unpack('<HHBB', header[12:18])
+        if image_type != 2 or color_map_type != 0 or bits_per_pixel not in (24, 32):
+            raise ValueError(f"{tga_file} is not an uncompressed true color TGA image.")
+        file.read(id_length)
+        pixels = np.frombuffer(file.read(width * height * bits_per_pixel // 8), dtype=np.uint8)
+    image = pixels.reshape(height, width, bits_per_pixel // 8)[:, :, 2::-1]
+    if not descriptor & 0x20:
+        image = image[::-1]
+    return np.ascontiguousarray(image)
+
+def build_palette(frame: np.ndarray, size: int = 255) -> np.ndarray:
+    """Builds a palette from the most frequent colors of a frame (quantized to 5 bits per channel).
+
+    The palette is shared by all frames of a movie; a rotating molecule adds hardly any new colors.
+
+    Args:
+        frame (np.ndarray): RGB image with shape (height, width, 3)
+        size (int): Maximal number of colors
+
+    Returns:
+        np.ndarray: Palette with shape (number of colors, 3)
+    """
+    bins = _color_bins(frame).ravel()
+    counts = np.bincount(bins, minlength=32768)
+    used = np.nonzero(counts)[0]
+    used = used[np.argsort(counts[used])[::-1]][:size]
+    palette = np.stack([(used >> 10) & 31, (used >> 5) & 31, used & 31], axis=1) * 8 + 4
+    return palette.astype(np.uint8)
+
+def _color_bins(frame: np.ndarray) -> np.ndarray:
+    """Maps every pixel to its bin in the 32x32x32 color cube.
+
+    Args:
+        frame (np.ndarray): RGB image with shape (height, width, 3)
+
+    Returns:
+        np.ndarray: Bin index of every pixel with shape (height, width)
+    """
+    quantized = frame.astype(np.int32) >> 3
+    return (quantized[:, :, 0] << 10) | (quantized[:, :, 1] << 5) | quantized[:, :, 2]
+
+def palette_lookup(palette: np.ndarray) -> np.ndarray:
+    """Finds the nearest palette color for every bin of the 32x32x32 color cube.
+
+    Args:
+        palette (np.ndarray): Palette with shape (number of colors, 3)
+
+    Returns:
+        np.ndarray: Palette index of every color bin
+    """
+    bins = np.arange(32768)
+    centers = np.stack([(bins >> 10) & 31, (bins >> 5) & 31, bins & 31], axis=1) * 8 + 4
+    lookup = np.zeros(32768, dtype=np.uint8)
+    for start in range(0, 32768, 4096):
+        distances = ((centers[start:start + 4096, None, :] - palette[None, :, :].astype(int)) ** 2).sum(axis=2)
+        lookup[start:start + 4096] = np.argmin(distances, axis=1)
+    return lookup
+
+def lzw_encode(indices: bytes, min_code_size: int = 8) -> bytes:
+    """Compresses palette indices with the variable code length LZW variant of GIF.
+
+    Args:
+        indices (bytes): Palette index of every pixel
+        min_code_size (int): Minimal code size (bits per palette index)
+
+    Returns:
+        bytes: Compressed data (without the sub-block framing)
+    """
+    clear_code = 1 << min_code_size
+    end_code = clear_code + 1
+    output = bytearray()
+    bit_buffer = 0
+    bit_count = 0
+
+    code_size = min_code_size + 1
+    next_code = end_code + 1
+    table = {}
+
+    def emit(code: int) -> None:
+        nonlocal bit_buffer, bit_count
+        bit_buffer |= code << bit_count
+        bit_count += code_size
+        while bit_count >= 8:
+            output.append(bit_buffer & 0xFF)
+            bit_buffer >>= 8
+            bit_count -= 8
+
+    emit(clear_code)
+    if len(indices) == 0:
+        emit(end_code)
+        return bytes(output) + (bytes([bit_buffer]) if bit_count else b'')
+    prefix = indices[0]
+    for index in indices[1:]:
+        key = (prefix << 8) | index
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        emit(prefix)
+        if next_code < 4096:
+            table[key] = next_code
+            next_code += 1
+            if next_code > (1 << code_size) and code_size < 12:
+                code_size += 1
+        else:
+            emit(clear_code)
+            table = {}
+            code_size = min_code_size + 1
+            next_code = end_code + 1
+        prefix = index
+    emit(prefix)
+    emit(end_code)
+    if bit_count:
+        output.append(bit_buffer & 0xFF)
+    return bytes(output)
+
+def _changed_box(previous: Optional[np.ndarray], current: np.ndarray) -> Optional[tuple]:
+    """Finds the bounding box of the pixels which differ between two frames.
+
+    Args:
+        previous (Optional[np.ndarray]): Previous frame (None for the first frame)
+        current (np.ndarray): Current frame
+
+    Returns:
+        Optional[tuple]: (top, bottom, left, right) of the changed region, None if nothing changed
+    """
+    if previous is None:
+        return (0, current.shape[0], 0, current.shape[1])
+    changed = previous != current
+    if changed.ndim == 3:
+        changed = changed.any(axis=2)
+    rows = np.nonzero(changed.any(axis=1))[0]
+    if len(rows) == 0:
+        return None
+    columns = np.nonzero(changed.any(axis=0))[0]
+    return (rows[0], rows[-1] + 1, columns[0], columns[-1] + 1)
+
+class GifWriter:
+    """Streaming GIF encoder with one palette for all frames and optional frame delta optimization."""
+
+    def __init__(self, movie_file: str, settings: MovieSettings):
+        self.file: BinaryIO = open(movie_file, 'wb')
+        self.settings = settings
+        self.lookup = None
+        self.previous = None
+
+    def start(self, frame: np.ndarray) -> None:
+        """Writes the header with the palette built from the first frame."""
+        palette = build_palette(frame)
+        self.lookup = palette_lookup(palette)
+        # Index 255 is reserved for transparent (unchanged) pixels
+        table = np.zeros((256, 3), dtype=np.uint8)
+        table[:len(palette)] = palette
+        height, width = frame.shape[:2]
+        self.file.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0xF7, 0, 0))
+        self.file.write(table.tobytes())
+        self.file.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01' + struct.pack('<H', self.settings.loop) + b'\x00')
+
+    def add_frame(self, frame: np.ndarray) -> None:
+        """Quantizes and appends a frame.
+
+        Args:
+            frame (np.ndarray): RGB image with shape (height, width, 3)
+        """
+        if self.lookup is None:
+            self.start(frame)
+        indices = self.lookup[_color_bins(frame)]
+        box = _changed_box(self.previous if self.settings.delta else None, indices)
+        if box is None:
+            box = (0, 1, 0, 1)
+        top, bottom, left, right = box
+        region = indices[top:bottom, left:right]
+        transparent_flag = 0
+        if self.settings.delta and self.previous is not None:
+            region = np.where(region == self.previous[top:bottom, left:right], 255, region).astype(np.uint8)
+            transparent_flag = 1
+        self.previous = indices
+
+        # Graphic control extension (disposal: keep the previous frame), image descriptor and image data
+        self.file.write(b'\x21\xF9\x04' + struct.pack('<BHBB', 0x04 | transparent_flag, self.settings.delay, 255, 0))
+        self.file.write(b'\x2C' + struct.pack('<HHHHB', left, top, right - left, bottom - top, 0))
+        data = lzw_encode(region.tobytes())
+        self.file.write(b'\x08')
+        for start in range(0, len(data), 255):
+            block = data[start:start + 255]
+            self.file.write(bytes([len(block)]) + block)
+        self.file.write(b'\x00')
+
+    def close(self) -> None:
+        """Writes the trailer and closes the file."""
+        self.file.write(b'\x3B')
+        self.file.close()
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    """Creates a PNG chunk with length and checksum."""
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xFFFFFFFF)
+
+def write_png(png_file: str, image: np.ndarray) -> None:
+    """Writes an RGB image as PNG file.
+
+    Args:
+        png_file (str): Name of the PNG file
+        image (np.ndarray): RGB image with shape (height, width, 3), first row at the top
+
+    Returns:
+        None: Writes the PNG file
+    """
+    height, width = image.shape[:2]
+    rows = np.concatenate([np.zeros((height, 1), dtype=np.uint8), image.reshape(height, -1)], axis=1)
+    with open(png_file, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        file.write(_png_chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        file.write(_png_chunk(b'IEND', b''))
+
+class ApngWriter:
+    """Streaming animated PNG encoder with optional frame delta optimization (only the changed region is stored)."""
+
+    def __init__(self, movie_file: str, settings: MovieSettings):
+        self.file: BinaryIO = open(movie_file, 'wb')
+        self.settings = settings
+        self.previous = None
+        self.sequence = 0
+
+    def add_frame(self, frame: np.ndarray) -> None:
+        """Compresses and appends a frame.
+
+        Args:
+            frame (np.ndarray): RGB image with shape (height, width, 3)
+        """
+        height, width = frame.shape[:2]
+        if self.previous is None:
+            self.file.write(b'\x89PNG\r\n\x1a\n')
+            self.file.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+            self.file.write(_png_chunk(b'acTL', struct.pack('>II', self.settings.n_frames, self.settings.loop)))
+        box = _changed_box(self.previous if self.settings.delta else None, frame)
+        top, bottom, left, right = box if box is not None else (0, 1, 0, 1)
+        region = frame[top:bottom, left:right]
+        self.previous = frame
+
+        self.file.write(_png_chunk(b'fcTL', struct.pack('>IIIIIHHBB', self.sequence, right - left, bottom - top, left, top,
+                                                        self.settings.delay, 100, 0, 0)))
+        self.sequence += 1
+        rows = np.concatenate([np.zeros((region.shape[0], 1), dtype=np.uint8), region.reshape(region.shape[0], -1)], axis=1)
+        data = zlib.compress(rows.tobytes(), 6)
+        if self.sequence == 1:
+            self.file.write(_png_chunk(b'IDAT', data))
+        else:
+            self.file.write(_png_chunk(b'fdAT', struct.pack('>I', self.sequence) + data))
+            self.sequence += 1
+
+    def close(self) -> None:
+        """Writes the end chunk and closes the file."""
+        self.file.write(_png_chunk(b'IEND', b''))
+        self.file.close()
+
+class Mp4Writer:
+    """Streams raw frames into ffmpeg to encode a H.264 MP4 movie."""
+
+    def __init__(self, movie_file: str, settings: MovieSettings):
+        self.movie_file = movie_file
+        self.settings = settings
+        self.process = None
+
+    def add_frame(self, frame: np.ndarray) -> None:
+        """Sends a frame to ffmpeg.
+
+        Args:
+            frame (np.ndarray): RGB image with shape (height, width, 3)
+        """
+        if self.process is None:
+            if shutil.which('ffmpeg') is None:
+                raise RuntimeError("MP4 movies need ffmpeg, which was not found.")
+            height, width = frame.shape[:2]
+            self.process = RUN_LOG.popen('ffmpeg', ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                                                    '-s', f'{width}x{height}', '-r', f'{100 / self.settings.delay}', '-i', '-',
+                                                    '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', self.movie_file],
+                                         os.path.basename(self.movie_file), [self.movie_file], stdin=subprocess.PIPE)
+        self.process.stdin.write(np.ascontiguousarray(frame).tobytes())
+
+    def close(self) -> None:
+        """Finishes the encoding."""
+        if self.process is not None:
+            self.process.stdin.close()
+            RUN_LOG.wait(self.process)
+
+MOVIE_WRITERS = {'gif': GifWriter, 'apng': ApngWriter, 'mp4': Mp4Writer}
+
+def encode_frame_stream(frame_prefix: str, movie_file: str, settings: MovieSettings, timeout: float = 600.0) -> str:
+    """Encodes the frames of one rotation into a movie while they are being rendered.
+
+    Frame k (<frame_prefix>.NNNN.tga) is complete as soon as frame k+1 or the marker <frame_prefix>.done exists.
+    Every frame is deleted after it has been encoded.
+
+    Args:
+        frame_prefix (str): Path of the frames without frame number and extension
+        movie_file (str): Name of the movie
+        settings (MovieSettings): Format, number of frames and frame delay
+        timeout (float): Seconds to wait for a frame before giving up
+
+    Returns:
+        str: Name of the movie, empty if not all frames could be encoded
+    """
+    writer = MOVIE_WRITERS[settings.format](movie_file, settings)
+    done_file = f"{frame_prefix}.done"
+    encoded_frames = 0
+    try:
+        for frame in range(0, settings.n_frames):
+            frame_file = f"{frame_prefix}.{frame:04d}.tga"
+            next_frame_file = f"{frame_prefix}.{frame + 1:04d}.tga"
+            waited = 0.0
+            while not (os.path.isfile(next_frame_file) or os.path.isfile(done_file)) and waited < timeout:
+                time.sleep(0.05)
+                waited += 0.05
+            if not os.path.isfile(frame_file):
+                break
+            writer.add_frame(read_tga(frame_file))
+            os.remove(frame_file)
+            encoded_frames += 1
+    finally:
+        writer.close()
+    if encoded_frames != settings.n_frames:
+        os.remove(movie_file)
+        return ''
+    return movie_file
+
+def encode_image_files(image_files: List[str], movie_file: str, settings: MovieSettings) -> str:
+    """Encodes existing images (e.g. the images of the trajectory frames) into a movie, one image per frame.
+
+    Args:
+        image_files (List[str]): TGA images in the order of the frames
+        movie_file (str): Name of the movie
+        settings (MovieSettings): Format and frame delay (the number of frames is given by the images)
+
+    Returns:
+        str: Name of the movie
+    """
+    writer = MOVIE_WRITERS[settings.format](movie_file, settings._replace(n_frames=len(image_files)))
+    try:
+        for image_file in image_files:
+            writer.add_frame(read_tga(image_file))
+    finally:
+        writer.close()
+    return movie_file
+
+def movie_files(prefix: str, settings: MovieSettings) -> List[str]:
+    """Returns the names of the rotation movies.
+
+    Args:
+        prefix (str): Prefix of the movies
+        settings (MovieSettings): Format of the movies
+
+    Returns:
+        List[str]: Movie for every axis (<prefix>rotation_<axis>.<extension>)
+    """
+    return [f"{prefix}rotation_{axis}.{MOVIE_EXTENSIONS[settings.format]}" for axis in ROTATION_AXES]
+
+def stream_movies(process: subprocess.Popen, prefixes: List[str], settings: MovieSettings, directory: str = '.') -> List[str]:
+    """Encodes the rotation movies rendered by a running VMD process, with one encoder process per axis.
+
+    Args:
+        process (subprocess.Popen): VMD process rendering the frames (see create_vmd_batch_script)
+        prefixes (List[str]): Prefixes of the frames, in the order they are rendered
+        settings (MovieSettings): Format and number of frames
+        directory (str): Working directory of the VMD process
+
+    Returns:
+        List[str]: Movies which have been written
+    """
+    with ProcessPoolExecutor(max_workers=len(ROTATION_AXES)) as executor:
+        futures = []
+        for prefix in prefixes:
+            for axis, movie_file in zip(ROTATION_AXES, movie_files(prefix, settings)):
+                futures.append(executor.submit(encode_frame_stream, os.path.join(directory, f"{prefix}{axis}"),
+                                               os.path.join(directory, movie_file), settings))
+        RUN_LOG.wait(process)
+        # Frames which VMD did not render any more will not come
+        for prefix in prefixes:
+            for axis in ROTATION_AXES:
+                open(os.path.join(directory, f"{prefix}{axis}.done"), 'w').close()
+        movies = [future.result() for future in futures]
+
+    for prefix in prefixes:
+        for axis in ROTATION_AXES:
+            os.remove(os.path.join(directory, f"{prefix}{axis}.done"))
+    return [os.path.basename(movie) for movie in movies if movie]
+
+def make_rotation_movies(molecule_file: str, orbital_file: str, background_color: str, molecule_style: str, prefix: str = '',
+                         settings: MovieSettings = MovieSettings(), isovalue: float = 0.02) -> List[str]:
+    """Renders and encodes the rotation movies of one orbital, with one headless VMD process per axis.
+
+    Args:
+        molecule_file (str): File containing the molecule coordinates
+        orbital_file (str): Cube file of the orbital
+        background_color (str): Background color for the VMD visualization (1: white, 2: black)
+        molecule_style (str): Style for the molecule visualization (1: Lines, 2: CPK, 3: Licorice)
+        prefix (str): Prefix of the movies (<prefix>rotation_<axis>.<extension>)
+        settings (MovieSettings): Format, number of frames and frame delay
+        isovalue (float): Isovalue of the orbital surfaces
+
+    Returns:
+        List[str]: Movies which have been written
+    """
+    workspace = Workspace(f'{prefix}movie_').create()
+    scratch_directory = workspace.path
+    processes = []
+    script_files = []
+    for axis in ROTATION_AXES:
+        vmd_script = f"""\
+set molecule [mol new "{os.path.abspath(molecule_file)}"]
+mol addfile "{os.path.abspath(orbital_file)}" type cube waitfor all molid $molecule
+display resetview
+mol color ColorID 0
+mol representation Isosurface {isovalue} 0 0 0 1 1
+mol addrep $molecule
+mol color ColorID 1
+mol representation Isosurface {-isovalue} 0 0 0 1 1
+mol addrep $molecule
+"""
+        vmd_script += '\n'.join(line.strip() for line in vmd_display_settings(background_color, molecule_style).splitlines()) + '\n'
+        vmd_script += f"""\
+source {ROTATION_SCRIPT}
+render_rotation_frames {axis} {settings.n_frames} {360.0 / settings.n_frames}
+quit
+"""
+        script_file = os.path.join(scratch_directory, f"movie_{axis}.tcl")
+        with open(script_file, 'w') as file:
+            file.write(vmd_script)
+        script_files.append(script_file)
+        with open(os.path.join(scratch_directory, f"vmd_{axis}.log"), 'w') as log:
+            processes.append(RUN_LOG.popen('vmd', ['vmd', '-dispdev', 'text', '-e', script_file], f"{prefix}rotation_{axis}", cwd=scratch_directory,
+                                           stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL))
+
+    written = []
+    with ProcessPoolExecutor(max_workers=len(ROTATION_AXES)) as executor:
+        futures = [executor.submit(encode_frame_stream, os.path.join(scratch_directory, axis),
+                                   os.path.join(scratch_directory, f"rotation_{axis}.{MOVIE_EXTENSIONS[settings.format]}"), settings)
+                   for axis in ROTATION_AXES]
+        for axis, process in zip(ROTATION_AXES, processes):
+            RUN_LOG.wait(process)
+            open(os.path.join(scratch_directory, f"{axis}.done"), 'w').close()
+        for axis, future in zip(ROTATION_AXES, futures):
+            movie_file = future.result()
+            if movie_file:
+                target = f"{prefix}rotation_{axis}.{MOVIE_EXTENSIONS[settings.format]}"
+                written.append(publish(movie_file, target))
+            else:
+                print(f"Movie of the rotation around {axis} failed (see {scratch_directory}/vmd_{axis}.log).")
+
+    if len(written) == len(ROTATION_AXES):
+        workspace.remove()
+    return written
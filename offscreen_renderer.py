@@ -0,0 +1,290 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from cube_io import load_cube
+from isosurface_mesh import BOHR_TO_ANGSTROM, merge_meshes, molecule_meshes, orbital_meshes
+from isovalue import DEFAULT_ISOVALUE, enclosed_density_isovalue
+from modules import available_cores, orbital_number
+from movie import MOVIE_EXTENSIONS, MOVIE_WRITERS, ROTATION_AXES, MovieSettings, write_png
+
+# Size of the images and movie frames (width, height) in pixels
+IMAGE_SIZE = (512, 512)
+
+# Background colors (RGB) for the choices of vmd_display_settings (1: white, 2 or empty: black)
+BACKGROUND_COLORS = {'1': (255, 255, 255), '2': (0, 0, 0), '': (0, 0, 0)}
+
+# Atom scale (relative to the covalent radius), common atom radius and bond radius (Angstrom) of the molecule styles
+# (1 or empty: Lines, 2: CPK, 3: Licorice); the thin bonds with small joints stand in for the lines of VMD
+MOLECULE_STYLES = {'1': (0.0, 0.0, 0.04), '': (0.0, 0.0, 0.04), '2': (0.6, 0.0, 0.1), '3': (0.0, 0.2, 0.2)}
+
+# Direction towards the light (camera coordinates, the camera looks along -z) and weights of the Phong shading
+LIGHT_DIRECTION = np.array([-0.3, 0.4, 1.0]) / np.linalg.norm([-0.3, 0.4, 1.0])
+AMBIENT, DIFFUSE, SPECULAR, SHININESS = 0.25, 0.7, 0.3, 30.0
+
+# Maximum number of candidate pixels tested at once by the rasterizer
+RASTER_CHUNK_SIZE = 2**22
+
+class Scene(NamedTuple):
+    """Triangles of an orbital and its molecule, ready for rendering."""
+    vertices: np.ndarray
+    normals: np.ndarray
+    colors: np.ndarray
+    faces: np.ndarray
+    center: np.ndarray
+    radius: float
+    background: Tuple[int, int, int]
+
+def build_scene(cube_file: str, isovalue: float, background_color: str, molecule_style: str) -> Scene:
+    """Extracts the isosurfaces of an orbital and the molecule in the chosen style.
+
+    The view is fitted to a sphere around all atoms and surfaces, so the scale stays the same in all rotation frames.
+
+    Args:
+        cube_file (str): Cube file of the orbital (text or binary)
+        isovalue (float): Isovalue of the surfaces
+        background_color (str): Background color (1: white, 2: black)
+        molecule_style (str): Style for the molecule (1: Lines, 2: CPK, 3: Licorice)
+
+    Returns:
+        Scene: Triangles, view sphere and background color
+    """
+    header, data = load_cube(cube_file)
+    atom_scale, atom_radius, bond_radius = MOLECULE_STYLES.get(molecule_style, MOLECULE_STYLES['1'])
+    meshes = orbital_meshes(header, data, isovalue)
+    meshes += molecule_meshes(np.asarray(header.atomic_numbers), np.asarray(header.coordinates) * BOHR_TO_ANGSTROM,
+                              atom_scale, atom_radius, bond_radius)
+    mesh = merge_meshes(meshes)
+    center = (mesh.vertices.min(axis=0) + mesh.vertices.max(axis=0)) / 2.0 if len(mesh.vertices) else np.zeros(3)
+    radius = float(np.linalg.norm(mesh.vertices - center, axis=1).max()) if len(mesh.vertices) else 1.0
+    return Scene(mesh.vertices, mesh.normals, mesh.colors.astype(float) / 255.0, mesh.faces, center, max(radius, 1e-6),
+                 BACKGROUND_COLORS.get(background_color, BACKGROUND_COLORS['2']))
+
+def rotation_matrices(axis: str, angles: np.ndarray) -> np.ndarray:
+    """Builds the rotation matrices around a screen axis for many angles at once.
+
+    Args:
+        axis (str): Screen axis (x, y or z)
+        angles (np.ndarray): Angles in degrees
+
+    Returns:
+        np.ndarray: Rotation matrices with shape (len(angles), 3, 3)
+    """
+    first, second = {'x': (1, 2), 'y': (2, 0), 'z': (0, 1)}[axis]
+    radians = np.radians(np.asarray(angles, dtype=float))
+    matrices = np.tile(np.eye(3), (len(radians), 1, 1))
+    matrices[:, first, first] = np.cos(radians)
+    matrices[:, first, second] = -np.sin(radians)
+    matrices[:, second, first] = np.sin(radians)
+    matrices[:, second, second] = np.cos(radians)
+    return matrices
+
+def shade(normals: np.ndarray, colors: np.ndarray) -> np.ndarray:
+    """Phong shading of vertices with a directional light (both sides of the surfaces are lit).
+
+    Args:
+        normals (np.ndarray): Vertex normals in camera coordinates
+        colors (np.ndarray): Vertex colors (RGB, 0 to 1)
+
+    Returns:
+        np.ndarray: Shaded vertex colors (RGB, 0 to 1)
+    """
+    half_vector = (LIGHT_DIRECTION + np.array([0.0, 0.0, 1.0])) / np.linalg.norm(LIGHT_DIRECTION + np.array([0.0, 0.0, 1.0]))
+    diffuse = np.abs(normals @ LIGHT_DIRECTION)[:, None]
+    specular = np.abs(normals @ half_vector)[:, None] ** SHININESS
+    return np.clip(colors * (AMBIENT + DIFFUSE * diffuse) + SPECULAR * specular, 0.0, 1.0)
+
+def rasterize(screen: np.ndarray, faces: np.ndarray, vertex_colors: np.ndarray, size: Tuple[int, int],
+              background: Tuple[int, int, int]) -> np.ndarray:
+    """Draws triangles with a z-buffer.
+
+    The triangles are grouped by the size of their pixel bounding boxes, so all candidate pixels of a group are tested
+    with the same array operations; depth and color are interpolated with barycentric coordinates.
+
+    Args:
+        screen (np.ndarray): Vertices in pixel coordinates (x, y) and depth (smaller is closer)
+        faces (np.ndarray): Vertex indices of the triangles
+        vertex_colors (np.ndarray): Shaded vertex colors (RGB, 0 to 1)
+        size (Tuple[int, int]): Width and height of the image
+        background (Tuple[int, int, int]): Background color
+
+    Returns:
+        np.ndarray: RGB image with shape (height, width, 3)
+    """
+    width, height = size
+    triangles = screen[faces].astype(np.float32)
+    # Signed double area, degenerate triangles are skipped
+    area = ((triangles[:, 1, 0] - triangles[:, 0, 0]) * (triangles[:, 2, 1] - triangles[:, 0, 1])
+            - (triangles[:, 2, 0] - triangles[:, 0, 0]) * (triangles[:, 1, 1] - triangles[:, 0, 1]))
+    # Pixels whose centers may lie inside a triangle
+    low = np.maximum(np.floor(triangles[:, :, :2].min(axis=1) - 0.5).astype(np.int64) + 1, 0)
+    high = np.minimum(np.floor(triangles[:, :, :2].max(axis=1) - 0.5).astype(np.int64), [width - 1, height - 1])
+    box = high - low + 1
+    visible = (np.abs(area) > 1e-6) & (box > 0).all(axis=1)
+    box_key = box[:, 0] * (height + 1) + box[:, 1]
+
+    pixels, depths, colors = [], [], []
+    for key in np.unique(box_key[visible]):
+        box_width, box_height = divmod(int(key), height + 1)
+        group = np.flatnonzero(visible & (box_key == key))
+        offset_y, offset_x = np.divmod(np.arange(box_width * box_height), box_width)
+        chunk = max(1, RASTER_CHUNK_SIZE // (box_width * box_height))
+        for start in range(0, len(group), chunk):
+            index = group[start:start + chunk]
+            center_x = (low[index, 0:1] + offset_x).astype(np.float32) + 0.5
+            center_y = (low[index, 1:2] + offset_y).astype(np.float32) + 0.5
+            corners = triangles[index]
+            weights = np.empty((3,) + center_x.shape, dtype=np.float32)
+            for k in range(3):
+                a, b = corners[:, (k + 1) % 3], corners[:, (k + 2) % 3]
+                weights[k] = ((b[:, 0:1] - a[:, 0:1]) * (center_y - a[:, 1:2]) - (b[:, 1:2] - a[:, 1:2]) * (center_x - a[:, 0:1]))
+            weights /= area[index][:, None]
+            triangle, candidate = np.nonzero((weights >= 0.0).all(axis=0))
+            weight = weights[:, triangle, candidate]
+            corner_faces = faces[index[triangle]]
+            pixels.append((low[index[triangle], 1] + offset_y[candidate]) * width + low[index[triangle], 0] + offset_x[candidate])
+            depths.append(np.einsum('kn,nk->n', weight, screen[corner_faces, 2]))
+            colors.append(np.einsum('kn,nkc->nc', weight, vertex_colors[corner_faces]))
+
+    image = np.empty((height * width, 3), dtype=np.uint8)
+    image[:] = background
+    if pixels:
+        pixel, depth, color = np.concatenate(pixels), np.concatenate(depths), np.concatenate(colors)
+        depth_buffer = np.full(height * width, np.inf)
+        np.minimum.at(depth_buffer, pixel, depth)
+        front = depth <= depth_buffer[pixel]
+        image[pixel[front]] = np.round(color[front] * 255.0).astype(np.uint8)
+    return image.reshape(height, width, 3)
+
+def render_image(scene: Scene, rotation: np.ndarray = np.eye(3), size: Tuple[int, int] = IMAGE_SIZE) -> np.ndarray:
+    """Renders a scene with an orthographic camera.
+
+    Args:
+        scene (Scene): Triangles and view sphere
+        rotation (np.ndarray): Rotation of the scene in camera coordinates
+        size (Tuple[int, int]): Width and height of the image
+
+    Returns:
+        np.ndarray: RGB image with shape (height, width, 3)
+    """
+    width, height = size
+    scale = 0.95 * min(width, height) / (2.0 * scene.radius)
+    camera = (scene.vertices - scene.center) @ rotation.T
+    screen = np.column_stack([width / 2.0 + scale * camera[:, 0], height / 2.0 - scale * camera[:, 1], -camera[:, 2]])
+    # All meshes are closed and wound counterclockwise seen from outside, triangles facing away are hidden
+    corners = camera[scene.faces]
+    facing = ((corners[:, 1, 0] - corners[:, 0, 0]) * (corners[:, 2, 1] - corners[:, 0, 1])
+              - (corners[:, 2, 0] - corners[:, 0, 0]) * (corners[:, 1, 1] - corners[:, 0, 1])) > 0.0
+    return rasterize(screen, scene.faces[facing], shade(scene.normals @ rotation.T, scene.colors), size, scene.background)
+
+# Scene of the worker processes, sent once per process instead of once per frame
+_worker_scene: Optional[Scene] = None
+
+def _set_worker_scene(scene: Scene) -> None:
+    global _worker_scene
+    _worker_scene = scene
+
+def _render_worker_frame(rotation: np.ndarray) -> np.ndarray:
+    return render_image(_worker_scene, rotation)
+
+def render_orbital(cube_file: str, isovalue: float, background_color: str, molecule_style: str, movie_maker: str,
+                   movie_settings: MovieSettings = MovieSettings(), n_workers: int = 0, output_directory: str = '.') -> List[str]:
+    """Renders the image (MO_<n>.png) and the rotation movies (MO_<n>_rotation_<axis>.<extension>) of one orbital.
+
+    The rotation frames are rendered by a process pool and written to the movies in their order as they finish.
+
+    Args:
+        cube_file (str): Cube file of the orbital
+        isovalue (float): Isovalue of the surfaces
+        background_color (str): Background color (1: white, 2: black)
+        molecule_style (str): Style for the molecule (1: Lines, 2: CPK, 3: Licorice)
+        movie_maker (str): Whether movies should be generated (yes/y, no/n)
+        movie_settings (MovieSettings): Format and number of frames of the movies
+        n_workers (int): Number of processes for the rotation frames (0: all available cores)
+        output_directory (str): Directory of the images and movies
+
+    Returns:
+        List[str]: Image and movies which have been written
+    """
+    name = f"MO_{orbital_number(cube_file)}"
+    scene = build_scene(cube_file, isovalue, background_color, molecule_style)
+    output_files = [os.path.join(output_directory, f"{name}.png")]
+    write_png(output_files[0], render_image(scene))
+    if movie_maker not in ('yes', 'y'):
+        return output_files
+
+    angles = np.arange(movie_settings.n_frames) * 360.0 / movie_settings.n_frames
+    rotations = np.concatenate([rotation_matrices(axis, angles) for axis in ROTATION_AXES])
+    movies = [os.path.join(output_directory, f"{name}_rotation_{axis}.{MOVIE_EXTENSIONS[movie_settings.format]}") for axis in ROTATION_AXES]
+    writers = [MOVIE_WRITERS[movie_settings.format](movie, movie_settings) for movie in movies]
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers or available_cores(), initializer=_set_worker_scene, initargs=(scene,)) as executor:
+            for frame_number, frame in enumerate(executor.map(_render_worker_frame, rotations)):
+                writers[frame_number // movie_settings.n_frames].add_frame(frame)
+    finally:
+        for writer in writers:
+            writer.close()
+    return output_files + movies
+
+def render_orbitals_offscreen(orbital_files: Sequence[str], background_color: str, molecule_style: str, movie_maker: str,
+                              movie_settings: MovieSettings = MovieSettings(), isovalues: Optional[Sequence[float]] = None,
+                              n_workers: int = 0, output_directory: str = '.') -> List[str]:
+    """Renders orbitals without VMD (replacement for render_orbitals_batch).
+
+    Args:
+        orbital_files (Sequence[str]): Cube files of the orbitals
+        background_color (str): Background color (1: white, 2: black)
+        molecule_style (str): Style for the molecule (1: Lines, 2: CPK, 3: Licorice)
+        movie_maker (str): Whether movies should be generated (yes/y, no/n)
+        movie_settings (MovieSettings): Format and number of frames of the movies
+        isovalues (Optional[Sequence[float]]): Isovalue of every orbital (None: 0.02 for all orbitals)
+        n_workers (int): Number of processes for the rotation frames (0: all available cores)
+        output_directory (str): Directory of the images and movies
+
+    Returns:
+        List[str]: Images (MO_<n>.png) and movies which have been written
+    """
+    if isovalues is None:
+        isovalues = [DEFAULT_ISOVALUE] * len(orbital_files)
+    output_files = []
+    for orbital_file, isovalue in zip(orbital_files, isovalues):
+        files = render_orbital(orbital_file, isovalue, background_color, molecule_style, movie_maker, movie_settings,
+                               n_workers, output_directory)
+        print(f"Rendered {orbital_file}: {' '.join(files)}")
+        output_files += files
+    return output_files
+
+if __name__ == '__main__':
+
+    # Check, if enough elements are present
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} [--movie] [--black] [--style 1|2|3] [--isovalue 0.02 | --fraction 0.85] CubeFile [CubeFile ...]")
+        exit()
+
+    arguments = sys.argv[1:]
+    movie_maker = 'no'
+    background_color = '1'
+    molecule_style = '1'
+    isovalue = DEFAULT_ISOVALUE
+    fraction = None
+    while arguments and arguments[0].startswith('--'):
+        option = arguments.pop(0)
+        if option == '--movie':
+            movie_maker = 'yes'
+        elif option == '--black':
+            background_color = '2'
+        elif option == '--style':
+            molecule_style = arguments.pop(0)
+        elif option == '--isovalue':
+            isovalue = float(arguments.pop(0))
+        elif option == '--fraction':
+            fraction = float(arguments.pop(0))
+        else:
+            print(f"Unknown option {option}.")
+            exit()
+
+    isovalues = [enclosed_density_isovalue(cube_file, fraction) if fraction else isovalue for cube_file in arguments]
+    render_orbitals_offscreen(arguments, background_color, molecule_style, movie_maker, isovalues=isovalues)
@@ -0,0 +1,558 @@
+import os
+import sys
+import xml.etree.ElementTree as ElementTree
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from cube_io import CubeHeader, write_cube
+from grid_sizing import BOHR_TO_ANGSTROM, grid_parameters, grid_preset, plan_grid
+from modules import MAX_ANGULAR_MOMENTUM, WAVEPLOT_BASIS
+from orbital_selection import read_occupations, select_orbitals
+
+# Number of orbitals evaluated at once while a density is accumulated (bounds the memory to this many grids)
+DENSITY_CHUNK_SIZE = 16
+
+# Orbitals are evaluated only around the atoms carrying this share of their squared coefficients (compact support)
+SUPPORT_WEIGHT = float(os.environ.get('ORBITAL_SUPPORT_WEIGHT', '0.999'))
+
+# Write every orbital on the part of the grid around its support atoms (ORBITAL_COMPACT_SUPPORT=1)
+COMPACT_SUPPORT = os.environ.get('ORBITAL_COMPACT_SUPPORT', '') not in ('', '0')
+
+# Weights of the levels in a density (unit: sum of |psi|^2, occupation: occupation weighted partial density)
+DENSITY_WEIGHTINGS = ('unit', 'occupation')
+
+class SlaterOrbital(NamedTuple):
+    """One shell of the Slater type basis of an element (lengths in Bohr)."""
+    angular_momentum: int
+    occupation: float
+    cutoff: float
+    exponents: np.ndarray
+    coefficients: np.ndarray
+
+class Species(NamedTuple):
+    """Basis of one element."""
+    atomic_number: int
+    orbitals: List[SlaterOrbital]
+
+class Geometry(NamedTuple):
+    """Geometry and eigenvector layout read from the detailed.xml of DFTB+."""
+    identity: int
+    type_names: List[str]
+    species: np.ndarray
+    coordinates: np.ndarray
+    number_orbitals: int
+    number_spins: int
+
+class Grid(NamedTuple):
+    """Cuboid grid of the cube files (lengths in Bohr)."""
+    origin: np.ndarray
+    axes: np.ndarray
+    shape: Tuple[int, int, int]
+
+def _parse_hsd_block(tokens: List[str], position: int) -> Tuple[List[Tuple[str, object]], int]:
+    """Parses the entries of a HSD block until the closing bracket.
+
+    Args:
+        tokens (List[str]): Tokens of the HSD text ("=", "{" and "}" are separate tokens)
+        position (int): Position of the first token inside the block
+
+    Returns:
+        Tuple[List[Tuple[str, object]], int]: Entries (name and value, list of values or sub block) and the position after the block
+    """
+    entries = []
+    while position < len(tokens) and tokens[position] != '}':
+        name = tokens[position]
+        position += 1
+        if tokens[position] == '=':
+            position += 1
+        if tokens[position] == '{':
+            end = tokens.index('}', position)
+            values = tokens[position + 1:end]
+            if '{' in values or '=' in values:
+                block, position = _parse_hsd_block(tokens, position + 1)
+                entries.append((name, block))
+                position += 1
+            else:
+                entries.append((name, values))
+                position = end + 1
+        else:
+            entries.append((name, tokens[position]))
+            position += 1
+    return entries, position
+
+def parse_basis(basis_hsd: str = WAVEPLOT_BASIS) -> Dict[str, Species]:
+    """Parses the Slater type basis embedded in the waveplot input.
+
+    Args:
+        basis_hsd (str): Species blocks of the waveplot basis definition
+
+    Returns:
+        Dict[str, Species]: Basis of every element, indexed by the element symbol
+    """
+    tokens = basis_hsd.replace('=', ' = ').replace('{', ' { ').replace('}', ' } ').split()
+    entries, _ = _parse_hsd_block(tokens, 0)
+
+    basis = {}
+    for element, block in entries:
+        atomic_number = 0
+        orbitals = []
+        for name, value in block:
+            if name == 'AtomicNumber':
+                atomic_number = int(value)
+            elif name == 'Orbital':
+                fields = dict(value)
+                exponents = np.array(fields['Exponents'], dtype=float)
+                coefficients = np.array(fields['Coefficients'], dtype=float)
+                orbitals.append(SlaterOrbital(
+                    int(fields['AngularMomentum']),
+                    float(fields['Occupation']),
+                    float(fields['Cutoff']),
+                    exponents,
+                    # Fortran layout: the coefficients of all powers of r for the first exponent come first
+                    coefficients.reshape(len(exponents), -1)))
+        basis[element] = Species(atomic_number, orbitals)
+    return basis
+
+def read_detailed_xml(detailed_xml: str = 'detailed.xml') -> Geometry:
+    """Reads the geometry and the size of the eigenvectors from the detailed.xml of DFTB+.
+
+    Args:
+        detailed_xml (str): detailed.xml written by DFTB+ (WriteDetailedXML = Yes)
+
+    Returns:
+        Geometry: Identity of the run, type names, species index and coordinates (Bohr) of every atom, number of orbitals and spins
+    """
+    root = ElementTree.parse(detailed_xml).getroot()
+    geometry = root.find('geometry')
+    type_names = [name.strip('"') for name in geometry.findtext('typenames').split()]
+    types_and_coordinates = np.array(geometry.findtext('typesandcoordinates').split(), dtype=float).reshape(-1, 4)
+    return Geometry(
+        int(root.findtext('identity')),
+        type_names,
+        types_and_coordinates[:, 0].astype(int) - 1,
+        types_and_coordinates[:, 1:],
+        int(root.findtext('nroforbitals')),
+        int(root.findtext('nrofspins')))
+
+def read_eigenvectors(levels: Sequence[int], geometry: Geometry, eigenvec_bin: str = 'eigenvec.bin', spin: int = 1) -> np.ndarray:
+    """Reads the eigenvectors of the requested levels from the binary eigenvector file of DFTB+.
+
+    Only the requested levels are read from the memory mapped file.
+
+    Args:
+        levels (Sequence[int]): Numbers of the levels (starting at 1)
+        geometry (Geometry): Geometry read from detailed.xml of the same run
+        eigenvec_bin (str): eigenvec.bin written by DFTB+ (WriteEigenvectors = Yes)
+        spin (int): Spin channel (1 or 2)
+
+    Returns:
+        np.ndarray: Eigenvector coefficients with shape (number of levels, number of orbitals)
+    """
+    identity = int(np.fromfile(eigenvec_bin, dtype=np.int32, count=1)[0])
+    if identity != geometry.identity:
+        raise ValueError(f"{eigenvec_bin} (identity {identity}) does not belong to the detailed.xml (identity {geometry.identity}).")
+    number_orbitals = geometry.number_orbitals
+    eigenvectors = np.memmap(eigenvec_bin, dtype=np.float64, mode='r', offset=4,
+                             shape=(geometry.number_spins * number_orbitals, number_orbitals))
+    rows = [(spin - 1) * number_orbitals + int(level) - 1 for level in levels]
+    return np.array(eigenvectors[rows])
+
+def basis_shells(geometry: Geometry, basis: Dict[str, Species]) -> List[List[SlaterOrbital]]:
+    """Selects the basis shells of every atom type, which are contained in the eigenvectors.
+
+    Shells above the highest angular momentum used in the DFTB+ calculation (MAX_ANGULAR_MOMENTUM) are skipped.
+
+    Args:
+        geometry (Geometry): Geometry read from detailed.xml
+        basis (Dict[str, Species]): Basis of every element
+
+    Returns:
+        List[List[SlaterOrbital]]: Shells of every atom type in the order of the eigenvector coefficients
+    """
+    shells = []
+    for type_name in geometry.type_names:
+        orbitals = basis[type_name].orbitals
+        if type_name in MAX_ANGULAR_MOMENTUM:
+            max_angular_momentum = 'spdf'.index(MAX_ANGULAR_MOMENTUM[type_name])
+            orbitals = [orbital for orbital in orbitals if orbital.angular_momentum <= max_angular_momentum]
+        shells.append(orbitals)
+
+    number_orbitals = sum(sum(2 * orbital.angular_momentum + 1 for orbital in shells[species]) for species in geometry.species)
+    if number_orbitals != geometry.number_orbitals:
+        raise ValueError(f"Basis contains {number_orbitals} orbitals, but the eigenvectors have {geometry.number_orbitals}.")
+    return shells
+
+def optimal_cuboid(geometry: Geometry, shells: List[List[SlaterOrbital]], n_points: Tuple[int, int, int] = (80, 80, 80), min_edge_length: float = 1.0) -> Grid:
+    """Determines the smallest cuboid along the cartesian axes containing all basis functions (waveplot OptimalCuboid).
+
+    Args:
+        geometry (Geometry): Geometry read from detailed.xml
+        shells (List[List[SlaterOrbital]]): Shells of every atom type
+        n_points (Tuple[int, int, int]): Number of grid points in each direction
+        min_edge_length (float): Minimal edge length of the cuboid in Bohr
+
+    Returns:
+        Grid: Origin, grid vectors and number of points of the cuboid
+    """
+    cutoffs = np.array([max(orbital.cutoff for orbital in shells[species]) for species in geometry.species])
+    lower = np.min(geometry.coordinates - cutoffs[:, None], axis=0)
+    upper = np.max(geometry.coordinates + cutoffs[:, None], axis=0)
+    edges = upper - lower
+    short = edges < min_edge_length
+    lower[short] -= 0.5 * (min_edge_length - edges[short])
+    edges[short] = min_edge_length
+    return Grid(lower, np.diag(edges / np.array(n_points)), tuple(int(n) for n in n_points))
+
+def cube_grid(geometry: Geometry, shells: List[List[SlaterOrbital]], n_points: Tuple[int, int, int] = (80, 80, 80),
+              region: Optional[Tuple[Sequence[float], Sequence[Sequence[float]]]] = None) -> Grid:
+    """Determines the grid of the cube files like waveplot does (OptimalCuboid or UserDefined region).
+
+    Args:
+        geometry (Geometry): Geometry read from detailed.xml
+        shells (List[List[SlaterOrbital]]): Shells of every atom type
+        n_points (Tuple[int, int, int]): Number of grid points in each direction
+        region (Optional[Tuple[Sequence[float], Sequence[Sequence[float]]]]): Origin and box vectors (Bohr), OptimalCuboid if None
+
+    Returns:
+        Grid: Origin, grid vectors and number of points
+    """
+    if region is None:
+        return optimal_cuboid(geometry, shells, n_points)
+    origin, box = region
+    # Like waveplot, the box vectors are divided by the number of points
+    return Grid(np.asarray(origin, dtype=float), np.asarray(box, dtype=float) / np.array(n_points)[:, None], tuple(int(n) for n in n_points))
+
+def atom_weights(coefficients: np.ndarray, geometry: Geometry, shells: List[List[SlaterOrbital]]) -> np.ndarray:
+    """Calculates the share of every atom in the squared eigenvector coefficients of every orbital.
+
+    Args:
+        coefficients (np.ndarray): Eigenvector coefficients with shape (number of orbitals, number of basis functions)
+        geometry (Geometry): Geometry read from detailed.xml
+        shells (List[List[SlaterOrbital]]): Shells of every atom type
+
+    Returns:
+        np.ndarray: Share of every atom with shape (number of orbitals, number of atoms), every row sums to 1
+    """
+    atom_sizes = [sum(2 * shell.angular_momentum + 1 for shell in shells[species]) for species in geometry.species]
+    first_orbitals = np.concatenate(([0], np.cumsum(atom_sizes)[:-1])).astype(int)
+    weights = np.add.reduceat(coefficients * coefficients, first_orbitals, axis=1)
+    return weights / np.maximum(weights.sum(axis=1, keepdims=True), 1e-300)
+
+def support_atoms(weights: np.ndarray, share: float = SUPPORT_WEIGHT) -> np.ndarray:
+    """Selects the fewest atoms which together carry a share of an orbital.
+
+    Args:
+        weights (np.ndarray): Share of every atom in the orbital (see atom_weights)
+        share (float): Share of the orbital, which the selected atoms carry together
+
+    Returns:
+        np.ndarray: Indices of the selected atoms in ascending order
+    """
+    order = np.argsort(weights)[::-1]
+    number_atoms = int(np.searchsorted(np.cumsum(weights[order]), min(share, 1.0) - 1e-12)) + 1
+    return np.sort(order[:min(number_atoms, len(weights))])
+
+def support_grid(grid: Grid, geometry: Geometry, shells: List[List[SlaterOrbital]], atoms: Sequence[int]) -> Grid:
+    """Cuts the part of a grid which lies within the basis cutoffs of some atoms.
+
+    The points of the smaller grid coincide with points of the full grid, so its cube file lies exactly on the full
+    molecule and can be overlaid on it.
+
+    Args:
+        grid (Grid): Full grid along the cartesian axes
+        geometry (Geometry): Geometry read from detailed.xml
+        shells (List[List[SlaterOrbital]]): Shells of every atom type
+        atoms (Sequence[int]): Indices of the atoms
+
+    Returns:
+        Grid: Part of the full grid containing the basis functions of the atoms
+    """
+    steps = np.diag(grid.axes)
+    cutoffs = np.array([max(shell.cutoff for shell in shells[geometry.species[atom]]) for atom in atoms])
+    positions = geometry.coordinates[list(atoms)]
+    lower = np.maximum(np.floor((np.min(positions - cutoffs[:, None], axis=0) - grid.origin) / steps), 0).astype(int)
+    upper = np.minimum(np.ceil((np.max(positions + cutoffs[:, None], axis=0) - grid.origin) / steps) + 1, grid.shape).astype(int)
+    upper = np.maximum(upper, lower + 1)
+    return Grid(grid.origin + lower * steps, grid.axes, tuple(int(n) for n in upper - lower))
+
+def compact_grids(coefficients: np.ndarray, geometry: Geometry, shells: List[List[SlaterOrbital]], grid: Grid,
+                  share: float = SUPPORT_WEIGHT) -> List[Tuple[List[int], Grid]]:
+    """Groups orbitals by the part of the grid around the atoms carrying them (compact support).
+
+    Localized orbitals (lone pairs, bonds of one fragment) only need the grid around a few atoms. Orbitals with the
+    same support grid are grouped, so that the basis functions are evaluated only once for them.
+
+    Args:
+        coefficients (np.ndarray): Eigenvector coefficients of the orbitals
+        geometry (Geometry): Geometry read from detailed.xml
+        shells (List[List[SlaterOrbital]]): Shells of every atom type
+        grid (Grid): Full grid along the cartesian axes
+        share (float): Share of every orbital carried by its support atoms
+
+    Returns:
+        List[Tuple[List[int], Grid]]: Positions of the orbitals in the coefficients and their grid, one entry per group
+    """
+    groups: Dict[Tuple[int, ...], Tuple[List[int], Grid]] = {}
+    for position, weights in enumerate(atom_weights(coefficients, geometry, shells)):
+        orbital_grid = support_grid(grid, geometry, shells, support_atoms(weights, share))
+        key = tuple(np.round((orbital_grid.origin - grid.origin) / np.diag(grid.axes)).astype(int)) + orbital_grid.shape
+        groups.setdefault(key, ([], orbital_grid))[0].append(position)
+    return list(groups.values())
+
+def radial_function(orbital: SlaterOrbital, r: np.ndarray) -> np.ndarray:
+    """Evaluates the radial part of a Slater type orbital.
+
+    R(r) = sum_i sum_j c_ij r^(l+j) exp(-alpha_i r)
+
+    Args:
+        orbital (SlaterOrbital): Shell of the basis
+        r (np.ndarray): Distances from the atom in Bohr
+
+    Returns:
+        np.ndarray: Radial function on the given distances
+    """
+    values = np.zeros_like(r)
+    powers = [r ** (orbital.angular_momentum + j) for j in range(orbital.coefficients.shape[1])]
+    for alpha, coefficients in zip(orbital.exponents, orbital.coefficients):
+        polynomial = coefficients[0] * powers[0]
+        for coefficient, power in zip(coefficients[1:], powers[1:]):
+            polynomial = polynomial + coefficient * power
+        values += polynomial * np.exp(-alpha * r)
+    return values
+
+def real_spherical_harmonics(angular_momentum: int, x: np.ndarray, y: np.ndarray, z: np.ndarray) -> List[np.ndarray]:
+    """Evaluates the real spherical harmonics in the DFTB+ order (m = -l, ..., l).
+
+    Args:
+        angular_momentum (int): Angular momentum (0, 1 or 2)
+        x (np.ndarray): x components of the unit vectors to the grid points
+        y (np.ndarray): y components of the unit vectors to the grid points
+        z (np.ndarray): z components of the unit vectors to the grid points
+
+    Returns:
+        List[np.ndarray]: One array for every magnetic quantum number
+    """
+    if angular_momentum == 0:
+        return [np.full_like(x, 0.28209479177387814)]
+    elif angular_momentum == 1:
+        return [0.4886025119029199 * y, 0.4886025119029199 * z, 0.4886025119029199 * x]
+    elif angular_momentum == 2:
+        return [1.0925484305920792 * x * y,
+                1.0925484305920792 * y * z,
+                0.31539156525252005 * (3.0 * z * z - 1.0),
+                1.0925484305920792 * x * z,
+                0.5462742152960396 * (x * x - y * y)]
+    raise ValueError(f"Angular momentum {angular_momentum} is not supported.")
+
+def evaluate_orbitals(coefficients: np.ndarray, geometry: Geometry, shells: List[List[SlaterOrbital]], grid: Grid) -> np.ndarray:
+    """Evaluates several molecular orbitals on a grid in one pass.
+
+    The radial and angular parts of the basis functions of every atom are calculated once on the grid points
+    within the cutoff of the atom and are used for all requested orbitals.
+
+    Args:
+        coefficients (np.ndarray): Eigenvector coefficients with shape (number of orbitals to plot, number of basis functions)
+        geometry (Geometry): Geometry read from detailed.xml
+        shells (List[List[SlaterOrbital]]): Shells of every atom type
+        grid (Grid): Cuboid grid along the cartesian axes
+
+    Returns:
+        np.ndarray: Values of the orbitals with shape (number of orbitals to plot, nx, ny, nz)
+    """
+    if not np.allclose(grid.axes, np.diag(np.diag(grid.axes))):
+        raise ValueError("Only grids along the cartesian axes are supported.")
+    steps = np.diag(grid.axes)
+    shape = np.array(grid.shape)
+    values = np.zeros((len(coefficients),) + tuple(grid.shape))
+
+    first_orbital = 0
+    for species, position in zip(geometry.species, geometry.coordinates):
+        atom_shells = shells[species]
+        number_atom_orbitals = sum(2 * shell.angular_momentum + 1 for shell in atom_shells)
+        atom_coefficients = coefficients[:, first_orbital:first_orbital + number_atom_orbitals]
+        first_orbital += number_atom_orbitals
+
+        # Grid points within the cutoff of the atom
+        cutoff = max(shell.cutoff for shell in atom_shells)
+        lower = np.maximum(np.ceil((position - cutoff - grid.origin) / steps), 0).astype(int)
+        upper = np.minimum(np.floor((position + cutoff - grid.origin) / steps) + 1, shape).astype(int)
+        if np.any(upper <= lower):
+            continue
+        dx = (grid.origin[0] + steps[0] * np.arange(lower[0], upper[0]) - position[0])[:, None, None]
+        dy = (grid.origin[1] + steps[1] * np.arange(lower[1], upper[1]) - position[1])[None, :, None]
+        dz = (grid.origin[2] + steps[2] * np.arange(lower[2], upper[2]) - position[2])[None, None, :]
+        r = np.sqrt(dx * dx + dy * dy + dz * dz)
+        r_safe = np.where(r > 0.0, r, 1.0)
+        x, y, z = dx / r_safe, dy / r_safe, dz / r_safe
+
+        basis_values = []
+        for shell in atom_shells:
+            radial = np.where(r <= shell.cutoff, radial_function(shell, r), 0.0)
+            for angular in real_spherical_harmonics(shell.angular_momentum, x, y, z):
+                basis_values.append(radial * angular)
+        block = (slice(None), slice(lower[0], upper[0]), slice(lower[1], upper[1]), slice(lower[2], upper[2]))
+        values[block] += np.tensordot(atom_coefficients, np.array(basis_values), axes=1)
+    return values
+
+def write_orbital_cubes(orbitals: Sequence[int], detailed_xml: str = 'detailed.xml', eigenvec_bin: str = 'eigenvec.bin', n_points: Tuple[int, int, int] = (80, 80, 80),
+                        region: Optional[Tuple[Sequence[float], Sequence[Sequence[float]]]] = None, compact: bool = False) -> List[str]:
+    """Calculates the real part of molecular orbitals with NumPy and writes them as cube files.
+
+    The cube files are named like the ones of waveplot (wp-1-1-<n>-real.cube), so that they can be used in the same way.
+    With compact every orbital is evaluated and written only on the part of the grid around the atoms carrying it
+    (see compact_grids).
+
+    Args:
+        orbitals (Sequence[int]): Numbers of the orbitals to be calculated
+        detailed_xml (str): detailed.xml written by DFTB+
+        eigenvec_bin (str): eigenvec.bin written by DFTB+
+        n_points (Tuple[int, int, int]): Number of grid points in each direction
+        region (Optional[Tuple[Sequence[float], Sequence[Sequence[float]]]]): Origin and box vectors (Bohr), OptimalCuboid if None
+        compact (bool): Write every orbital only around the atoms carrying it
+
+    Returns:
+        List[str]: Names of the cube files which have been written
+    """
+    basis = parse_basis()
+    geometry = read_detailed_xml(detailed_xml)
+    shells = basis_shells(geometry, basis)
+    grid = cube_grid(geometry, shells, n_points, region)
+    coefficients = read_eigenvectors(orbitals, geometry, eigenvec_bin)
+    if compact:
+        groups = compact_grids(coefficients, geometry, shells, grid)
+    else:
+        groups = [(list(range(0, len(orbitals))), grid)]
+
+    atomic_numbers = np.array([basis[geometry.type_names[species]].atomic_number for species in geometry.species])
+    cube_files = {}
+    for positions, group_grid in groups:
+        values = evaluate_orbitals(coefficients[positions], geometry, shells, group_grid)
+        for position, orbital_values in zip(positions, values):
+            orbital = orbitals[position]
+            cube_file = f"wp-1-1-{orbital}-real.cube"
+            header = CubeHeader((" Calculated by orbital_engine.py", f" Spin 1, K-point 1, Level {orbital}, real part"),
+                                group_grid.origin, group_grid.axes, group_grid.shape, atomic_numbers, geometry.coordinates)
+            write_cube(os.path.join(os.path.dirname(os.path.abspath(detailed_xml)), cube_file), header, orbital_values)
+            cube_files[position] = cube_file
+    return [cube_files[position] for position in sorted(cube_files)]
+
+def accumulate_density(levels: Sequence[int], weights: Sequence[float], geometry: Geometry, shells: List[List[SlaterOrbital]], grid: Grid,
+                       eigenvec_bin: str = 'eigenvec.bin', spin: int = 1, density: Optional[np.ndarray] = None) -> np.ndarray:
+    """Adds the weighted densities sum_i w_i |psi_i|^2 of several levels to an accumulator grid.
+
+    The orbitals are evaluated in chunks of DENSITY_CHUNK_SIZE, so only the accumulator and one chunk are in memory.
+
+    Args:
+        levels (Sequence[int]): Numbers of the levels (starting at 1)
+        weights (Sequence[float]): Weight of every level
+        geometry (Geometry): Geometry read from detailed.xml
+        shells (List[List[SlaterOrbital]]): Shells of every atom type
+        grid (Grid): Cuboid grid along the cartesian axes
+        eigenvec_bin (str): eigenvec.bin written by DFTB+
+        spin (int): Spin channel of the levels
+        density (Optional[np.ndarray]): Accumulator grid (a new one if None)
+
+    Returns:
+        np.ndarray: Accumulated density with shape (nx, ny, nz)
+    """
+    if density is None:
+        density = np.zeros(grid.shape)
+    for first in range(0, len(levels), DENSITY_CHUNK_SIZE):
+        chunk = list(levels[first:first + DENSITY_CHUNK_SIZE])
+        values = evaluate_orbitals(read_eigenvectors(chunk, geometry, eigenvec_bin, spin), geometry, shells, grid)
+        density += np.tensordot(np.asarray(weights[first:first + DENSITY_CHUNK_SIZE], dtype=float), values * values, axes=1)
+    return density
+
+def write_density_cube(selection: str, weighting: str = 'occupation', spin_density: bool = False, directory: str = '.',
+                       n_points: Tuple[int, int, int] = (80, 80, 80), cube_file: str = 'density.cube',
+                       region: Optional[Tuple[Sequence[float], Sequence[Sequence[float]]]] = None) -> str:
+    """Accumulates the density of the selected levels in one pass and writes it as a single cube file.
+
+    No cube file of a single orbital is written. Both spin channels of a spin polarized calculation are added
+    (PlottedSpins = { 1 2 }); the spin density subtracts the second channel from the first.
+
+    Args:
+        selection (str): Selected levels (see orbital_selection.select_levels), resolved for every spin channel
+        weighting (str): Weights of the levels (unit: sum of |psi|^2, occupation: occupation weighted partial density)
+        spin_density (bool): Calculate the spin density (needs a spin polarized calculation)
+        directory (str): Directory of the DFTB+ calculation (detailed.xml, eigenvec.bin, band.out)
+        n_points (Tuple[int, int, int]): Number of grid points in each direction
+        cube_file (str): Name of the density cube file in the directory
+        region (Optional[Tuple[Sequence[float], Sequence[Sequence[float]]]]): Origin and box vectors (Bohr), OptimalCuboid if None
+
+    Returns:
+        str: Name of the cube file which has been written
+    """
+    if weighting not in DENSITY_WEIGHTINGS:
+        raise ValueError(f"Unknown weighting {weighting}, choose one of {', '.join(DENSITY_WEIGHTINGS)}.")
+    detailed_xml = os.path.join(directory, 'detailed.xml')
+    basis = parse_basis()
+    geometry = read_detailed_xml(detailed_xml)
+    if spin_density and geometry.number_spins != 2:
+        raise ValueError("The spin density needs a spin polarized calculation (two spin channels).")
+    shells = basis_shells(geometry, basis)
+    grid = cube_grid(geometry, shells, n_points, region)
+
+    density = np.zeros(grid.shape)
+    number_levels = 0
+    for spin in range(1, geometry.number_spins + 1):
+        levels = [int(level) for level in select_orbitals(selection, directory, spin)]
+        if weighting == 'occupation':
+            occupations = read_occupations(detailed_xml, spin)
+            weights = [occupations[level - 1] for level in levels]
+        else:
+            weights = [1.0] * len(levels)
+        # Levels without weight (e.g. unoccupied levels of the partial density) are not evaluated
+        sign = -1.0 if spin_density and spin == 2 else 1.0
+        weighted_levels = [(level, sign * weight) for level, weight in zip(levels, weights) if weight != 0.0]
+        accumulate_density([level for level, _ in weighted_levels], [weight for _, weight in weighted_levels], geometry, shells, grid,
+                           os.path.join(directory, 'eigenvec.bin'), spin, density)
+        number_levels += len(weighted_levels)
+
+    kind = 'Spin density' if spin_density else 'Density'
+    atomic_numbers = np.array([basis[geometry.type_names[species]].atomic_number for species in geometry.species])
+    header = CubeHeader((" Calculated by orbital_engine.py", f" {kind} of {number_levels} levels ({selection}), {weighting} weights"),
+                        grid.origin, grid.axes, grid.shape, atomic_numbers, geometry.coordinates)
+    write_cube(os.path.join(directory, cube_file), header, density)
+    return cube_file
+
+if __name__ == '__main__':
+
+    # Check, if enough elements are present
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} [--unit] [--spin] [--points n | --grid preset] [--output density.cube] Selection [Directory]")
+        print("       Writes the density of the selected levels (e.g. \"HOMO-5:HOMO\") as one cube file.")
+        exit()
+
+    arguments = sys.argv[1:]
+    density_weighting = 'occupation'
+    density_of_spins = False
+    grid_points = 80
+    grid_setting = ''
+    density_file = 'density.cube'
+    while arguments and arguments[0].startswith('--'):
+        option = arguments.pop(0)
+        if option == '--unit':
+            density_weighting = 'unit'
+        elif option == '--spin':
+            density_of_spins = True
+        elif option == '--points':
+            grid_points = int(arguments.pop(0))
+        elif option == '--grid':
+            grid_setting = arguments.pop(0)
+        elif option == '--output':
+            density_file = arguments.pop(0)
+        else:
+            print(f"Unknown option {option}.")
+            exit()
+
+    calculation_directory = arguments[1] if len(arguments) > 1 else '.'
+    density_points, density_region = (grid_points, grid_points, grid_points), None
+    if grid_setting and grid_preset(grid_setting) is not None:
+        # The grid is planned around the atoms of the calculation
+        atom_coordinates = read_detailed_xml(os.path.join(calculation_directory, 'detailed.xml')).coordinates * BOHR_TO_ANGSTROM
+        density_points, density_region = grid_parameters(plan_grid(atom_coordinates, grid_preset(grid_setting)))
+    written_file = write_density_cube(arguments[0], density_weighting, density_of_spins, calculation_directory,
+                                      density_points, density_file, density_region)
+    print(f"Density written to {written_file}")
@@ -0,0 +1,211 @@
+import os
+import re
+import sys
+import xml.etree.ElementTree as ElementTree
+from typing import List, Optional
+
+import numpy as np
+
+HARTREE_TO_EV = 27.211386245988
+
+# Units of the energy windows, converted to eV (the unit of band.out)
+ENERGY_UNITS = {'': 1.0, 'ev': 1.0, 'h': HARTREE_TO_EV, 'ha': HARTREE_TO_EV, 'hartree': HARTREE_TO_EV}
+
+# Energy window, e.g. "E in [-8, -2] eV"
+ENERGY_WINDOW = re.compile(r'E\s*in\s*\[\s*([-+0-9.eE]+)\s*,\s*([-+0-9.eE]+)\s*\]\s*(eV|Hartree|Ha|H)?', re.IGNORECASE)
+
+# Single level: absolute number or offset from the HOMO or LUMO, e.g. "12", "HOMO", "LUMO+3"
+LEVEL = re.compile(r'^(?:(\d+)|(HOMO|LUMO)([+-]\d+)?)$', re.IGNORECASE)
+
+def read_occupations(detailed_xml: str = 'detailed.xml', spin: int = 1, kpoint: int = 1) -> np.ndarray:
+    """Reads the occupations of one spin channel from the detailed.xml of DFTB+ without building the whole tree.
+
+    The file is parsed as a stream; every element is dropped as soon as it is closed and the parsing stops once the
+    requested occupations have been read.
+
+    Args:
+        detailed_xml (str): detailed.xml written by DFTB+ (WriteDetailedXML = Yes)
+        spin (int): Spin channel (1 or 2)
+        kpoint (int): Number of the k-point
+
+    Returns:
+        np.ndarray: Occupation of every level
+    """
+    path = []
+    root = None
+    for event, element in ElementTree.iterparse(detailed_xml, events=('start', 'end')):
+        if event == 'start':
+            path.append(element.tag)
+            if root is None:
+                root = element
+            continue
+        path.pop()
+        if element.tag == f"k{kpoint}" and path[-2:] == ['occupations', f"spin{spin}"]:
+            return np.array(element.text.split(), dtype=float)
+        if len(path) == 1:
+            # Completed children of the root element are not needed any more
+            root.clear()
+    raise ValueError(f"{detailed_xml} contains no occupations for spin {spin}, k-point {kpoint}.")
+
+def read_band_energies(band_out: str = 'band.out', spin: int = 1, kpoint: int = 1) -> np.ndarray:
+    """Reads the eigenvalues of one spin channel from the band.out of DFTB+ line by line.
+
+    Args:
+        band_out (str): band.out written by DFTB+ (energies in eV)
+        spin (int): Spin channel (1 or 2)
+        kpoint (int): Number of the k-point
+
+    Returns:
+        np.ndarray: Energy of every level in eV
+    """
+    energies = []
+    in_block = False
+    with open(band_out, 'r') as file:
+        for line in file:
+            columns = line.split()
+            if columns[:1] == ['KPT']:
+                if in_block:
+                    break
+                in_block = int(columns[1]) == kpoint and int(columns[3]) == spin
+            elif in_block and columns:
+                # Lines are "index energy occupation" (older versions: "energy occupation")
+                energies.append(float(columns[-2]))
+    if not energies:
+        raise ValueError(f"{band_out} contains no energies for spin {spin}, k-point {kpoint}.")
+    return np.array(energies)
+
+def homo_level(occupations: np.ndarray) -> int:
+    """Finds the highest occupied level.
+
+    With a smeared Fermi distribution the HOMO is the highest level which is at least half filled.
+
+    Args:
+        occupations (np.ndarray): Occupation of every level
+
+    Returns:
+        int: Number of the HOMO (starting at 1, 0 if no level is occupied)
+    """
+    occupied = np.flatnonzero(occupations >= 0.5 * max(float(occupations.max()), 1e-12))
+    return int(occupied[-1]) + 1 if len(occupied) and occupations.max() > 0.0 else 0
+
+def needs_calculation(selection: str) -> bool:
+    """Checks whether a selection refers to the HOMO, LUMO or energies (and can only be resolved after DFTB+).
+
+    Args:
+        selection (str): Orbital selection
+
+    Returns:
+        bool: True if the selection is not a plain list of level numbers
+    """
+    return bool(re.search(r'HOMO|LUMO|\[', selection, re.IGNORECASE))
+
+def _terms(selection: str) -> List[str]:
+    """Splits a selection without its energy windows into items (levels or ranges)."""
+    remainder = re.sub(r'\s*([:+-])\s*', r'\1', ENERGY_WINDOW.sub(' ', selection))
+    return [item for item in re.split(r'[,\s]+', remainder.strip()) if item]
+
+def check_selection(selection: str) -> None:
+    """Checks the syntax of a selection before the DFTB+ calculation.
+
+    Args:
+        selection (str): Orbital selection
+
+    Returns:
+        None: Raises ValueError for invalid items or empty selections
+    """
+    items = _terms(selection)
+    if not items and not ENERGY_WINDOW.search(selection):
+        raise ValueError("No orbital selected.")
+    for item in items:
+        for term in item.split(':', 1):
+            if LEVEL.match(term) is None:
+                raise ValueError(f"Invalid orbital {term}, use numbers, HOMO, LUMO, HOMO-n or LUMO+n.")
+
+def _level(term: str, homo: Optional[int]) -> int:
+    """Converts a single level term (12, HOMO, LUMO-1, ...) into the number of the level."""
+    match = LEVEL.match(term)
+    if match is None:
+        raise ValueError(f"Invalid orbital {term}, use numbers, HOMO, LUMO, HOMO-n or LUMO+n.")
+    if match.group(1):
+        return int(match.group(1))
+    if homo is None:
+        raise ValueError(f"{term} needs the occupations of the DFTB+ calculation.")
+    return homo + (0 if match.group(2).upper() == 'HOMO' else 1) + int(match.group(3) or 0)
+
+def select_levels(selection: str, occupations: Optional[np.ndarray] = None, energies: Optional[np.ndarray] = None) -> List[int]:
+    """Resolves an orbital selection into level numbers.
+
+    The selection consists of items separated by commas or spaces:
+        12            single level
+        10:15         levels 10 to 15 (both included)
+        HOMO-5:LUMO+5 levels relative to the highest occupied and lowest unoccupied level
+        E in [-8, -2] eV   all levels with energies in the window (eV, Ha or Hartree)
+
+    Args:
+        selection (str): Orbital selection
+        occupations (Optional[np.ndarray]): Occupation of every level (needed for HOMO and LUMO)
+        energies (Optional[np.ndarray]): Energy of every level in eV (needed for energy windows)
+
+    Returns:
+        List[int]: Sorted numbers of the selected levels (starting at 1)
+    """
+    number_levels = len(occupations) if occupations is not None else (len(energies) if energies is not None else None)
+    homo = homo_level(occupations) if occupations is not None else None
+    levels = set()
+
+    for lower, upper, unit in ENERGY_WINDOW.findall(selection):
+        if energies is None:
+            raise ValueError("Energy windows need the eigenvalues of the DFTB+ calculation (band.out).")
+        factor = ENERGY_UNITS[unit.lower()]
+        window = sorted((float(lower) * factor, float(upper) * factor))
+        levels.update(int(level) + 1 for level in np.flatnonzero((energies >= window[0]) & (energies <= window[1])))
+
+    for item in _terms(selection):
+        if ':' in item:
+            first, last = (_level(term, homo) for term in item.split(':', 1))
+            # Ranges reaching beyond the calculated levels are cut
+            first, last = max(first, 1), min(last, number_levels) if number_levels else last
+            levels.update(range(first, last + 1))
+        else:
+            level = _level(item, homo)
+            if level < 1 or (number_levels and level > number_levels):
+                raise ValueError(f"Orbital {item} (level {level}) does not exist.")
+            levels.add(level)
+    return sorted(levels)
+
+def select_orbitals(selection: str, directory: str = '.', spin: int = 1) -> List[str]:
+    """Resolves an orbital selection with the results of the DFTB+ calculation in a directory.
+
+    Only the files needed by the selection are read: detailed.xml for HOMO and LUMO, band.out for energy windows.
+
+    Args:
+        selection (str): Orbital selection (see select_levels)
+        directory (str): Directory of the DFTB+ calculation
+        spin (int): Spin channel, whose HOMO, LUMO and energies are used
+
+    Returns:
+        List[str]: Numbers of the selected orbitals
+    """
+    occupations = energies = None
+    if re.search(r'HOMO|LUMO', selection, re.IGNORECASE) or os.path.isfile(os.path.join(directory, 'detailed.xml')):
+        occupations = read_occupations(os.path.join(directory, 'detailed.xml'), spin)
+    if ENERGY_WINDOW.search(selection):
+        energies = read_band_energies(os.path.join(directory, 'band.out'), spin)
+    return [str(level) for level in select_levels(selection, occupations, energies)]
+
+if __name__ == '__main__':
+
+    # Check, if enough elements are present
+    if len(sys.argv) not in (2, 3):
+        print(f"Usage: python3 {sys.argv[0]} Selection (e.g. \"HOMO-5:LUMO+5\" or \"E in [-8, -2] eV\") [Directory]")
+        exit()
+
+    calculation_directory = sys.argv[2] if len(sys.argv) == 3 else '.'
+    level_occupations = read_occupations(os.path.join(calculation_directory, 'detailed.xml'))
+    band_out_file = os.path.join(calculation_directory, 'band.out')
+    level_energies = read_band_energies(band_out_file) if os.path.isfile(band_out_file) else None
+    homo = homo_level(level_occupations)
+    print(f"HOMO: level {homo}, LUMO: level {homo + 1}")
+    for selected_level in select_levels(sys.argv[1], level_occupations, level_energies):
+        energy = f"{level_energies[selected_level - 1]:10.4f} eV" if level_energies is not None else ''
+        print(f"Level {selected_level:6d}  occupation {level_occupations[selected_level - 1]:.4f}  {energy}")
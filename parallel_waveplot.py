@@ -0,0 +1,202 @@
+import os
+import shutil
+import tempfile
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from cube_io import CubeHeader, read_cube, write_cube
+from modules import available_cores, waveplot_input
+from orbital_engine import basis_shells, compact_grids, cube_grid, parse_basis, read_detailed_xml, read_eigenvectors
+from process_runner import STALL_TIMEOUT, WAVEPLOT_TIMEOUT, ProcessJob, describe, run_processes
+
+WAVEPLOT = '/usr/local/bin/waveplot'
+
+class WaveplotShard(NamedTuple):
+    """Part of the cube generation done by one waveplot process."""
+    orbitals: List[str]
+    n_points: Tuple[int, int, int]
+    region: Optional[Tuple[np.ndarray, np.ndarray]]
+    first_point: int
+
+def waveplot_shard_job(shard: WaveplotShard, shard_directory: str, calculation_directory: str) -> ProcessJob:
+    """Prepares one waveplot process in its own scratch directory.
+
+    The input points to detailed.xml, eigenvec.bin and dftb_in.hsd of the calculation directory,
+    so these files are shared by all shards and never copied. dftb_in.hsd includes the xyz file by its absolute path
+    (see run_dftb), so the include resolves from the shard directory as well.
+
+    Args:
+        shard (WaveplotShard): Orbitals and grid region of the shard
+        shard_directory (str): Scratch directory of the shard
+        calculation_directory (str): Directory containing the DFTB+ output
+
+    Returns:
+        ProcessJob: Waveplot process of the shard (output in waveplot.out of the shard directory)
+    """
+    waveplot_in = waveplot_input(shard.orbitals, shard.n_points, shard.region,
+                                 os.path.join(calculation_directory, 'detailed.xml'),
+                                 os.path.join(calculation_directory, 'eigenvec.bin'),
+                                 os.path.join(calculation_directory, 'dftb_in.hsd'))
+    with open(os.path.join(shard_directory, 'waveplot_in.hsd'), 'w') as file:
+        file.write(waveplot_in)
+
+    # Every shard gets one core, the parallelism comes from the number of shards
+    environment = dict(os.environ, OMP_NUM_THREADS='1')
+    return ProcessJob('waveplot', [WAVEPLOT, 'waveplot_in.hsd'], shard_directory, 'waveplot.out', os.path.basename(shard_directory),
+                      [f"wp-1-1-{orbital}-real.cube" for orbital in shard.orbitals], WAVEPLOT_TIMEOUT, STALL_TIMEOUT, environment=environment)
+
+def level_shards(orbitals: Sequence[str], n_shards: int, n_points: Tuple[int, int, int],
+                 region: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> List[WaveplotShard]:
+    """Splits the orbitals into groups, every group is calculated on the full grid by one waveplot process.
+
+    Args:
+        orbitals (Sequence[str]): Numbers of the orbitals to be calculated
+        n_shards (int): Number of waveplot processes
+        n_points (Tuple[int, int, int]): Number of grid points in each direction
+        region (Optional[Tuple[np.ndarray, np.ndarray]]): Origin and box vectors (Bohr) of the grid, OptimalCuboid if None
+
+    Returns:
+        List[WaveplotShard]: One shard per waveplot process
+    """
+    groups = [list(orbitals[i::n_shards]) for i in range(0, min(n_shards, len(orbitals)))]
+    return [WaveplotShard(group, n_points, region, 0) for group in groups]
+
+def grid_shards(orbitals: Sequence[str], n_shards: int, origin: np.ndarray, axes: np.ndarray, n_points: Tuple[int, int, int]) -> List[WaveplotShard]:
+    """Splits the grid into sub-cuboids along x, every sub-cuboid is calculated for all orbitals by one waveplot process.
+
+    Args:
+        orbitals (Sequence[str]): Numbers of the orbitals to be calculated
+        n_shards (int): Number of waveplot processes
+        origin (np.ndarray): Origin of the full grid (Bohr)
+        axes (np.ndarray): Grid vectors of the full grid (Bohr)
+        n_points (Tuple[int, int, int]): Number of grid points of the full grid in each direction
+
+    Returns:
+        List[WaveplotShard]: One shard per waveplot process
+    """
+    n_shards = min(n_shards, n_points[0])
+    boundaries = np.linspace(0, n_points[0], n_shards + 1).round().astype(int)
+    shards = []
+    for first_point, last_point in zip(boundaries[:-1], boundaries[1:]):
+        slab_points = (int(last_point - first_point), n_points[1], n_points[2])
+        # waveplot divides the box by the number of points, so the slab keeps the grid vectors of the full grid
+        box = axes * np.array(slab_points)[:, None]
+        shards.append(WaveplotShard(list(orbitals), slab_points, (origin + first_point * axes[0], box), int(first_point)))
+    return shards
+
+def compact_shards(orbitals: Sequence[str], n_shards: int, calculation_directory: str, n_points: Tuple[int, int, int],
+                   region: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> List[WaveplotShard]:
+    """Groups the orbitals by the part of the grid around the atoms carrying them, every group gets its own region.
+
+    Groups are split further by orbitals, so that about n_shards waveplot processes are started.
+
+    Args:
+        orbitals (Sequence[str]): Numbers of the orbitals to be calculated
+        n_shards (int): Number of waveplot processes
+        calculation_directory (str): Directory containing the DFTB+ output
+        n_points (Tuple[int, int, int]): Number of grid points of the full grid in each direction
+        region (Optional[Tuple[np.ndarray, np.ndarray]]): Origin and box vectors (Bohr) of the full grid, OptimalCuboid if None
+
+    Returns:
+        List[WaveplotShard]: One shard per waveplot process
+    """
+    geometry = read_detailed_xml(os.path.join(calculation_directory, 'detailed.xml'))
+    shells = basis_shells(geometry, parse_basis())
+    grid = cube_grid(geometry, shells, n_points, region)
+    coefficients = read_eigenvectors(orbitals, geometry, os.path.join(calculation_directory, 'eigenvec.bin'))
+    shards = []
+    for positions, group_grid in compact_grids(coefficients, geometry, shells, grid):
+        group = [orbitals[position] for position in positions]
+        # waveplot divides the box by the number of points, so the region keeps the grid vectors of the full grid
+        group_region = (group_grid.origin, group_grid.axes * np.array(group_grid.shape)[:, None])
+        n_group_shards = max(round(n_shards * len(group) / len(orbitals)), 1)
+        shards += level_shards(group, n_group_shards, group_grid.shape, group_region)
+    return shards
+
+def stitch_cubes(slab_files: List[str], cube_file: str) -> None:
+    """Joins cube files of consecutive sub-cuboids along x into a single cube file.
+
+    Args:
+        slab_files (List[str]): Cube files of the sub-cuboids, ordered along x
+        cube_file (str): Name of the joined cube file
+
+    Returns:
+        None: Writes the joined cube file
+    """
+    slabs = [read_cube(slab_file) for slab_file in slab_files]
+    first_header = slabs[0][0]
+    data = np.concatenate([slab_data for _, slab_data in slabs], axis=0)
+    header = CubeHeader(first_header.comments, first_header.origin, first_header.axes, data.shape,
+                        first_header.atomic_numbers, first_header.coordinates)
+    write_cube(cube_file, header, data)
+
+def input_waveplot_parallel(orbitals: Sequence[str], n_workers: int = 0, n_points: Tuple[int, int, int] = (80, 80, 80), directory: str = '.',
+                            region: Optional[Tuple[np.ndarray, np.ndarray]] = None, compact: bool = False) -> List[str]:
+    """Runs several waveplot processes at once to generate the orbital cube files.
+
+    With at least as many orbitals as workers the orbitals are distributed over the workers. Otherwise the grid is
+    split into sub-cuboids along x, which are calculated concurrently and stitched into a single cube per orbital.
+    With compact every orbital is calculated only on the part of the grid around the atoms carrying it (see compact_shards).
+
+    Args:
+        orbitals (Sequence[str]): Numbers of the orbitals to be calculated
+        n_workers (int): Number of concurrent waveplot processes (0: all available cores)
+        n_points (Tuple[int, int, int]): Number of grid points in each direction
+        directory (str): Directory containing the DFTB+ output, the cube files are written there
+        region (Optional[Tuple[np.ndarray, np.ndarray]]): Origin and box vectors (Bohr) of the grid, OptimalCuboid if None
+        compact (bool): Calculate every orbital only around the atoms carrying it
+
+    Returns:
+        List[str]: Names of the cube files (wp-1-1-<n>-real.cube) which have been written
+    """
+    current_directory = os.path.abspath(directory)
+    if n_workers <= 0:
+        n_workers = available_cores()
+
+    if compact:
+        shards = compact_shards(orbitals, n_workers, current_directory, n_points, region)
+    elif len(orbitals) >= n_workers or n_workers == 1:
+        shards = level_shards(orbitals, n_workers, n_points, region)
+    else:
+        geometry = read_detailed_xml(os.path.join(current_directory, 'detailed.xml'))
+        grid = cube_grid(geometry, basis_shells(geometry, parse_basis()), n_points, region)
+        shards = grid_shards(orbitals, n_workers, grid.origin, grid.axes, n_points)
+
+    # Cube files of an earlier run in the same directory must not be taken for results of this run
+    for orbital in orbitals:
+        if os.path.isfile(os.path.join(current_directory, f"wp-1-1-{orbital}-real.cube")):
+            os.remove(os.path.join(current_directory, f"wp-1-1-{orbital}-real.cube"))
+
+    shard_directories = [tempfile.mkdtemp(prefix=f'waveplot_shard_{i}_', dir=current_directory) for i in range(0, len(shards))]
+    # All shards are run from one event loop
+    results = run_processes([waveplot_shard_job(shard, shard_directory, current_directory)
+                             for shard, shard_directory in zip(shards, shard_directories)])
+    for i, (result, shard_directory) in enumerate(zip(results, shard_directories)):
+        if result.status != 'finished':
+            print(f"Waveplot shard {i} failed: {describe(result)}")
+            # Partially written cube files of a killed shard are removed, only waveplot.out is kept for inspection
+            for cube_file in result.job.output_files:
+                if os.path.isfile(os.path.join(shard_directory, cube_file)):
+                    os.remove(os.path.join(shard_directory, cube_file))
+
+    cube_files = []
+    for orbital in orbitals:
+        cube_file = f"wp-1-1-{orbital}-real.cube"
+        shard_files = [os.path.join(shard_directory, cube_file) for shard, shard_directory in zip(shards, shard_directories) if orbital in shard.orbitals]
+        # Only orbitals whose shards all finished are moved or stitched
+        if not all(result.status == 'finished' for shard, result in zip(shards, results) if orbital in shard.orbitals):
+            continue
+        if not all(os.path.isfile(shard_file) for shard_file in shard_files):
+            continue
+        if len(shard_files) == 1:
+            shutil.move(shard_files[0], os.path.join(current_directory, cube_file))
+        else:
+            stitch_cubes(shard_files, os.path.join(current_directory, cube_file))
+        cube_files.append(cube_file)
+
+    # Failed shards keep their directory for inspection
+    for result, shard_directory in zip(results, shard_directories):
+        if result.status == 'finished':
+            shutil.rmtree(shard_directory)
+    return cube_files
@@ -0,0 +1,205 @@
+import asyncio
+import math
+import os
+import subprocess
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from instrumentation import RUN_LOG
+
+# Time limits of the programs in seconds (0: no limit)
+DFTB_TIMEOUT = float(os.environ.get('ORBITAL_DFTB_TIMEOUT', '0'))
+WAVEPLOT_TIMEOUT = float(os.environ.get('ORBITAL_WAVEPLOT_TIMEOUT', '0'))
+
+# Seconds without any output after which a process counts as stalled (0: no limit)
+STALL_TIMEOUT = float(os.environ.get('ORBITAL_STALL_TIMEOUT', '600'))
+
+# SCC iterations without a new lowest SCC error after which a DFTB+ calculation counts as diverged (0: never)
+SCC_PATIENCE = int(os.environ.get('ORBITAL_SCC_PATIENCE', '100'))
+
+# Every n-th SCC iteration is printed by jobs with progress output
+SCC_PROGRESS_INTERVAL = 10
+
+class ProcessJob(NamedTuple):
+    """External program run by the asyncio runner, with its limits."""
+    name: str
+    command: List[str]
+    directory: str
+    output_file: str
+    label: str = ''
+    output_files: Sequence[str] = ()
+    timeout: float = 0.0
+    stall_timeout: float = 0.0
+    scc_patience: int = 0
+    progress: bool = False
+    environment: Optional[Dict[str, str]] = None
+
+class ProcessResult(NamedTuple):
+    """Outcome of a process (status: finished, failed, timeout, stalled, diverged or not started)."""
+    job: ProcessJob
+    return_code: Optional[int]
+    status: str
+    scc_iterations: int
+    scc_error: float
+    errors: List[str]
+    wall_seconds: float
+
+class OutputMonitor:
+    """Parses the output of DFTB+ or waveplot line by line: SCC iterations, SCC errors and error messages."""
+
+    def __init__(self, scc_patience: int = 0):
+        self.scc_patience = scc_patience
+        self.in_scc_table = False
+        self.iterations = 0
+        self.scc_error = math.nan
+        self.best_error = math.inf
+        self.best_iteration = 0
+        self.errors: List[str] = []
+
+    def feed(self, line: str) -> bool:
+        """Parses one line of output.
+
+        Args:
+            line (str): Line of the standard output
+
+        Returns:
+            bool: True if a new SCC iteration has been read
+        """
+        columns = line.split()
+        if columns and columns[0] == 'iSCC':
+            self.in_scc_table = True
+            return False
+        if self.in_scc_table and len(columns) >= 4 and columns[0].isdigit():
+            self.iterations = int(columns[0])
+            try:
+                self.scc_error = abs(float(columns[-1]))
+            except ValueError:
+                self.scc_error = math.nan
+            if self.scc_error < self.best_error:
+                self.best_error, self.best_iteration = self.scc_error, self.iterations
+            return True
+        self.in_scc_table = False
+        if line.lstrip().upper().startswith('ERROR'):
+            self.errors.append(line.strip())
+        elif self.errors and self.errors[-1].endswith('!') and line.lstrip().startswith('->'):
+            # DFTB+ writes the message in the line after "ERROR!"
+            self.errors[-1] += ' ' + line.strip()
+        return False
+
+    @property
+    def diverged(self) -> bool:
+        """True if the SCC error is not finite or has not improved for scc_patience iterations."""
+        if self.iterations == 0:
+            return False
+        if not math.isfinite(self.scc_error):
+            return True
+        return self.scc_patience > 0 and self.iterations - self.best_iteration >= self.scc_patience
+
+async def _follow_output(job: ProcessJob, reader: asyncio.StreamReader, monitor: OutputMonitor, start: float) -> str:
+    """Copies the output of a process into its output file until it ends or one of the limits is hit."""
+    deadline = start + job.timeout if job.timeout > 0 else None
+    with open(os.path.join(job.directory, job.output_file), 'wb') as output:
+        while True:
+            limits = [job.stall_timeout] if job.stall_timeout > 0 else []
+            if deadline is not None:
+                limits.append(max(deadline - time.perf_counter(), 0.0))
+            try:
+                line = await asyncio.wait_for(reader.readline(), min(limits) if limits else None)
+            except asyncio.TimeoutError:
+                return 'timeout' if deadline is not None and time.perf_counter() >= deadline else 'stalled'
+            if not line:
+                return 'finished'
+            output.write(line)
+            if monitor.feed(line.decode(errors='replace')):
+                if job.progress and (monitor.iterations == 1 or monitor.iterations % SCC_PROGRESS_INTERVAL == 0):
+                    print(f"{job.label or job.name}: SCC iteration {monitor.iterations}, SCC error {monitor.scc_error:.3e}")
+                if monitor.diverged:
+                    return 'diverged'
+
+async def run_process(job: ProcessJob) -> ProcessResult:
+    """Runs an external program, streams its output into the output file and parses it while it runs.
+
+    Processes which exceed their time limit, stop writing output or whose SCC cycle diverges are killed; cancelling the
+    coroutine kills the process as well. The resources of the process are recorded in the run log.
+
+    Args:
+        job (ProcessJob): Program, directory and limits
+
+    Returns:
+        ProcessResult: Return code, status, SCC progress and error messages of the process
+    """
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    # Fortran programs buffer their output when it goes into a pipe
+    environment = dict(job.environment if job.environment is not None else os.environ, GFORTRAN_UNBUFFERED_PRECONNECTED='y')
+    try:
+        process = RUN_LOG.popen(job.name, job.command, job.label, job.output_files, cwd=job.directory, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, env=environment)
+    except OSError as error:
+        return ProcessResult(job, None, 'not started', 0, math.nan, [str(error)], 0.0)
+
+    reader = asyncio.StreamReader(limit=2**20)
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), process.stdout)
+    monitor = OutputMonitor(job.scc_patience)
+    try:
+        status = await _follow_output(job, reader, monitor, start)
+    except asyncio.CancelledError:
+        process.kill()
+        transport.close()
+        RUN_LOG.wait(process)
+        raise
+    if status != 'finished':
+        process.kill()
+    transport.close()
+    # os.wait4 blocks, so the process is reaped in a thread while the other processes continue
+    return_code = await loop.run_in_executor(None, RUN_LOG.wait, process)
+    if status == 'finished' and return_code != 0:
+        status = 'failed'
+    return ProcessResult(job, return_code, status, monitor.iterations, monitor.scc_error, monitor.errors, time.perf_counter() - start)
+
+async def _run_all(jobs: Sequence[ProcessJob], max_concurrent: int) -> List[ProcessResult]:
+    """Runs the jobs from one event loop, at most max_concurrent at once."""
+    semaphore = asyncio.Semaphore(max_concurrent)
+
+    async def limited(job: ProcessJob) -> ProcessResult:
+        async with semaphore:
+            return await run_process(job)
+
+    return list(await asyncio.gather(*(limited(job) for job in jobs)))
+
+def run_processes(jobs: Sequence[ProcessJob], max_concurrent: int = 0) -> List[ProcessResult]:
+    """Runs several external programs at once from one event loop and waits for all of them.
+
+    Args:
+        jobs (Sequence[ProcessJob]): Programs to be run
+        max_concurrent (int): Maximal number of processes running at once (0: all)
+
+    Returns:
+        List[ProcessResult]: One result per job, in the order of the jobs
+    """
+    if not jobs:
+        return []
+    return asyncio.run(_run_all(jobs, max_concurrent if max_concurrent > 0 else len(jobs)))
+
+def run_process_blocking(job: ProcessJob) -> ProcessResult:
+    """Runs one external program with the asyncio runner and waits for it (for callers without an event loop)."""
+    return run_processes([job])[0]
+
+def describe(result: ProcessResult) -> str:
+    """Describes the outcome of a process in one line.
+
+    Args:
+        result (ProcessResult): Outcome of the process
+
+    Returns:
+        str: Description with status, SCC progress, first error message and the output file
+    """
+    job = result.job
+    description = f"{job.name}{f' ({job.label})' if job.label else ''}: {result.status}"
+    if result.return_code not in (None, 0):
+        description += f", exit code {result.return_code}"
+    if result.scc_iterations:
+        description += f" after {result.scc_iterations} SCC iterations (SCC error {result.scc_error:.2e})"
+    if result.errors:
+        description += f", {result.errors[0]}"
+    return description + f" (see {os.path.join(job.directory, job.output_file)})"
@@ -0,0 +1,220 @@
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
+
+from instrumentation import RUN_LOG
+from modules import available_cores, create_vmd_batch_script, launch_vmd_with_script, orbital_number
+from movie import MovieSettings, make_rotation_movies, movie_files, stream_movies
+from vmd_server import VmdClient, VmdServerError, server_client
+from workspace import Workspace
+
+class RenderJob(NamedTuple):
+    """Rendering of one orbital by a headless VMD worker."""
+    molecule_file: str
+    orbital_file: str
+    background_color: str
+    molecule_style: str
+    movie_maker: str
+    movie_settings: MovieSettings = MovieSettings()
+    isovalue: float = 0.02
+
+class RenderResult(NamedTuple):
+    """Outcome of a render job."""
+    orbital_file: str
+    output_files: List[str]
+    error: str
+
+def render_job(job: RenderJob, output_directory: str, threads_per_worker: int) -> RenderResult:
+    """Renders one orbital with a headless VMD process in its own scratch directory.
+
+    Images, movie frames and rotation movies cannot collide with other workers,
+    because every worker writes only into its scratch directory. The movies are encoded while VMD renders the frames.
+
+    Args:
+        job (RenderJob): Orbital and visualization choices
+        output_directory (str): Directory the images and movies are moved to
+        threads_per_worker (int): Number of threads the Tachyon renderer of the worker may use
+
+    Returns:
+        RenderResult: Images and movies which have been written, or the reason of the failure
+    """
+    name = f"MO_{orbital_number(job.orbital_file)}"
+    workspace = Workspace(f'render_{name}_').create()
+    scratch_directory = workspace.path
+    vmd_script_file = create_vmd_batch_script(os.path.abspath(job.molecule_file), [os.path.abspath(job.orbital_file)],
+                                              job.background_color, job.molecule_style, job.movie_maker, job.movie_settings.n_frames, [job.isovalue])
+    environment = dict(os.environ, VMDFORCECPUCOUNT=str(threads_per_worker))
+    try:
+        with open(os.path.join(scratch_directory, 'vmd.log'), 'w') as log:
+            process = RUN_LOG.popen('vmd', ['vmd', '-dispdev', 'text', '-e', vmd_script_file], name, cwd=scratch_directory,
+                                    stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, env=environment)
+            # The movie frames are encoded while VMD renders them
+            if job.movie_maker in ('yes', 'y'):
+                stream_movies(process, [f"{name}_"], job.movie_settings, scratch_directory)
+            RUN_LOG.wait(process)
+    except OSError as error:
+        workspace.remove()
+        return RenderResult(job.orbital_file, [], f"VMD could not be started: {error}")
+    finally:
+        os.remove(vmd_script_file)
+
+    expected_files = [f"{name}.tga"]
+    if job.movie_maker in ('yes', 'y'):
+        expected_files += movie_files(f"{name}_", job.movie_settings)
+    output_files = workspace.publish(expected_files, output_directory)
+    missing_files = [file for file in expected_files if file not in output_files]
+
+    if process.returncode != 0 or missing_files:
+        return RenderResult(job.orbital_file, output_files,
+                            f"VMD exited with code {process.returncode}, missing {' '.join(missing_files) or 'nothing'} (see {scratch_directory}/vmd.log)")
+    workspace.remove()
+    return RenderResult(job.orbital_file, output_files, '')
+
+def render_job_on_server(job: RenderJob, client: VmdClient, output_directory: str) -> RenderResult:
+    """Renders one orbital with the running render server, which keeps the molecule loaded between the orbitals.
+
+    Args:
+        job (RenderJob): Orbital and visualization choices
+        client (VmdClient): Client of the render server
+        output_directory (str): Directory the images and movies are moved to
+
+    Returns:
+        RenderResult: Images and movies which have been written, or the reason of the failure
+    """
+    name = f"MO_{orbital_number(job.orbital_file)}"
+    movie_settings = job.movie_settings if job.movie_maker in ('yes', 'y') else None
+    with Workspace(f'render_{name}_') as workspace:
+        try:
+            with RUN_LOG.stage('render server', name):
+                expected_files = client.render_orbital(job.molecule_file, job.orbital_file, job.background_color, job.molecule_style,
+                                                       name, workspace.path, job.isovalue, movie_settings)
+        except (VmdServerError, OSError) as error:
+            return RenderResult(job.orbital_file, workspace.publish([f"{name}.tga"], output_directory), f"Render server failed: {error}")
+        output_files = workspace.publish(expected_files, output_directory)
+    missing_files = [file for file in expected_files if file not in output_files]
+    if missing_files:
+        return RenderResult(job.orbital_file, output_files, f"Render server did not write {' '.join(missing_files)}")
+    return RenderResult(job.orbital_file, output_files, '')
+
+def render_rotation_movies(molecule_file: str, orbital_file: str, background_color: str, molecule_style: str, prefix: str = '',
+                           settings: MovieSettings = MovieSettings(), isovalue: float = 0.02) -> List[str]:
+    """Renders and encodes the rotation movies of one orbital with the render server, or with headless VMD processes
+    if no server is running (see movie.make_rotation_movies).
+
+    Args:
+        molecule_file (str): File containing the molecule coordinates
+        orbital_file (str): Cube file of the orbital
+        background_color (str): Background color for the VMD visualization (1: white, 2: black)
+        molecule_style (str): Style for the molecule visualization (1: Lines, 2: CPK, 3: Licorice)
+        prefix (str): Prefix of the movies (<prefix>rotation_<axis>.<extension>)
+        settings (MovieSettings): Format, number of frames and frame delay
+        isovalue (float): Isovalue of the orbital surfaces
+
+    Returns:
+        List[str]: Movies which have been written
+    """
+    client = server_client()
+    if client is None:
+        return make_rotation_movies(molecule_file, orbital_file, background_color, molecule_style, prefix, settings, isovalue)
+    with Workspace(f'{prefix}movie_') as workspace:
+        try:
+            movies = client.render_orbital(molecule_file, orbital_file, background_color, molecule_style, prefix, workspace.path,
+                                           isovalue, settings, image=False)
+        except (VmdServerError, OSError) as error:
+            print(f"Rotation movies of {orbital_file} failed: {error}")
+            return []
+        return workspace.publish(movies)
+
+def render_orbitals_batch(molecule_file: str, orbital_files: List[str], background_color: str, molecule_style: str, movie_maker: str,
+                          movie_settings: MovieSettings = MovieSettings(), isovalues: Optional[List[float]] = None) -> List[str]:
+    """Renders all orbitals in one headless VMD session (see create_vmd_batch_script), or with the render server if one is running.
+
+    The frames of the rotation movies are encoded while VMD is still rendering.
+
+    Args:
+        molecule_file (str): File containing the molecule coordinates
+        orbital_files (List[str]): Cube files of the orbitals
+        background_color (str): Background color for the VMD visualization (1: white, 2: black)
+        molecule_style (str): Style for the molecule visualization (1: Lines, 2: CPK, 3: Licorice)
+        movie_maker (str): Whether movies should be generated (yes/y, no/n)
+        movie_settings (MovieSettings): Format and number of frames of the movies
+        isovalues (Optional[List[float]]): Isovalue of every orbital (None: 0.02 for all orbitals)
+
+    Returns:
+        List[str]: Images (MO_<n>.tga) and movies which have been written
+    """
+    # A running render server already has VMD started
+    client = server_client()
+    if client is not None:
+        if isovalues is None:
+            isovalues = [0.02] * len(orbital_files)
+        results = [render_job_on_server(RenderJob(molecule_file, orbital_file, background_color, molecule_style, movie_maker, movie_settings, isovalue),
+                                        client, os.path.abspath('.'))
+                   for orbital_file, isovalue in zip(orbital_files, isovalues)]
+        for result in results:
+            if result.error:
+                print(f"Rendering of {result.orbital_file} failed: {result.error}")
+            else:
+                print(f"Rendered {' '.join(result.output_files)}")
+        return [file for result in results for file in result.output_files]
+
+    # Create one VMD script for all orbitals and run it without display in a private workspace
+    vmd_script_file = create_vmd_batch_script(os.path.abspath(molecule_file), [os.path.abspath(orbital_file) for orbital_file in orbital_files],
+                                              background_color, molecule_style, movie_maker, movie_settings.n_frames, isovalues)
+    with Workspace('render_batch_') as workspace:
+        vmd_process = launch_vmd_with_script(vmd_script_file, headless=True, directory=workspace.path)
+        names = [f"MO_{orbital_number(orbital_file)}" for orbital_file in orbital_files]
+        movies = []
+        if movie_maker in ('yes', 'y'):
+            movies = stream_movies(vmd_process, [f"{name}_" for name in names], movie_settings, workspace.path)
+        RUN_LOG.wait(vmd_process)
+
+        # Clean up: Remove temporary script file
+        os.remove(vmd_script_file)
+        # Only the images and movies are moved into the current directory
+        output_files = workspace.publish([f"{name}.tga" for name in names])
+        movies = workspace.publish(movies)
+    for orbital_file, name in zip(orbital_files, names):
+        if f"{name}.tga" in output_files:
+            print(f"Rendered {name}.tga")
+        else:
+            print(f"Rendering of {orbital_file} failed.")
+    for movie in movies:
+        print(f"Encoded {movie}")
+    return output_files + movies
+
+def render_orbitals_parallel(jobs: List[RenderJob], n_workers: int = 0, output_directory: str = '.') -> List[RenderResult]:
+    """Renders orbitals with several headless VMD processes at once, or with the render server if one is running.
+
+    Args:
+        jobs (List[RenderJob]): One job per orbital
+        n_workers (int): Number of concurrent VMD processes (0: all available cores)
+        output_directory (str): Directory the images and movies are moved to
+
+    Returns:
+        List[RenderResult]: One result per job, in the order of the jobs
+    """
+    if n_workers <= 0:
+        n_workers = available_cores()
+    n_workers = max(1, min(n_workers, len(jobs)))
+    threads_per_worker = max(1, available_cores() // n_workers)
+    output_directory = os.path.abspath(output_directory)
+
+    client = server_client()
+    if client is not None:
+        # The render server handles one request at a time, the orbitals are rendered one after the other
+        if len(jobs) > 1:
+            print(f"Render server on port {client.state.port} is running: rendering {len(jobs)} orbitals one after the other "
+                  f"instead of with {n_workers} VMD processes (stop the server for parallel rendering).")
+        results = [render_job_on_server(job, client, output_directory) for job in jobs]
+    else:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(render_job, jobs, [output_directory] * len(jobs), [threads_per_worker] * len(jobs)))
+
+    for result in results:
+        if result.error:
+            print(f"Rendering of {result.orbital_file} failed: {result.error}")
+        else:
+            print(f"Rendered {result.orbital_file}: {' '.join(result.output_files)}")
+    return results
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from typing import List, Optional, Sequence, Tuple
+
+from modules import SLATER_KOSTER_PREFIX, dftb_input
+
+# Location and size limit of the cache, can be changed with environment variables
+CACHE_DIRECTORY = os.environ.get('ORBITAL_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'dftb_orbitals'))
+CACHE_SIZE_LIMIT = int(float(os.environ.get('ORBITAL_CACHE_SIZE_GB', '5')) * 1024**3)
+
+# Files of the DFTB+ calculation needed for the cube generation (band.out holds the eigenvalues for the selection of
+# orbitals by energy). dftb_in.hsd is not cached: it includes the xyz file by its path, so it is written again for
+# the xyz file of every run (see write_dftb_input)
+DFTB_RESULT_FILES = ['eigenvec.bin', 'detailed.xml', 'charges.bin', 'band.out']
+
+def normalized_geometry(molecule_xyz: str) -> str:
+    """Writes the first geometry of a xyz file in a normalized form (no comment, fixed number format).
+
+    Args:
+        molecule_xyz (str): File containing the molecule coordinates in xyz format
+
+    Returns:
+        str: One line "element x y z" per atom with coordinates rounded to 1e-6 Angstrom
+    """
+    lines = []
+    with open(molecule_xyz, 'r') as file:
+        number_atoms = int(file.readline().split()[0])
+        next(file)
+        for i in range(0, number_atoms):
+            columns = file.readline().split()
+            coordinates = [round(float(column), 6) + 0.0 for column in columns[1:4]]
+            lines.append(f"{columns[0]} {coordinates[0]:.6f} {coordinates[1]:.6f} {coordinates[2]:.6f}")
+    return '\n'.join(lines)
+
+def dftb_cache_key(molecule_xyz: str, elements: List[str]) -> str:
+    """Calculates the cache key of a DFTB+ calculation.
+
+    The key depends on the normalized geometry, the generated DFTB+ input (without the name of the xyz file)
+    and the Slater-Koster set.
+
+    Args:
+        molecule_xyz (str): File containing the molecule coordinates in xyz format
+        elements (List[str]): List of all different elements in the molecule
+
+    Returns:
+        str: Hexadecimal SHA-256 key
+    """
+    key = hashlib.sha256()
+    key.update(normalized_geometry(molecule_xyz).encode())
+    key.update(dftb_input('geometry.xyz', elements).encode())
+    key.update(SLATER_KOSTER_PREFIX.encode())
+    return key.hexdigest()
+
+def cube_cache_key(dftb_key: str, orbital: str, engine: str, n_points: Sequence[int] = (80, 80, 80),
+                   region: Optional[Tuple[Sequence[float], Sequence[Sequence[float]]]] = None) -> str:
+    """Calculates the cache key of an orbital cube file.
+
+    Args:
+        dftb_key (str): Cache key of the DFTB+ calculation
+        orbital (str): Number of the orbital
+        engine (str): Program generating the cube ('waveplot' or 'numpy')
+        n_points (Sequence[int]): Number of grid points in each direction
+        region (Optional[Tuple[Sequence[float], Sequence[Sequence[float]]]]): Origin and box vectors (Bohr), OptimalCuboid if None
+
+    Returns:
+        str: Hexadecimal SHA-256 key
+    """
+    grid = 'x'.join(str(n) for n in n_points)
+    if region is not None:
+        # Without a region the keys of existing cache entries stay valid
+        origin, box = region
+        grid += ' ' + ' '.join(f"{value:.6f}" for value in list(origin) + [value for vector in box for value in vector])
+    return hashlib.sha256(f"{dftb_key} {int(orbital)} {engine} {grid}".encode()).hexdigest()
+
+class ResultCache:
+    """Persistent, content addressed cache for DFTB+ results and cube files with LRU eviction.
+
+    Every entry is a directory named by its key. The modification time of the directory is the time of the last access.
+    """
+
+    def __init__(self, directory: str = CACHE_DIRECTORY, size_limit: int = CACHE_SIZE_LIMIT):
+        self.directory = directory
+        self.size_limit = size_limit
+        os.makedirs(self.directory, exist_ok=True)
+
+    def entry_directory(self, key: str) -> str:
+        """Returns the directory of a cache entry.
+
+        Args:
+            key (str): Cache key
+
+        Returns:
+            str: Directory of the entry
+        """
+        return os.path.join(self.directory, key[:2], key)
+
+    def fetch(self, key: str, files: List[str], destination: str = '.') -> bool:
+        """Copies the files of a cache entry into a directory.
+
+        Every file is copied to a temporary name and renamed, so concurrent runs never see a partial file.
+
+        Args:
+            key (str): Cache key
+            files (List[str]): Names of the files of the entry
+            destination (str): Directory the files are copied to
+
+        Returns:
+            bool: True if the entry contained all files
+        """
+        entry = self.entry_directory(key)
+        if not all(os.path.isfile(os.path.join(entry, file)) for file in files):
+            return False
+        for file in files:
+            temporary = os.path.join(destination, f".{file}.{os.getpid()}.partial")
+            try:
+                shutil.copyfile(os.path.join(entry, file), temporary)
+            except FileNotFoundError:
+                # The entry has been evicted by a concurrent run
+                return False
+            os.replace(temporary, os.path.join(destination, file))
+        now = time.time()
+        try:
+            os.utime(entry, (now, now))
+        except FileNotFoundError:
+            # The entry has been evicted by a concurrent run after the files were copied
+            pass
+        return True
+
+    def store(self, key: str, files: List[str], source: str = '.') -> None:
+        """Stores files as a cache entry and evicts the least recently used entries above the size limit.
+
+        The entry is written to a temporary directory first and renamed, so incomplete entries are never visible.
+
+        Args:
+            key (str): Cache key
+            files (List[str]): Names of the files to be stored
+            source (str): Directory containing the files
+
+        Returns:
+            None: Writes the cache entry
+        """
+        entry = self.entry_directory(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        temporary = tempfile.mkdtemp(prefix='.incomplete_', dir=os.path.dirname(entry))
+        for file in files:
+            shutil.copyfile(os.path.join(source, file), os.path.join(temporary, file))
+        if os.path.isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.rename(temporary, entry)
+        except OSError:
+            # A concurrent run has stored the same entry in the meantime
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict()
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """Lists all cache entries.
+
+        Returns:
+            List[Tuple[float, int, str]]: Time of the last access, size in bytes and directory of every entry
+        """
+        entries = []
+        for prefix in os.listdir(self.directory):
+            prefix_directory = os.path.join(self.directory, prefix)
+            if not os.path.isdir(prefix_directory):
+                continue
+            for name in os.listdir(prefix_directory):
+                entry = os.path.join(prefix_directory, name)
+                if name.startswith('.incomplete_'):
+                    continue
+                try:
+                    size = sum(os.path.getsize(os.path.join(entry, file)) for file in os.listdir(entry))
+                    entries.append((os.path.getmtime(entry), size, entry))
+                except FileNotFoundError:
+                    # The entry has been evicted or replaced by a concurrent run
+                    continue
+        return entries
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until the cache is below its size limit.
+
+        Returns:
+            None: Removes cache entries
+        """
+        entries = sorted(self.entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total_size <= self.size_limit:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
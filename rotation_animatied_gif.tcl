@@ -1,26 +1,10 @@
-proc make_rotation_animated_gif {} {
-	set frame 0
-	for {set i 0} {$i < 360} {incr i 10} {
-		set filename snap.[format "%04d" $frame].rgb
-		render snapshot $filename
-		incr frame
-		rotate y by 10
+proc render_rotation_frames {axis nframes step {renderer TachyonInternal} {prefix ""} {extension tga}} {
+	# Frames are named <prefix><axis>.NNNN.<extension>, the movie is encoded from them by movie.py
+	for {set frame 0} {$frame < $nframes} {incr frame} {
+		set filename ${prefix}${axis}.[format "%04d" $frame].$extension
+		render $renderer $filename
+		rotate $axis by $step
 	}
-	exec convert -delay 100 -loop 4 snap.*.rgb rotation_y.gif
-	set frame 0
-	for {set i 0} {$i < 360} {incr i 10} {
-		set filename snap.[format "%04d" $frame].rgb
-		render snapshot $filename
-		incr frame
-		rotate x by 10
-	}
-	exec convert -delay 100 -loop 4 snap.*.rgb rotation_x.gif
-	set frame 0
-	for {set i 0} {$i < 360} {incr i 10} {
-		set filename snap.[format "%04d" $frame].rgb
-		render snapshot $filename
-		incr frame
-		rotate z by 10
-	}
-	exec convert -delay 100 -loop 4 snap.*.rgb rotation_z.gif
+	# Marker telling the encoder that the last frame is complete
+	close [open ${prefix}${axis}.done w]
 }
@@ -0,0 +1,170 @@
+import os
+import shutil
+from typing import List, NamedTuple, Optional, Sequence
+
+from grid_sizing import FIXED_GRID, grid_parameters, plan_xyz_grid
+from isovalue import orbital_isovalues
+from modules import input_waveplot_batch, run_dftb
+from movie import MOVIE_EXTENSIONS, MovieSettings, encode_image_files
+from orbital_engine import COMPACT_SUPPORT, write_orbital_cubes
+from orbital_selection import select_orbitals
+from parallel_waveplot import input_waveplot_parallel
+from render_pool import RenderJob, render_orbitals_parallel
+from workspace import Workspace
+from xyz_io import XyzTrajectory
+
+class FrameResult(NamedTuple):
+    """Outcome of the orbital calculation for one trajectory frame."""
+    frame: int
+    directory: str
+    cube_files: List[str]
+    scc_iterations: int
+    warm_start: bool
+
+def parse_frame_selection(selection: str, number_frames: int) -> range:
+    """Converts a frame selection into frame numbers.
+
+    The selection is a single frame ("10") or a range with optional stride ("start:stop:stride", like Python slices,
+    e.g. "::10" for every tenth frame or "100:200" for frames 100 to 199).
+
+    Args:
+        selection (str): Frame selection
+        number_frames (int): Number of frames of the trajectory
+
+    Returns:
+        range: Frame numbers
+    """
+    parts = selection.split(':')
+    if len(parts) == 1:
+        frame = int(parts[0]) % number_frames
+        return range(frame, frame + 1)
+    if len(parts) > 3:
+        raise ValueError(f"Invalid frame selection {selection}, use start:stop:stride.")
+    start, stop, stride = [int(part) if part else None for part in parts + [''] * (3 - len(parts))]
+    return range(*slice(start, stop, stride).indices(number_frames))
+
+def frame_directory(frame: int) -> str:
+    """Returns the directory of a trajectory frame.
+
+    Args:
+        frame (int): Number of the frame
+
+    Returns:
+        str: Directory frame_<frame> (relative to the current directory)
+    """
+    return f"frame_{frame:06d}"
+
+def run_trajectory(trajectory_xyz: str, frames: Sequence[int], orbitals: List[str], elements: List[str], engine: str = '1',
+                   warm_start: bool = True, selection: str = '', grid: str = FIXED_GRID) -> List[FrameResult]:
+    """Calculates the orbital cube files for frames of a trajectory, one after the other.
+
+    Every frame is calculated in its own workspace (see workspace.py), so runs started from the same directory cannot
+    overwrite each other's files; only the geometry, charges.bin and the cube files are moved into frame_<n>. With
+    warm_start the SCC cycle of a frame starts from the charges.bin of the previously calculated frame (DFTB+
+    ReadInitialCharges), which needs far fewer SCC iterations than a start from the neutral atoms for neighboring MD
+    frames. A selection relative to the HOMO and LUMO or by
+    energy is resolved with the first successfully calculated frame, so that all frames show the same levels.
+
+    Args:
+        trajectory_xyz (str): Multi-frame xyz file
+        frames (Sequence[int]): Numbers of the frames to be calculated
+        orbitals (List[str]): Numbers of the orbitals to be calculated
+        elements (List[str]): List of all different elements in the trajectory
+        engine (str): Program for the cube files (1: waveplot, 2: NumPy engine, 3: parallel waveplot)
+        warm_start (bool): Start every frame from the charges of the previous frame
+        selection (str): Orbital selection (see orbital_selection.select_levels), used if orbitals is empty
+        grid (str): Grid setting (see grid_sizing.grid_preset), planned around the atoms of every frame
+
+    Returns:
+        List[FrameResult]: One result per frame
+    """
+    results = []
+    previous_charges: Optional[str] = None
+    # The charges of the last calculated frame are kept in a workspace of this run, so concurrent runs cannot mix them
+    with Workspace('trajectory_') as run_workspace, XyzTrajectory(trajectory_xyz) as trajectory:
+        for frame in frames:
+            directory = frame_directory(frame)
+            os.makedirs(directory, exist_ok=True)
+            # DFTB+ and the cube generation of every frame run in a private workspace
+            with Workspace(f'frame_{frame}_') as workspace:
+                trajectory.write_frame(frame, workspace.file('geometry.xyz'))
+
+                read_initial_charges = warm_start and previous_charges is not None
+                if read_initial_charges:
+                    shutil.copyfile(previous_charges, workspace.file('charges.bin'))
+                dftb_result = run_dftb('geometry.xyz', elements, workspace.path, read_initial_charges)
+                iterations = dftb_result.scc_iterations
+
+                if dftb_result.status != 'finished' or not os.path.isfile(workspace.file('eigenvec.bin')):
+                    workspace.publish(['geometry.xyz', 'dftb.out'], directory)
+                    print(f"Frame {frame}: DFTB+ calculation failed (see {directory}/dftb.out).")
+                    results.append(FrameResult(frame, directory, [], iterations, read_initial_charges))
+                    previous_charges = None
+                    continue
+                previous_charges = shutil.copyfile(workspace.file('charges.bin'), run_workspace.file('charges.bin'))
+                if not orbitals:
+                    orbitals = select_orbitals(selection, workspace.path)
+                    print(f"Frame {frame}: selected orbitals {' '.join(orbitals)}")
+
+                n_points, region = grid_parameters(plan_xyz_grid(workspace.file('geometry.xyz'), grid))
+                if engine == '2':
+                    cube_files = write_orbital_cubes(orbitals, workspace.file('detailed.xml'), workspace.file('eigenvec.bin'),
+                                                     n_points, region, COMPACT_SUPPORT)
+                elif engine == '3':
+                    cube_files = input_waveplot_parallel(orbitals, n_points=n_points, directory=workspace.path, region=region,
+                                                         compact=COMPACT_SUPPORT)
+                else:
+                    cube_files = input_waveplot_batch(orbitals, workspace.path, n_points, region)
+                # Only the geometry, the charges and the cube files are moved into the frame directory
+                cube_files = workspace.publish(cube_files, directory)
+                workspace.publish(['geometry.xyz', 'charges.bin'], directory)
+
+            start = 'warm start' if read_initial_charges else 'cold start'
+            print(f"Frame {frame}: {iterations} SCC iterations ({start}), cube files written: {' '.join(cube_files)}")
+            results.append(FrameResult(frame, directory, cube_files, iterations, read_initial_charges))
+    return results
+
+def render_trajectory(results: List[FrameResult], background_color: str, molecule_style: str,
+                      enclosed_fraction: Optional[float] = None) -> None:
+    """Renders the orbitals of every frame (MO_<n>.tga in the frame directories) with headless VMD processes.
+
+    Args:
+        results (List[FrameResult]): Calculated frames
+        background_color (str): Background color for the VMD visualization (1: white, 2: black)
+        molecule_style (str): Style for the molecule visualization (1: Lines, 2: CPK, 3: Licorice)
+        enclosed_fraction (Optional[float]): Fraction of the density enclosed by the isosurfaces (None: fixed isovalue 0.02)
+
+    Returns:
+        None: Writes the images
+    """
+    for result in results:
+        cube_paths = [os.path.join(result.directory, cube_file) for cube_file in result.cube_files]
+        if not cube_paths:
+            continue
+        # The orbitals of one frame are rendered by several VMD processes at once
+        render_jobs = [RenderJob(os.path.join(result.directory, 'geometry.xyz'), cube_path, background_color, molecule_style, 'no',
+                                 MovieSettings(), isovalue)
+                       for cube_path, isovalue in zip(cube_paths, orbital_isovalues(cube_paths, enclosed_fraction))]
+        render_orbitals_parallel(render_jobs, output_directory=result.directory)
+
+def orbital_evolution_movies(results: List[FrameResult], orbitals: List[str], settings: MovieSettings) -> List[str]:
+    """Encodes the rendered images of every orbital along the trajectory into a movie (MO_<n>_evolution.<extension>).
+
+    Args:
+        results (List[FrameResult]): Calculated and rendered frames
+        orbitals (List[str]): Numbers of the orbitals
+        settings (MovieSettings): Format and frame delay of the movies
+
+    Returns:
+        List[str]: Movies which have been written
+    """
+    movies = []
+    for orbital in orbitals:
+        image_files = [os.path.join(result.directory, f"MO_{orbital}.tga") for result in results]
+        image_files = [image_file for image_file in image_files if os.path.isfile(image_file)]
+        if len(image_files) < 2:
+            print(f"Not enough images of orbital {orbital} for a movie.")
+            continue
+        movies.append(encode_image_files(image_files, f"MO_{orbital}_evolution.{MOVIE_EXTENSIONS[settings.format]}", settings))
+        print(f"Encoded {movies[-1]} ({len(image_files)} frames)")
+    return movies
@@ -1,18 +1,29 @@
+import atexit
 import sys
 import os
 
-from modules import create_vmd_script, user_choices, launch_vmd_with_script
+from modules import create_vmd_script, user_choices, launch_vmd_with_script, render_mode_choice, orbital_number, movie_choices, isovalue_choice, preview_choice
+from cube_pyramid import preview_cube
+from instrumentation import RUN_LOG
+from isovalue import orbital_isovalues
+from movie import MovieSettings
+from render_pool import RenderJob, render_orbitals_batch, render_orbitals_parallel, render_rotation_movies
+from vmd_server import display_client
+from offscreen_renderer import render_orbitals_offscreen
 
 if __name__ == '__main__':
 
     # Check, if enough elements are present
-    if len(sys.argv) != 3:
-        print(f"Usage: python3 {sys.argv[0]} CoordinatesFile CubeFile")
+    if len(sys.argv) < 3:
+        print(f"Usage: python3 {sys.argv[0]} CoordinatesFile CubeFile [CubeFile ...]")
         exit()
 
+    # Resources of every stage and external program are summarized when the run ends
+    atexit.register(RUN_LOG.finish)
+
     #reading input files input
     molecule_file_path=sys.argv[1]
-    orbital_file_path=sys.argv[2]
+    orbital_file_paths=sys.argv[2:]
 
     #Checking for files specified in orbitals.inp
     condition_1 = os.path.isfile(molecule_file_path)
@@ -21,34 +32,74 @@ if __name__ == '__main__':
     else:
         print(f"Specified Coordinates file {molecule_file_path} not found --> exiting.")
         exit()
-    condition_2 = os.path.isfile(orbital_file_path)
-    if condition_2 is not False:
-        print(f"Found Orbital file: {orbital_file_path}")
-    else:
-        print(f"Specified Orbital file {orbital_file_path} not found --> exiting.")
-        exit()
+    for orbital_file_path in orbital_file_paths:
+        condition_2 = os.path.isfile(orbital_file_path)
+        if condition_2 is not False:
+            print(f"Found Orbital file: {orbital_file_path}")
+        else:
+            print(f"Specified Orbital file {orbital_file_path} not found --> exiting.")
+            exit()
 
     #user choices
     background_color, molecule_style, movie_maker = user_choices()
-    
-    # Create VMD script
-    vmd_script_file = create_vmd_script(molecule_file_path,orbital_file_path, background_color, molecule_style, movie_maker)
+    movie_settings = MovieSettings()
+    if movie_maker in ('yes', 'y'):
+        movie_format, n_frames = movie_choices()
+        movie_settings = MovieSettings(format=movie_format, n_frames=n_frames)
+    enclosed_fraction = isovalue_choice()
+    render_mode = render_mode_choice()
+    preview_level = preview_choice()
 
-    print("------------------------------------------------------------------------")
-    print("Launching VMD and loading Data into VMD.")
-    print("------------------------------------------------------------------------")
+    # Isovalues of the orbital surfaces (fixed or calculated from the cube files)
+    with RUN_LOG.stage('isovalues'):
+        isovalues = orbital_isovalues(orbital_file_paths, enclosed_fraction)
 
-    # Launch VMD with the script
-    vmd_process = launch_vmd_with_script(vmd_script_file)
+    if render_mode == '2':
+        # Render all orbitals in one VMD session without display
+        render_files = [preview_cube(orbital_file_path, preview_level) for orbital_file_path in orbital_file_paths]
+        with RUN_LOG.stage('rendering', molecule_file_path):
+            render_orbitals_batch(molecule_file_path, render_files, background_color, molecule_style, movie_maker, movie_settings, isovalues)
+        exit()
+    elif render_mode == '3':
+        # Render every orbital in its own headless VMD process, several at once
+        render_jobs = [RenderJob(molecule_file_path, preview_cube(orbital_file_path, preview_level), background_color, molecule_style, movie_maker, movie_settings, isovalue)
+                       for orbital_file_path, isovalue in zip(orbital_file_paths, isovalues)]
+        with RUN_LOG.stage('rendering', molecule_file_path):
+            render_orbitals_parallel(render_jobs)
+        exit()
+    elif render_mode == '4':
+        # Render all orbitals with the built-in renderer, the molecule is taken from the cube files
+        render_files = [preview_cube(orbital_file_path, preview_level) for orbital_file_path in orbital_file_paths]
+        with RUN_LOG.stage('rendering', molecule_file_path):
+            render_orbitals_offscreen(render_files, background_color, molecule_style, movie_maker, movie_settings, isovalues)
+        exit()
 
-    # Wait for VMD to finish
-    vmd_process.wait()
+    for orbital_file_path, isovalue in zip(orbital_file_paths, isovalues):
+        viewer = display_client()
+        if viewer is not None:
+            # Show the orbital in the window of the running render server
+            viewer.show_orbital(molecule_file_path, orbital_file_path, background_color, molecule_style, isovalue)
+            input("Press Enter to continue with the next orbital.")
+        else:
+            # Create VMD script
+            vmd_script_file = create_vmd_script(molecule_file_path,orbital_file_path, background_color, molecule_style, isovalue,
+                                                preview_cube(orbital_file_path, preview_level) if preview_level else '')
 
-    # Clean up: Remove temporary script file
-    os.remove(vmd_script_file)
+            print("------------------------------------------------------------------------")
+            print("Launching VMD and loading Data into VMD.")
+            print("------------------------------------------------------------------------")
 
-    #removing Snapshots from movie
-    if movie_maker in ('yes', 'y'):
-        del_vec = ['0000','0001','0002','0003','0004','0005','0006','0007','0008','0009','0010','0011','0012','0013','0014','0015','0016','0017','0018','0019','0020','0021','0022','0023','0024','0025','0026','0027','0028','0029','0030','0031','0032','0033','0034','0035']
-        for i in del_vec:
-            os.remove(f'snap.{i}.rgb')
\ No newline at end of file
+            # Launch VMD with the script
+            vmd_process = launch_vmd_with_script(vmd_script_file)
+
+            # Wait for VMD to finish
+            RUN_LOG.wait(vmd_process)
+
+            # Clean up: Remove temporary script file
+            os.remove(vmd_script_file)
+
+        # Rendering and encoding the rotation movies without display, keeping the movies of every orbital if several orbitals are shown
+        if movie_maker in ('yes', 'y'):
+            prefix = f'MO_{orbital_number(orbital_file_path)}_' if len(orbital_file_paths) > 1 else ''
+            with RUN_LOG.stage('movies', orbital_file_path):
+                render_rotation_movies(molecule_file_path, orbital_file_path, background_color, molecule_style, prefix, movie_settings, isovalue)
@@ -0,0 +1,149 @@
+# Render server for VMD, started by vmd_server.py (vmd -e vmd_render_server.tcl).
+# Requests come over a socket bound to 127.0.0.1: a line with the access token, a line with the length of the
+# Tcl script in bytes and the script itself. The reply is "OK <length>" or "ERROR <length>" followed by the result.
+# Molecules and cube files stay loaded between the requests.
+
+set orbital_server_port $env(ORBITAL_VMD_PORT)
+set orbital_server_token $env(ORBITAL_VMD_TOKEN)
+set orbital_server_display [expr {[info exists env(ORBITAL_VMD_DISPLAY)] && $env(ORBITAL_VMD_DISPLAY) == 1}]
+array set orbital_server_molecules {}
+# Molecules kept loaded at most (e.g. the frames of a trajectory), the oldest is deleted first
+set orbital_server_max_molecules 16
+# Cube files kept loaded per molecule at most, VMD cannot delete single volumes, so the molecule is loaded again
+set orbital_server_max_volumes 32
+array set orbital_server_volumes {}
+
+proc orbital_server_forget {path} {
+	# Deletes a molecule and its volumes from VMD and from the cache
+	global orbital_server_molecules orbital_server_volumes
+	set molid [lindex $orbital_server_molecules($path) 0]
+	if {[lsearch [molinfo list] $molid] >= 0} {
+		mol delete $molid
+	}
+	array unset orbital_server_volumes "$molid,*"
+	unset orbital_server_molecules($path)
+}
+
+proc orbital_server_molecule {path} {
+	# Molecule of a xyz file, loaded again only if the file changed or the molecule was deleted
+	global orbital_server_molecules orbital_server_max_molecules
+	set modified [file mtime $path]
+	if {[info exists orbital_server_molecules($path)]} {
+		lassign $orbital_server_molecules($path) molid loaded
+		if {$loaded == $modified && [lsearch [molinfo list] $molid] >= 0} {
+			return $molid
+		}
+		orbital_server_forget $path
+	}
+	# Molecule ids grow, the smallest id belongs to the molecule loaded first
+	while {[array size orbital_server_molecules] >= $orbital_server_max_molecules} {
+		set oldest ""
+		foreach cached [array names orbital_server_molecules] {
+			if {$oldest eq "" || [lindex $orbital_server_molecules($cached) 0] < [lindex $orbital_server_molecules($oldest) 0]} {
+				set oldest $cached
+			}
+		}
+		orbital_server_forget $oldest
+	}
+	set molid [mol new $path waitfor all]
+	set orbital_server_molecules($path) [list $molid $modified]
+	display resetview
+	# Representations 1 and 2 show the positive and negative isosurfaces
+	mol addrep $molid
+	mol addrep $molid
+	return $molid
+}
+
+proc orbital_server_volume {molid cube} {
+	# Index of the volume data set of a cube file in a molecule, loaded once
+	global orbital_server_volumes
+	set modified [file mtime $cube]
+	if {[info exists orbital_server_volumes($molid,$cube)]} {
+		lassign $orbital_server_volumes($molid,$cube) volume loaded
+		if {$loaded == $modified} {
+			return $volume
+		}
+	}
+	set volume [molinfo $molid get numvolumedata]
+	mol addfile $cube type cube waitfor all molid $molid
+	set orbital_server_volumes($molid,$cube) [list $volume $modified]
+	return $volume
+}
+
+proc orbital_server_scene {path cube} {
+	# Molecule and volume index of a xyz file and a cube file, loaded only if they are not loaded already
+	global orbital_server_volumes orbital_server_max_volumes
+	set molid [orbital_server_molecule $path]
+	set loaded 0
+	if {[info exists orbital_server_volumes($molid,$cube)]} {
+		set loaded [expr {[lindex $orbital_server_volumes($molid,$cube) 1] == [file mtime $cube]}]
+	}
+	if {!$loaded && [molinfo $molid get numvolumedata] >= $orbital_server_max_volumes} {
+		# Frees the memory of all volumes of the molecule
+		orbital_server_forget $path
+		set molid [orbital_server_molecule $path]
+	}
+	return [list $molid [orbital_server_volume $molid $cube]]
+}
+
+proc orbital_server_show {molid volume isovalue} {
+	# Shows only this molecule with the isosurfaces of one of its volumes
+	foreach other [molinfo list] {
+		if {$other == $molid} {
+			mol on $other
+		} else {
+			mol off $other
+		}
+	}
+	mol color ColorID 0
+	mol representation Isosurface $isovalue $volume 0 0 1 1
+	mol modrep 1 $molid
+	mol color ColorID 1
+	mol representation Isosurface [expr {-$isovalue}] $volume 0 0 1 1
+	mol modrep 2 $molid
+	display update
+}
+
+proc orbital_server_request {channel} {
+	global orbital_server_token
+	if {[gets $channel token] < 0 || [gets $channel length] < 0} {
+		close $channel
+		return
+	}
+	if {$token ne $orbital_server_token} {
+		set status 1
+		set result "invalid token"
+	} else {
+		set script [encoding convertfrom utf-8 [read $channel $length]]
+		set status [catch {uplevel #0 $script} result]
+	}
+	set reply [encoding convertto utf-8 $result]
+	puts -nonewline $channel "[expr {$status == 1 ? {ERROR} : {OK}}] [string length $reply]\n$reply"
+	close $channel
+}
+
+proc orbital_server_accept {channel address port} {
+	fconfigure $channel -translation binary -blocking 1
+	fileevent $channel readable [list orbital_server_request $channel]
+}
+
+proc orbital_server_stop {} {
+	# VMD quits once the current request has been answered
+	global orbital_server_running
+	set orbital_server_running 0
+}
+
+proc orbital_server_heartbeat {} {
+	# Keeps the window of VMD responsive while the server waits for requests
+	display update ui
+	after 40 orbital_server_heartbeat
+}
+
+source [file join [file dirname [info script]] rotation_animatied_gif.tcl]
+socket -server orbital_server_accept -myaddr 127.0.0.1 $orbital_server_port
+if {$orbital_server_display} {
+	orbital_server_heartbeat
+}
+set orbital_server_running 1
+vwait orbital_server_running
+quit
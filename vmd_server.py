@@ -0,0 +1,275 @@
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import time
+from typing import List, NamedTuple, Optional
+
+from modules import vmd_display_settings
+from movie import ROTATION_AXES, MovieSettings, encode_image_files, movie_files
+
+# Tcl script of the render server (see vmd_render_server.tcl)
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vmd_render_server.tcl")
+
+# Port of the render server on 127.0.0.1
+VMD_SERVER_PORT = int(os.environ.get('ORBITAL_VMD_PORT', '5601'))
+
+# File with the port, access token and process id of the running render server (readable only by its owner)
+VMD_SERVER_STATE = os.environ.get('ORBITAL_VMD_SERVER_STATE', os.path.join(os.path.expanduser('~'), '.orbital_vmd_server'))
+
+# Seconds VMD may take to start the render server
+VMD_SERVER_START_TIMEOUT = 60.0
+
+class VmdServerError(Exception):
+    """Error reported by the render server, or the server cannot be reached."""
+
+class ServerState(NamedTuple):
+    """Connection details of a running render server."""
+    port: int
+    token: str
+    pid: int
+    display: bool
+
+def read_server_state(state_file: str = VMD_SERVER_STATE) -> Optional[ServerState]:
+    """Reads the connection details written by start_server.
+
+    Args:
+        state_file (str): State file of the render server
+
+    Returns:
+        Optional[ServerState]: Port, token, process id and display mode (None if no server has been started)
+    """
+    try:
+        with open(state_file, 'r') as file:
+            port, token, pid, display = file.read().split()
+        return ServerState(int(port), token, int(pid), display == '1')
+    except (OSError, ValueError):
+        return None
+
+class VmdClient:
+    """Connection to the render server: every request sends a Tcl script, which VMD evaluates at global level.
+
+    Molecules and cube files stay loaded in VMD between requests, so only the first request for a molecule pays for
+    loading it, and no request pays for the start of VMD.
+    """
+
+    def __init__(self, state: ServerState, timeout: float = 600.0):
+        self.state = state
+        self.timeout = timeout
+
+    def command(self, script: str) -> str:
+        """Evaluates a Tcl script in the render server.
+
+        Args:
+            script (str): Tcl commands
+
+        Returns:
+            str: Result of the last command
+        """
+        data = script.encode()
+        try:
+            with socket.create_connection(('127.0.0.1', self.state.port), timeout=self.timeout) as connection:
+                connection.sendall(f"{self.state.token}\n{len(data)}\n".encode() + data)
+                reply = b''
+                while True:
+                    chunk = connection.recv(65536)
+                    if not chunk:
+                        break
+                    reply += chunk
+        except OSError as error:
+            raise VmdServerError(f"Render server on port {self.state.port} cannot be reached: {error}") from None
+        status_line, _, result = reply.partition(b'\n')
+        status = status_line.split()
+        if len(status) != 2 or len(result) != int(status[1]):
+            raise VmdServerError(f"Incomplete reply of the render server: {status_line.decode(errors='replace')}")
+        if status[0] != b'OK':
+            raise VmdServerError(result.decode(errors='replace'))
+        return result.decode()
+
+    def orbital_script(self, molecule_file: str, orbital_file: str, background_color: str, molecule_style: str, isovalue: float = 0.02) -> str:
+        """Creates the Tcl commands showing an orbital with the molecule; both are loaded only if they are not loaded already.
+
+        Args:
+            molecule_file (str): File containing the molecule coordinates in xyz format
+            orbital_file (str): Cube file of the orbital
+            background_color (str): Background color for the VMD visualization (1: white, 2: black)
+            molecule_style (str): Style for the molecule visualization (1: Lines, 2: CPK, 3: Licorice)
+            isovalue (float): Isovalue of the orbital surfaces
+
+        Returns:
+            str: Tcl commands
+        """
+        script = f"""\
+lassign [orbital_server_scene "{os.path.abspath(molecule_file)}" "{os.path.abspath(orbital_file)}"] molecule volume
+orbital_server_show $molecule $volume {isovalue:.6g}
+"""
+        return script + '\n'.join(line.strip() for line in vmd_display_settings(background_color, molecule_style).splitlines()) + '\n'
+
+    def show_orbital(self, molecule_file: str, orbital_file: str, background_color: str, molecule_style: str, isovalue: float = 0.02) -> None:
+        """Shows an orbital with the molecule in the window of the render server (see orbital_script)."""
+        self.command(self.orbital_script(molecule_file, orbital_file, background_color, molecule_style, isovalue) + "display update\n")
+
+    def render_orbital(self, molecule_file: str, orbital_file: str, background_color: str, molecule_style: str, name: str, directory: str,
+                       isovalue: float = 0.02, movie_settings: Optional[MovieSettings] = None, image: bool = True) -> List[str]:
+        """Renders the image and optionally the rotation movies of one orbital with the Tachyon renderer built into VMD.
+
+        The scene is set up and rendered in a single request, so that requests of several threads cannot mix their scenes.
+
+        Args:
+            molecule_file (str): File containing the molecule coordinates in xyz format
+            orbital_file (str): Cube file of the orbital
+            background_color (str): Background color for the VMD visualization (1: white, 2: black)
+            molecule_style (str): Style for the molecule visualization (1: Lines, 2: CPK, 3: Licorice)
+            name (str): Name of the image (<name>.tga) and prefix of the movies (<name>_rotation_<axis>.<extension>)
+            directory (str): Directory of the image and movies
+            isovalue (float): Isovalue of the orbital surfaces
+            movie_settings (Optional[MovieSettings]): Format and number of frames of the movies (None: no movies)
+            image (bool): Render the image (False: only the movies, named <name>rotation_<axis>.<extension>)
+
+        Returns:
+            List[str]: Names of the image and movies which have been written
+        """
+        directory = os.path.abspath(directory)
+        movie_prefix = f"{name}_" if image else name
+        frame_prefix = os.path.join(directory, movie_prefix)
+        script = self.orbital_script(molecule_file, orbital_file, background_color, molecule_style, isovalue)
+        if image:
+            script += f'render TachyonInternal "{os.path.join(directory, name)}.tga"\n'
+        if movie_settings is not None:
+            for axis in ROTATION_AXES:
+                script += f'render_rotation_frames {axis} {movie_settings.n_frames} {360.0 / movie_settings.n_frames} TachyonInternal "{frame_prefix}"\n'
+        self.command(script)
+
+        written = [f"{name}.tga"] if image else []
+        if movie_settings is not None:
+            for axis, movie_file in zip(ROTATION_AXES, movie_files(movie_prefix, movie_settings)):
+                os.remove(f"{frame_prefix}{axis}.done")
+                frames = [f"{frame_prefix}{axis}.{frame:04d}.tga" for frame in range(0, movie_settings.n_frames)]
+                encode_image_files(frames, os.path.join(directory, movie_file), movie_settings)
+                for frame in frames:
+                    os.remove(frame)
+                written.append(movie_file)
+        return written
+
+    def stop(self) -> None:
+        """Stops the render server (VMD quits after the reply)."""
+        self.command("orbital_server_stop\n")
+
+def server_client(state_file: str = VMD_SERVER_STATE) -> Optional[VmdClient]:
+    """Connects to the render server if one is running.
+
+    Args:
+        state_file (str): State file of the render server
+
+    Returns:
+        Optional[VmdClient]: Client of the running server (None: no server is running, VMD has to be started)
+    """
+    state = read_server_state(state_file)
+    if state is None:
+        return None
+    client = VmdClient(state, timeout=5.0)
+    try:
+        client.command("return ok\n")
+    except VmdServerError:
+        return None
+    return VmdClient(state)
+
+def display_client(state_file: str = VMD_SERVER_STATE) -> Optional[VmdClient]:
+    """Connects to the render server if one is running with the VMD window (started with --display).
+
+    Args:
+        state_file (str): State file of the render server
+
+    Returns:
+        Optional[VmdClient]: Client of the running server (None: no server with window is running)
+    """
+    client = server_client(state_file)
+    if client is None or not client.state.display:
+        return None
+    return client
+
+def start_server(display: bool = False, port: int = VMD_SERVER_PORT, state_file: str = VMD_SERVER_STATE) -> VmdClient:
+    """Starts VMD as render server in the background, which keeps running after this process ends.
+
+    Args:
+        display (bool): Open the VMD window (interactive looks), otherwise VMD runs in text mode (rendering only)
+        port (int): Port on 127.0.0.1
+        state_file (str): File the port, token and process id are written to
+
+    Returns:
+        VmdClient: Client of the started server
+    """
+    client = server_client(state_file)
+    if client is not None:
+        print(f"Render server is already running on port {client.state.port}.")
+        return client
+
+    token = secrets.token_hex(16)
+    environment = dict(os.environ, ORBITAL_VMD_PORT=str(port), ORBITAL_VMD_TOKEN=token, ORBITAL_VMD_DISPLAY='1' if display else '0')
+    command = ['vmd', '-e', SERVER_SCRIPT] if display else ['vmd', '-dispdev', 'text', '-e', SERVER_SCRIPT]
+    log_file = f"{state_file}.log"
+    with open(log_file, 'w') as log:
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, env=environment,
+                                   start_new_session=True)
+    state = ServerState(port, token, process.pid, display)
+
+    # Only the owner may read the token
+    descriptor = os.open(state_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'w') as file:
+        file.write(f"{state.port} {state.token} {state.pid} {int(display)}\n")
+
+    client = VmdClient(state, timeout=5.0)
+    deadline = time.perf_counter() + VMD_SERVER_START_TIMEOUT
+    while True:
+        try:
+            client.command("return ok\n")
+            return VmdClient(state)
+        except VmdServerError:
+            if process.poll() is not None or time.perf_counter() > deadline:
+                os.remove(state_file)
+                raise VmdServerError(f"Render server did not start (see {log_file}).") from None
+            time.sleep(0.2)
+
+def stop_server(state_file: str = VMD_SERVER_STATE) -> bool:
+    """Stops the running render server.
+
+    Args:
+        state_file (str): State file of the render server
+
+    Returns:
+        bool: True if a server has been stopped
+    """
+    client = server_client(state_file)
+    if os.path.isfile(state_file):
+        os.remove(state_file)
+    if client is None:
+        return False
+    client.stop()
+    return True
+
+if __name__ == '__main__':
+
+    # Check, if enough elements are present
+    if len(sys.argv) < 2 or sys.argv[1] not in ('start', 'stop', 'status'):
+        print(f"Usage: python3 {sys.argv[0]} start [--display] | stop | status")
+        exit()
+
+    if sys.argv[1] == 'start':
+        options = sys.argv[2:]
+        for option in options:
+            if option != '--display':
+                print(f"Unknown option {option}.")
+                exit()
+        started_client = start_server('--display' in options)
+        mode = 'with window' if started_client.state.display else 'in text mode'
+        print(f"Render server {mode} is running on port {started_client.state.port} (process {started_client.state.pid}).")
+    elif sys.argv[1] == 'stop':
+        print("Render server stopped." if stop_server() else "No render server is running.")
+    else:
+        running_client = server_client()
+        if running_client is None:
+            print("No render server is running.")
+        else:
+            mode = 'with window' if running_client.state.display else 'in text mode'
+            print(f"Render server {mode} is running on port {running_client.state.port} (process {running_client.state.pid}).")
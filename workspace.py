@@ -0,0 +1,129 @@
+import errno
+import os
+import shutil
+import tempfile
+from typing import List, Optional, Sequence
+
+# Directory of the job workspaces (empty: chosen by scratch_base)
+SCRATCH_DIRECTORY = os.environ.get('ORBITAL_SCRATCH_DIR', '')
+
+# Minimal free space of an automatically chosen scratch file system
+SCRATCH_MIN_FREE = int(float(os.environ.get('ORBITAL_SCRATCH_MIN_FREE_GB', '1')) * 1024**3)
+
+def scratch_base() -> str:
+    """Chooses the directory the job workspaces are created in.
+
+    ORBITAL_SCRATCH_DIR is used if it is set. Otherwise the first writable directory with enough free space of
+    /dev/shm (node-local memory), $TMPDIR and the default temporary directory is used.
+
+    Returns:
+        str: Directory for the workspaces
+    """
+    if SCRATCH_DIRECTORY:
+        os.makedirs(SCRATCH_DIRECTORY, exist_ok=True)
+        return SCRATCH_DIRECTORY
+    for directory in ('/dev/shm', os.environ.get('TMPDIR', ''), tempfile.gettempdir()):
+        if directory and os.path.isdir(directory) and os.access(directory, os.W_OK | os.X_OK):
+            if shutil.disk_usage(directory).free >= SCRATCH_MIN_FREE:
+                return directory
+    return tempfile.gettempdir()
+
+def publish(source: str, destination: str) -> str:
+    """Moves a file to its destination atomically, so that readers never see a partial file.
+
+    Within one file system the file is renamed. Across file systems it is copied to a hidden temporary file next to
+    the destination first, which is then renamed.
+
+    Args:
+        source (str): File to be moved
+        destination (str): Path of the moved file (replaced if it exists)
+
+    Returns:
+        str: Path of the moved file
+    """
+    try:
+        os.replace(source, destination)
+        return destination
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+    handle, temporary = tempfile.mkstemp(prefix=f".{os.path.basename(destination)}.", suffix='.partial',
+                                         dir=os.path.dirname(os.path.abspath(destination)))
+    os.close(handle)
+    try:
+        shutil.copyfile(source, temporary)
+        os.replace(temporary, destination)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    os.remove(source)
+    return destination
+
+class Workspace:
+    """Private temporary directory of one run or stage on fast scratch storage.
+
+    All intermediate files (DFTB+ and waveplot inputs and outputs, movie frames) are written into the workspace,
+    so runs started from the same directory cannot overwrite each other. Only the results are published to their
+    destination. Used as context manager the workspace is removed at the end, but kept for inspection if an error
+    occurred.
+    """
+
+    def __init__(self, prefix: str = 'orbitals_', base: str = ''):
+        self.prefix = prefix
+        self.base = base
+        self.path = ''
+
+    def create(self) -> 'Workspace':
+        """Creates the directory of the workspace."""
+        self.path = tempfile.mkdtemp(prefix=self.prefix, dir=self.base or scratch_base())
+        return self
+
+    def remove(self) -> None:
+        """Removes the workspace with all files left in it."""
+        if self.path and os.path.isdir(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self) -> 'Workspace':
+        return self.create()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None and issubclass(exc_type, Exception):
+            print(f"Workspace kept for inspection: {self.path}")
+        else:
+            self.remove()
+
+    def file(self, name: str) -> str:
+        """Returns the path of a file in the workspace."""
+        return os.path.join(self.path, name)
+
+    def copy_in(self, source: str, name: Optional[str] = None) -> str:
+        """Copies an input file into the workspace.
+
+        Args:
+            source (str): File to be copied
+            name (Optional[str]): Name in the workspace (None: name of the source)
+
+        Returns:
+            str: Name of the file in the workspace
+        """
+        name = name or os.path.basename(source)
+        shutil.copyfile(source, self.file(name))
+        return name
+
+    def publish(self, files: Sequence[str], destination_directory: str = '.') -> List[str]:
+        """Moves result files from the workspace to their destination (see publish).
+
+        Args:
+            files (Sequence[str]): Names of the files in the workspace
+            destination_directory (str): Directory the files are moved to
+
+        Returns:
+            List[str]: Names of the files which have been moved (missing files are skipped)
+        """
+        published = []
+        for name in files:
+            if os.path.isfile(self.file(name)):
+                publish(self.file(name), os.path.join(destination_directory, name))
+                published.append(name)
+        return published
@@ -0,0 +1,198 @@
+import mmap
+import os
+import sys
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# Size of the blocks scanned for line ends while the frame index is built
+INDEX_BLOCK_SIZE = 64 * 1024**2
+
+class XyzFrame(NamedTuple):
+    """Single frame (geometry) of a xyz file."""
+    comment: str
+    species: np.ndarray
+    coordinates: np.ndarray
+
+def build_frame_index(buffer: mmap.mmap) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds the byte offsets of all frames of a xyz file in one pass.
+
+    The line ends are located block by block with NumPy; only the first line of every frame (the number of atoms)
+    is parsed, the other lines of a frame are skipped by counting line ends.
+
+    Args:
+        buffer (mmap.mmap): Memory map of the xyz file
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Offsets of the first and behind the last byte of every complete frame
+    """
+    size = len(buffer)
+    starts: List[int] = []
+    ends: List[int] = []
+    position = 0           # start of the current frame
+    lines_to_skip = 0      # lines of the current frame still to be skipped (0: looking for the next header)
+    last_line_end = -1
+    for block_start in range(0, size, INDEX_BLOCK_SIZE):
+        block = np.frombuffer(buffer, dtype=np.uint8, count=min(INDEX_BLOCK_SIZE, size - block_start), offset=block_start)
+        line_ends = np.flatnonzero(block == ord('\n')) + block_start
+        if len(line_ends):
+            last_line_end = int(line_ends[-1])
+        i = 0
+        while i < len(line_ends):
+            if lines_to_skip == 0:
+                header = buffer[position:line_ends[i]].strip()
+                i += 1
+                if not header:
+                    # Blank lines between or after frames
+                    position = int(line_ends[i - 1]) + 1
+                    continue
+                lines_to_skip = int(header.split()[0]) + 1
+                starts.append(position)
+            if i + lines_to_skip <= len(line_ends):
+                i += lines_to_skip
+                position = int(line_ends[i - 1]) + 1
+                ends.append(position)
+                lines_to_skip = 0
+            else:
+                lines_to_skip -= len(line_ends) - i
+                i = len(line_ends)
+
+    # The last line of the file may have no line end
+    if lines_to_skip == 1 and buffer[last_line_end + 1:size].strip():
+        ends.append(size)
+    elif len(starts) > len(ends):
+        print(f"The last frame is incomplete and is ignored (offset {starts[-1]}).")
+        starts.pop()
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+def parse_frame(data: bytes) -> XyzFrame:
+    """Parses the text of one xyz frame.
+
+    Args:
+        data (bytes): Text of the frame, starting with the number of atoms
+
+    Returns:
+        XyzFrame: Comment, species (strings) and coordinates (Angstrom, shape (n, 3))
+    """
+    lines = data.decode().splitlines()
+    number_atoms = int(lines[0].split()[0])
+    columns = [line.split() for line in lines[2:2 + number_atoms]]
+    species = np.array([column[0] for column in columns])
+    coordinates = np.array([column[1:4] for column in columns], dtype=float).reshape(number_atoms, 3)
+    return XyzFrame(lines[1].strip(), species, coordinates)
+
+class XyzTrajectory:
+    """Random access to the frames of a (multi-frame) xyz file through a byte offset index.
+
+    The file is memory mapped, so only the frames which are accessed are read from disk.
+    """
+
+    def __init__(self, xyz_file: str):
+        self.xyz_file = xyz_file
+        # An empty file cannot be mapped into memory
+        if os.path.getsize(xyz_file) == 0:
+            raise ValueError(f"{xyz_file} is empty.")
+        self.file = open(xyz_file, 'rb')
+        try:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.file.close()
+            raise
+        try:
+            self.starts, self.ends = build_frame_index(self.buffer)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self) -> 'XyzTrajectory':
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def close(self) -> None:
+        """Closes the memory map and the file."""
+        self.buffer.close()
+        self.file.close()
+
+    def frame_bytes(self, index: int) -> bytes:
+        """Returns the unparsed text of a frame.
+
+        Args:
+            index (int): Number of the frame (0 is the first frame, negative numbers count from the end)
+
+        Returns:
+            bytes: Text of the frame including its line ends
+        """
+        return self.buffer[self.starts[index]:self.ends[index]]
+
+    def frame(self, index: int) -> XyzFrame:
+        """Reads a single frame.
+
+        Args:
+            index (int): Number of the frame (0 is the first frame, negative numbers count from the end)
+
+        Returns:
+            XyzFrame: Comment, species and coordinates of the frame
+        """
+        return parse_frame(self.frame_bytes(index))
+
+    def frames(self, indices: Optional[Iterable[int]] = None) -> Iterator[XyzFrame]:
+        """Iterates over frames.
+
+        Args:
+            indices (Optional[Iterable[int]]): Numbers of the frames (None: all frames)
+
+        Returns:
+            Iterator[XyzFrame]: Frames in the order of the indices
+        """
+        for index in (range(0, len(self)) if indices is None else indices):
+            yield self.frame(index)
+
+    def elements(self, indices: Optional[Iterable[int]] = None) -> List[str]:
+        """Finds all different elements of some frames.
+
+        Args:
+            indices (Optional[Iterable[int]]): Numbers of the frames (None: first frame)
+
+        Returns:
+            List[str]: Every element once, in the order of the first appearance
+        """
+        seen = set()
+        elements = []
+        for frame in self.frames([0] if indices is None else indices):
+            for element in frame.species:
+                if element not in seen:
+                    seen.add(element)
+                    elements.append(str(element))
+        return elements
+
+    def write_frame(self, index: int, xyz_file: str) -> None:
+        """Writes a single frame as a xyz file (the text is copied unchanged).
+
+        Args:
+            index (int): Number of the frame
+            xyz_file (str): Name of the new xyz file
+
+        Returns:
+            None: Writes the xyz file
+        """
+        with open(xyz_file, 'wb') as file:
+            file.write(self.frame_bytes(index))
+
+if __name__ == '__main__':
+
+    # Check, if enough elements are present
+    if len(sys.argv) not in (2, 3):
+        print(f"Usage: python3 {sys.argv[0]} XyzFile [Frame]")
+        exit()
+
+    with XyzTrajectory(sys.argv[1]) as trajectory:
+        print(f"{sys.argv[1]}: {len(trajectory)} frames, elements {' '.join(trajectory.elements())}")
+        if len(sys.argv) == 3:
+            frame_file = f"{os.path.splitext(os.path.basename(sys.argv[1]))[0]}_frame_{sys.argv[2]}.xyz"
+            trajectory.write_frame(int(sys.argv[2]), frame_file)
+            print(f"Frame {sys.argv[2]} written to {frame_file}.")